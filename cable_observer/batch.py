@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ROS-free offline processing of recorded frame sequences on a process pool.
+
+RGB and depth streams are given separately, each one as a directory of images (sorted by
+name), a video file, an npy/npz stack (N, H, W[, C]) or a recording (see `recording`, the
+same directory for both streams). Sequence is split into chunks
+processed by worker processes, every worker compiles (or loads cached) kernels once.
+Splines are written to memory-mapped arrays in the output directory:
+    splines.npy - float64 (N, num_of_cables, 3, num_of_pts), NaN without a spline,
+    instances.npy - int64 (N, num_of_cables), instance ids, -1 without a spline,
+    summary.json - parameters and timings.
+
+Example:
+    python3 -m cable_observer.batch --rgb rec/rgb.mp4 --depth rec/depth.npy --output out \
+        --workers 8 --param hsv_ranges=[170,100,100,10,255,255]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import numpy.typing as npt
+
+try:
+    from cable_observer import CableObserver
+    from benchmark import DEFAULT_PARAMETERS, parameter
+    from recording import RECORDING_META, Replay
+except ImportError:
+    from cable_observer.cable_observer import CableObserver
+    from cable_observer.benchmark import DEFAULT_PARAMETERS, parameter
+    from cable_observer.recording import RECORDING_META, Replay
+
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".exr")
+NPZ_KEYS = {"rgb": "rgb", "depth": "depth"}  # default keys of streams in npz stacks
+
+
+class FrameSequence:
+    """
+    Frames of a single stream: directory of images, video file, npy/npz stack or recording.
+
+    npy stacks are memory-mapped, npz stacks are loaded whole (prefer npy for long sequences).
+    """
+
+    def __init__(self, path: str, key: Optional[str] = None) -> None:
+        self._path = path
+        self._key = key
+        self._files = None
+        self._stack = None
+        self._replay = None
+        if os.path.exists(os.path.join(path, RECORDING_META)):
+            self._replay = Replay(path)
+            self._length = len(self._replay)
+        elif os.path.isdir(path):
+            self._files = sorted(os.path.join(path, name) for name in os.listdir(path)
+                                 if name.lower().endswith(IMAGE_EXTENSIONS))
+            self._length = len(self._files)
+        elif path.endswith(".npy"):
+            self._stack = np.load(path, mmap_mode="r")
+            self._length = len(self._stack)
+        elif path.endswith(".npz"):
+            self._stack = np.load(path)[key]
+            self._length = len(self._stack)
+        else:
+            capture = cv2.VideoCapture(path)
+            if not capture.isOpened():
+                raise ValueError(f"Cannot open '{path}' as a video")
+            self._length = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+            capture.release()
+
+    def __len__(self) -> int:
+        return self._length
+
+    def read(self, start: int = 0, stop: Optional[int] = None) -> Iterator[npt.NDArray]:
+        stop = self._length if stop is None else min(stop, self._length)
+        if self._replay is not None:
+            for frame in self._replay.frames(start, stop):
+                yield frame[0 if self._key == NPZ_KEYS["rgb"] else 1]
+        elif self._files is not None:
+            for key in range(start, stop):
+                yield cv2.imread(self._files[key], cv2.IMREAD_UNCHANGED)
+        elif self._stack is not None:
+            for key in range(start, stop):
+                yield np.asarray(self._stack[key])
+        else:
+            capture = cv2.VideoCapture(self._path)
+            capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+            for _ in range(start, stop):
+                is_read, frame = capture.read()
+                if not is_read:
+                    break
+                yield frame
+            capture.release()
+
+
+def read_frames(rgb: str, depth: str, start: int = 0,
+                stop: Optional[int] = None) -> Iterator[Tuple[npt.NDArray[np.uint8], npt.NDArray]]:
+    """
+    Generator of (img, depth) pairs of frames [start, stop) of the recorded streams.
+    """
+    rgb_frames = FrameSequence(rgb, key=NPZ_KEYS["rgb"])
+    depth_frames = FrameSequence(depth, key=NPZ_KEYS["depth"])
+    yield from zip(rgb_frames.read(start, stop), depth_frames.read(start, stop))
+
+
+def track_frames(cable_observer: CableObserver,
+                 frames: Iterator[Tuple[npt.NDArray[np.uint8], npt.NDArray]],
+                 native_depth: bool = False) -> Iterator[Tuple[npt.NDArray[np.float64],
+                                                               npt.NDArray[np.int64]]]:
+    """
+    Generator of (splines (num_of_cables, 3, num_of_pts), instances ids) of consecutive frames.
+    """
+    for img, depth in frames:
+        if not native_depth:
+            depth = depth.astype(np.float64)
+        spline_coords = cable_observer.track(frame=img[..., :3], depth=depth)
+        instances_ids = cable_observer.get_instances_ids()
+        if len(instances_ids) == 0:
+            yield np.empty((0, 3, 0), dtype=np.float64), instances_ids
+            continue
+        yield spline_coords.reshape(len(instances_ids), 3, -1), instances_ids
+
+
+# per-process state of pool workers, kernels are compiled (or loaded) once per worker
+_worker_cable_observer = None
+
+
+def init_worker(parameters: Dict[str, Any]) -> None:
+    global _worker_cable_observer
+    _worker_cable_observer = CableObserver()
+    _worker_cable_observer.set_parameters(**parameters)
+
+
+def process_chunk(rgb: str, depth: str, output: str, start: int, stop: int,
+                  overlap: int, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Track frames [start - overlap, stop) from a fresh state and write [start, stop).
+    """
+    t1 = perf_counter()
+    cable_observer = _worker_cable_observer
+    cable_observer.reset()
+    splines = np.load(os.path.join(output, "splines.npy"), mmap_mode="r+")
+    instances = np.load(os.path.join(output, "instances.npy"), mmap_mode="r+")
+
+    first = max(start - overlap, 0)
+    num_of_frames = 0
+    num_of_empty_frames = 0
+    frames = read_frames(rgb, depth, first, stop)
+    results = track_frames(cable_observer, frames,
+                           native_depth=parameters.get("native_depth", False))
+    for key, (spline_coords, instances_ids) in enumerate(results, start=first):
+        if key < start:
+            continue
+        num_of_frames += 1
+        # the previous spline is returned without a fit, the frame is left NaN
+        empty = "fit_spline" not in cable_observer.get_stamps()
+        num_of_empty_frames += empty
+        if not empty and len(instances_ids) > 0:
+            splines[key, :len(instances_ids)] = spline_coords
+            instances[key, :len(instances_ids)] = instances_ids
+    splines.flush()
+    instances.flush()
+
+    return {"start": start, "stop": stop, "frames": num_of_frames,
+            "empty_frames": num_of_empty_frames, "time": (perf_counter() - t1) * 1000}
+
+
+def align_chunks(splines: npt.NDArray[np.float64], starts: List[int]) -> None:
+    """
+    Flip single cable splines of chunks, so the direction is consistent with the previous chunk.
+    """
+    # chunks are aligned in order, the previous one is already consistent
+    stops = starts[1:] + [len(splines)]
+    for start, stop in zip(starts[1:], stops[1:]):
+        previous, current = splines[start - 1, 0], splines[start, 0]
+        if np.isnan(previous).any() or np.isnan(current).any():
+            continue
+        diff = np.linalg.norm(current - previous)
+        diff_inv = np.linalg.norm(current[:, ::-1] - previous)
+        if diff_inv < diff:
+            splines[start:stop] = splines[start:stop, :, :, ::-1]
+
+
+def process_sequence(rgb: str, depth: str, output: str, parameters: Dict[str, Any], *,
+                     num_of_workers: int = 0, chunk_size: int = 500,
+                     overlap: int = 10) -> Dict[str, Any]:
+    """
+    Track the whole recorded sequence on a process pool, results are written to `output`.
+    """
+    t1 = perf_counter()
+    num_of_workers = num_of_workers or os.cpu_count()
+    parameters = dict(parameters)
+    # numba threads of workers share cores
+    parameters.setdefault("num_threads", max(1, os.cpu_count() // num_of_workers))
+    num_of_frames = min(len(FrameSequence(rgb, key=NPZ_KEYS["rgb"])),
+                        len(FrameSequence(depth, key=NPZ_KEYS["depth"])))
+    num_of_cables = parameters.get("num_of_cables", 1)
+    num_of_pts = parameters.get("num_of_pts", 256)
+
+    os.makedirs(output, exist_ok=True)
+    splines = np.lib.format.open_memmap(
+        os.path.join(output, "splines.npy"), mode="w+", dtype=np.float64,
+        shape=(num_of_frames, num_of_cables, 3, num_of_pts))
+    splines[:] = np.nan
+    splines.flush()
+    instances = np.lib.format.open_memmap(
+        os.path.join(output, "instances.npy"), mode="w+", dtype=np.int64,
+        shape=(num_of_frames, num_of_cables))
+    instances[:] = -1
+    instances.flush()
+
+    # spawned workers do not inherit numba threads or opened captures of this process
+    starts = list(range(0, num_of_frames, chunk_size))
+    chunks = []
+    with ProcessPoolExecutor(max_workers=num_of_workers,
+                             mp_context=multiprocessing.get_context("spawn"),
+                             initializer=init_worker, initargs=(parameters,)) as executor:
+        futures = [executor.submit(process_chunk, rgb, depth, output, start,
+                                   min(start + chunk_size, num_of_frames), overlap, parameters)
+                   for start in starts]
+        for future in as_completed(futures):
+            chunks.append(future.result())
+            sys.stderr.write(f"frames {sum(chunk['frames'] for chunk in chunks)}/"
+                             f"{num_of_frames}\n")
+
+    # instance ids are per chunk in multi-cable mode, chunks are not aligned
+    if num_of_cables == 1:
+        align_chunks(splines=splines, starts=starts)
+        splines.flush()
+
+    t2 = perf_counter()
+    summary = {
+        "rgb": rgb,
+        "depth": depth,
+        "parameters": parameters,
+        "workers": num_of_workers,
+        "chunk_size": chunk_size,
+        "overlap": overlap,
+        "frames": num_of_frames,
+        "empty_frames": sum(chunk["empty_frames"] for chunk in chunks),
+        "time": (t2 - t1) * 1000,
+        "fps": num_of_frames / (t2 - t1),
+        "chunks": sorted(chunks, key=lambda chunk: chunk["start"]),
+    }
+    with open(os.path.join(output, "summary.json"), "w") as f:
+        f.write(json.dumps(summary, indent=2) + "\n")
+    return summary
+
+
+def main(args=None) -> None:
+    parser = argparse.ArgumentParser(description="Track cables in recorded frame sequences.")
+    parser.add_argument("--rgb", type=str, required=True,
+                        help="Directory of images, video file or npy/npz (key 'rgb') stack.")
+    parser.add_argument("--depth", type=str, required=True,
+                        help="Directory of images, video file or npy/npz (key 'depth') stack.")
+    parser.add_argument("--output", type=str, required=True, help="Output directory.")
+    parser.add_argument("--workers", type=int, default=0, help="Worker processes (0 - all cores).")
+    parser.add_argument("--chunk", type=int, default=500, help="Frames per chunk.")
+    parser.add_argument("--overlap", type=int, default=10,
+                        help="Frames tracked before a chunk to restore tracking state.")
+    parser.add_argument("--param", type=parameter, action="append", default=[],
+                        help="CableObserver parameter as key=json_value, e.g. num_of_knots=15.")
+    args = parser.parse_args(args)
+
+    parameters = dict(DEFAULT_PARAMETERS)
+    parameters.update(dict(args.param))
+    summary = process_sequence(args.rgb, args.depth, args.output, parameters,
+                               num_of_workers=args.workers, chunk_size=args.chunk,
+                               overlap=args.overlap)
+    sys.stdout.write(f"{summary['frames']} frames, {summary['fps']:.1f} fps\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ROS-free benchmark of the tracking pipeline on synthetic frames.
+
+Example:
+    python3 -m cable_observer.benchmark --resolutions 640x480 1920x1080 --fragments 1 8 \
+        --noise 0 16 --frames 100 --output bench.json
+"""
+
+import argparse
+import itertools
+import json
+import platform
+import sys
+from time import perf_counter
+from typing import Any, Dict, List
+
+import numba
+import numpy as np
+import numpy.typing as npt
+
+try:
+    from cable_observer import CableObserver
+    from utils.synthetic import SyntheticCable
+except ImportError:
+    from cable_observer.cable_observer import CableObserver
+    from cable_observer.utils.synthetic import SyntheticCable
+
+
+DEFAULT_PARAMETERS = {
+    "depth_ranges": [200, 900],
+    "depth_scale": 0.001,
+    "hsv_ranges": [170, 100, 100, 10, 255, 255],
+}
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    samples = np.array(samples, dtype=np.float64)
+    return {
+        "mean": float(samples.mean()),
+        "p50": float(np.percentile(samples, 50)),
+        "p99": float(np.percentile(samples, 99)),
+    }
+
+
+def depth_dtype(parameters: Dict[str, Any]) -> np.dtype:
+    # node passes 16UC1 depth without conversion in native_depth mode
+    return np.uint16 if parameters.get("native_depth", False) else np.float64
+
+
+def spline_error(spline_coords: npt.NDArray[np.float64],
+                 coords: npt.NDArray[np.float64]) -> float:
+    """
+    Mean distance [px] from 2D spline points to the closest sample of the ground truth curve.
+    """
+    spline_coords_2d = spline_coords.reshape(-1, 3, spline_coords.shape[-1])[:, :2]
+    spline_coords_2d = spline_coords_2d.transpose(0, 2, 1).reshape(-1, 1, 2)
+    dists = np.linalg.norm(spline_coords_2d - coords[:2].T[np.newaxis], axis=-1)
+    return float(dists.min(axis=1).mean())
+
+
+def depth_error(spline_coords: npt.NDArray[np.float64],
+                coords: npt.NDArray[np.float64]) -> float:
+    """
+    Mean depth difference [m] between spline points and the closest (2D) ground truth sample.
+    """
+    spline_coords = spline_coords.reshape(-1, 3, spline_coords.shape[-1]).transpose(0, 2, 1)
+    spline_coords = spline_coords.reshape(-1, 3)
+    dists = np.linalg.norm(spline_coords[:, np.newaxis, :2] - coords[:2].T[np.newaxis], axis=-1)
+    return float(np.abs(spline_coords[:, 2] - coords[2, dists.argmin(axis=1)]).mean())
+
+
+def run_scenario(*, width: int, height: int, num_of_fragments: int, noise: float,
+                 holes: float, num_of_frames: int, num_of_warmup_frames: int, seed: int,
+                 parameters: Dict[str, Any]) -> Dict[str, Any]:
+    cable_observer = CableObserver()
+    cable_observer.set_parameters(**parameters)
+    cable = SyntheticCable(width=width, height=height, num_of_fragments=num_of_fragments,
+                           noise=noise, holes=holes, depth_scale=parameters["depth_scale"],
+                           depth_dtype=depth_dtype(parameters), seed=seed)
+    frames = list(cable.sequence(num_of_warmup_frames + num_of_frames))
+
+    warmup = []
+    stages = {}
+    errors = []
+    depth_errors = []
+    quality_levels = []
+    empty_frames = 0
+    for key, (img, depth, coords) in enumerate(frames):
+        spline_coords = cable_observer.track(frame=img, depth=depth)
+        stamps = cable_observer.get_stamps()
+        if key < num_of_warmup_frames:
+            warmup.append(stamps)
+            continue
+        quality_levels.append(cable_observer.get_quality_level())
+        if "fit_spline" not in stamps:
+            empty_frames += 1
+        else:
+            errors.append(spline_error(spline_coords=spline_coords, coords=coords))
+            depth_errors.append(depth_error(spline_coords=spline_coords, coords=coords) * 1000)
+        for stage, value in stamps.items():
+            stages.setdefault(stage, []).append(value)
+
+    total = summarize(stages["total"])
+    return {
+        "resolution": [width, height],
+        "fragments": num_of_fragments,
+        "noise": noise,
+        "holes": holes,
+        "frames": num_of_frames,
+        "empty_frames": empty_frames,
+        "warmup": warmup,
+        "stages": {stage: summarize(values) for stage, values in stages.items()},
+        "error": summarize(errors) if errors else None,
+        "depth_error": summarize(depth_errors) if depth_errors else None,  # mm
+        # number of frames produced at every quality level, see latency_budget
+        "quality_levels": np.bincount(quality_levels).tolist(),
+        "fps": 1000.0 / total["mean"],
+    }
+
+
+def resolution(value: str) -> List[int]:
+    width, height = value.lower().split("x")
+    return [int(width), int(height)]
+
+
+def parameter(value: str) -> List[Any]:
+    key, raw = value.split("=", 1)
+    return [key, json.loads(raw)]
+
+
+def main(args=None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark cable observer on synthetic frames.")
+    parser.add_argument("--resolutions", type=resolution, nargs="+",
+                        default=[[640, 480], [1280, 720], [1920, 1080]])
+    parser.add_argument("--fragments", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--noise", type=float, nargs="+", default=[0.0, 16.0])
+    parser.add_argument("--holes", type=float, default=0.0,
+                        help="Fraction of depth pixels without data.")
+    parser.add_argument("--frames", type=int, default=50, help="Steady state frames.")
+    parser.add_argument("--warmup", type=int, default=1, help="Warmup frames per scenario.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--param", type=parameter, action="append", default=[],
+                        help="CableObserver parameter as key=json_value, e.g. num_of_knots=15.")
+    parser.add_argument("--output", type=str, default="-", help="Output JSON file (- for stdout).")
+    args = parser.parse_args(args)
+
+    parameters = dict(DEFAULT_PARAMETERS)
+    parameters.update(dict(args.param))
+
+    # numba compiles (or loads cached kernels) during warmup in set_parameters,
+    # measure it and the first frame before any scenario
+    t1 = perf_counter()
+    cable_observer = CableObserver()
+    cable_observer.set_parameters(**parameters)
+    t2 = perf_counter()
+    img, depth, _ = SyntheticCable(depth_scale=parameters["depth_scale"],
+                                   depth_dtype=depth_dtype(parameters), seed=args.seed).render()
+    cable_observer.track(frame=img, depth=depth)
+    t3 = perf_counter()
+
+    scenarios = []
+    for (width, height), num_of_fragments, noise in itertools.product(
+            args.resolutions, args.fragments, args.noise):
+        scenarios.append(run_scenario(
+            width=width, height=height, num_of_fragments=num_of_fragments, noise=noise,
+            holes=args.holes, num_of_frames=args.frames, num_of_warmup_frames=args.warmup,
+            seed=args.seed, parameters=parameters))
+
+    report = {
+        "platform": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "numpy": np.__version__,
+            "numba": numba.__version__,
+        },
+        "parameters": parameters,
+        "jit_warmup": {
+            "set_parameters": (t2 - t1) * 1000,
+            "warmup": cable_observer.get_warmup_time(),
+            "first_frame": (t3 - t2) * 1000,
+            "stages": cable_observer.get_stamps(),
+            "total": (t3 - t1) * 1000,
+        },
+        "scenarios": scenarios,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output == "-":
+        sys.stdout.write(output + "\n")
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == '__main__':
+    main()
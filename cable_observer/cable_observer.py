@@ -15,15 +15,47 @@
 # limitations under the License.
 
 from time import perf_counter
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+import numpy.typing as npt
 
 try:
     # from utils.frame_2d import Frame2D
     from utils.frame_3d import Frame3D
     from utils.deformable_linear_object import DeformableLinearObject
+    from utils.metrics import Metrics
+    from utils.multi_deformable_linear_object import MultiDeformableLinearObject
+    from utils.quality_scheduler import QualityScheduler
+    from utils.synthetic import SyntheticCable
+    from utils.trace import TraceRecorder
 except ImportError:
     # from cable_observer.utils.frame_2d import Frame2D
     from cable_observer.utils.frame_3d import Frame3D
     from cable_observer.utils.deformable_linear_object import DeformableLinearObject
+    from cable_observer.utils.metrics import Metrics
+    from cable_observer.utils.multi_deformable_linear_object import MultiDeformableLinearObject
+    from cable_observer.utils.quality_scheduler import QualityScheduler
+    from cable_observer.utils.synthetic import SyntheticCable
+    from cable_observer.utils.trace import TraceRecorder
+
+
+WARMUP_SHAPE = (120, 160)  # (height, width) of synthetic warmup frames
+MIN_NUM_OF_KNOTS = 8  # lowest number of knots of degraded quality levels
+DEBUG_PERIOD = 1.0  # s, between metrics printed in debug mode
+# parameters applied in place by update_parameters, grouped by the state depending on them
+FRAME_PARAMETERS = {"depth_ranges", "depth_scale", "fused", "hsv_ranges", "mask_backend",
+                    "native_depth", "num_threads", "skeleton_backend", "z_vertical_shift"}
+DLO_PARAMETERS = {"association_radius", "depth_median_window", "min_length", "num_of_pts",
+                  "path_extractor", "spline_fitter", "vector_dir_len", "z_vertical_shift"}
+QUALITY_PARAMETERS = {"downscale", "incremental_order", "latency_budget", "num_of_knots",
+                      "refine"}
+TRACE_PARAMETERS = {"trace_directory", "trace_frames", "trace_threshold"}
+# other kernels (or the mask lookup table) are needed, they are warmed up before the next frame
+WARMUP_PARAMETERS = {"downscale", "fused", "hsv_ranges", "latency_budget", "mask_backend",
+                     "native_depth", "path_extractor", "refine", "skeleton_backend",
+                     "spline_fitter"}
 
 
 class CableObserver:
@@ -42,46 +74,354 @@ class CableObserver:
     def __init__(self) -> None:
         self._frame3d = None
         self._dlo = None
+        self._quality_levels = []
+        self._quality_level = 0
+        self._quality_scheduler = None
+        self._tracking_metrics = None
+        self._trace_recorder = None
+        self._debug_time = 0.0
+        self._stamps = {}
+        self._warmup_time = 0.0
 
+        self._association_radius = 40.0
         self._debug = False
         self._depth_ranges = [0, 10000]
+        self._depth_median_window = 0
         self._depth_scale = 0.001
+        self._downscale = 1
+        self._fused = False
         self._hsv_ranges = [0, 0, 0, 179, 255, 255]
+        self._incremental_order = False
+        self._latency_budget = 0.0
+        self._mask_backend = "hsv"
+        self._metrics = False
         self._min_length = 10
+        self._native_depth = False
+        self._num_of_cables = 1
         self._num_of_knots = 25
         self._num_of_pts = 256
+        self._num_threads = 0
+        self._path_extractor = "walk"
+        self._refine = False
+        self._roi_padding = 50
+        self._roi_tracking = False
+        self._skeleton_backend = "lee"
+        self._spline_fitter = "scipy"
+        self._trace_directory = "."
+        self._trace_frames = 0
+        self._trace_threshold = 0.0
         self._vector_dir_len = 5
+        self._warmup = True
         self._z_vertical_shift = 0
 
     def get_mask(self):
         return self._frame3d.mask * 255
 
+    def get_instances_ids(self) -> npt.NDArray[np.int64]:
+        """
+        Ids of the cables returned by `track`, in multi-cable mode splines are stacked in
+        this order. Single cable has id 0.
+        """
+        if isinstance(self._dlo, MultiDeformableLinearObject):
+            return self._dlo.instances_ids
+        return np.zeros(min(len(self._dlo.spline_coords_3d), 1), dtype=np.int64)
+
+    def get_stamps(self) -> Dict[str, float]:
+        return self._stamps
+
+    def get_metrics(self) -> Optional[Metrics]:
+        """
+        Rolling per-stage and per-frame statistics, None unless `metrics` (or `debug`) is on.
+        """
+        return self._tracking_metrics
+
+    def get_trace_recorder(self) -> Optional[TraceRecorder]:
+        """
+        Ring buffer of stage spans of the last `trace_frames` frames, None if tracing is off.
+        """
+        return self._trace_recorder
+
+    def get_quality_level(self) -> int:
+        """
+        Quality level (index of `get_quality_levels`) the last output was produced at.
+        """
+        return self._quality_level
+
+    def get_warmup_time(self) -> float:
+        return self._warmup_time
+
     def set_parameters(self, **kwargs) -> None:
         for arg in kwargs:
             if hasattr(self, "_" + arg):
                 setattr(self, "_" + arg, kwargs[arg])
 
-        self._frame3d = Frame3D(hsv_ranges=self._hsv_ranges,
-                                depth_ranges=self._depth_ranges, depth_scale=self._depth_scale)
-        self._dlo = DeformableLinearObject(num_of_knots=self._num_of_knots,
-                                           num_of_pts=self._num_of_pts,
-                                           vector_dir_len=self._vector_dir_len,
-                                           z_vertical_shift=self._z_vertical_shift)
+        self.reset()
+        if self._warmup:
+            self.warmup()
+
+    def update_parameters(self, **kwargs) -> List[str]:
+        """
+        Apply parameters between frames without dropping tracking state (previous splines).
+        Settings are changed in place and only state depending on them is rebuilt, e.g.
+        quality levels on quality settings or the trace buffer on trace settings. Changing
+        `num_of_cables` resets tracking, turning `warmup` on warms the pipeline up. Invalid
+        values raise ValueError and leave all parameters unchanged. Returns names of changed
+        parameters.
+        """
+        previous = {arg: getattr(self, "_" + arg) for arg in kwargs if hasattr(self, "_" + arg)}
+        changed = sorted(arg for arg in previous
+                         if not np.array_equal(kwargs[arg], previous[arg]))
+        for arg in changed:
+            setattr(self, "_" + arg, kwargs[arg])
+        try:
+            # the new combination is validated before anything is applied
+            self.check_parameters()
+        except ValueError:
+            for arg, value in previous.items():
+                setattr(self, "_" + arg, value)
+            raise
+
+        is_reset = self._dlo is None or "num_of_cables" in changed
+        if is_reset:
+            self.reset()
+        else:
+            self.apply_parameters(changed)
+        if self._warmup and (is_reset or "warmup" in changed or
+                             not WARMUP_PARAMETERS.isdisjoint(changed)):
+            self.warmup()
+        return changed
+
+    def check_parameters(self) -> None:
+        """
+        Raise ValueError if current parameters are invalid, nothing is built or applied.
+        """
+        Frame3D.check_backends(mask_backend=self._mask_backend,
+                               skeleton_backend=self._skeleton_backend)
+        Frame3D.check_downscale(downscale=self._downscale)
+        DeformableLinearObject.check_parameters(path_extractor=self._path_extractor,
+                                                spline_fitter=self._spline_fitter,
+                                                depth_median_window=self._depth_median_window)
+
+    def apply_parameters(self, changed: List[str]) -> None:
+        """
+        Pass changed parameters to the tracking pipeline in place.
+        """
+        if not FRAME_PARAMETERS.isdisjoint(changed):
+            self._frame3d.set_parameters(**self.get_frame_parameters())
+        if not DLO_PARAMETERS.isdisjoint(changed):
+            dlo_parameters = self.get_dlo_parameters()
+            if isinstance(self._dlo, MultiDeformableLinearObject):
+                dlo_parameters["association_radius"] = self._association_radius
+            self._dlo.set_parameters(**dlo_parameters)
+        if not QUALITY_PARAMETERS.isdisjoint(changed):
+            self.reset_quality()
+        if "debug" in changed or "metrics" in changed:
+            if not (self._metrics or self._debug):
+                self._tracking_metrics = None
+            elif self._tracking_metrics is None:
+                self._tracking_metrics = Metrics()
+        if not TRACE_PARAMETERS.isdisjoint(changed):
+            self._trace_recorder = self.create_trace_recorder()
+
+    def reset(self) -> None:
+        """
+        Drop tracking state (previous splines), e.g. at the start of an independent sequence.
+        """
+        self.close_pipeline(dlo=self._dlo)
+        self._frame3d, self._dlo = self.create_pipeline()
+        self.reset_quality()
+        self._tracking_metrics = Metrics() if self._metrics or self._debug else None
+        self._trace_recorder = self.create_trace_recorder()
+
+    def reset_quality(self) -> None:
+        """
+        Quality levels of current parameters, tracking restarts at the configured level.
+        """
+        self._quality_levels = self.get_quality_levels()
+        self._quality_level = 0
+        self._quality_scheduler = QualityScheduler(budget=self._latency_budget,
+                                                   num_of_levels=len(self._quality_levels))
+        self.set_quality(frame3d=self._frame3d, dlo=self._dlo, quality=self._quality_levels[0])
+
+    def create_trace_recorder(self) -> Optional[TraceRecorder]:
+        if self._trace_frames <= 0:
+            return None
+        return TraceRecorder(capacity=self._trace_frames, threshold=self._trace_threshold,
+                             directory=self._trace_directory)
+
+    def create_pipeline(self) -> Tuple[Frame3D, Union[DeformableLinearObject,
+                                                      MultiDeformableLinearObject]]:
+        frame3d = Frame3D(**self.get_frame_parameters(),
+                          downscale=self._downscale, refine=self._refine)
+        dlo_kwargs = self.get_dlo_parameters() | dict(num_of_knots=self._num_of_knots,
+                                                      incremental_order=self._incremental_order)
+        if self._num_of_cables > 1:
+            dlo = MultiDeformableLinearObject(num_of_cables=self._num_of_cables,
+                                              association_radius=self._association_radius,
+                                              **dlo_kwargs)
+        else:
+            dlo = DeformableLinearObject(**dlo_kwargs)
+        return frame3d, dlo
+
+    @staticmethod
+    def close_pipeline(dlo: Optional[Union[DeformableLinearObject,
+                                           MultiDeformableLinearObject]]) -> None:
+        # threads of discarded multi-cable trackers are stopped
+        if isinstance(dlo, MultiDeformableLinearObject):
+            dlo.close()
+
+    def get_frame_parameters(self) -> Dict[str, Any]:
+        return dict(hsv_ranges=self._hsv_ranges,
+                    depth_ranges=self._depth_ranges, depth_scale=self._depth_scale,
+                    roi_guard=abs(self._z_vertical_shift),
+                    mask_backend=self._mask_backend, fused=self._fused,
+                    num_threads=self._num_threads,
+                    skeleton_backend=self._skeleton_backend,
+                    native_depth=self._native_depth)
+
+    def get_dlo_parameters(self) -> Dict[str, Any]:
+        return dict(min_length=self._min_length,
+                    num_of_pts=self._num_of_pts,
+                    vector_dir_len=self._vector_dir_len,
+                    z_vertical_shift=self._z_vertical_shift,
+                    path_extractor=self._path_extractor,
+                    spline_fitter=self._spline_fitter,
+                    depth_median_window=self._depth_median_window)
+
+    def get_quality_levels(self) -> List[Dict[str, Any]]:
+        """
+        Settings of quality levels from the configured one (0) to the cheapest one, every
+        level degrades the previous one by a step. Only level 0 without `latency_budget`.
+        """
+        quality = dict(incremental_order=self._incremental_order,
+                       num_of_knots=self._num_of_knots, downscale=self._downscale,
+                       refine=self._refine, morphology=True)
+        levels = [quality]
+        if self._latency_budget <= 0:
+            return levels
+
+        steps = [
+            dict(incremental_order=True),
+            dict(num_of_knots=min(self._num_of_knots,
+                                  max(MIN_NUM_OF_KNOTS, self._num_of_knots // 2))),
+            dict(downscale=min(2 * self._downscale, 4), refine=True),
+            dict(morphology=False),
+            dict(downscale=4, refine=True),
+        ]
+        for step in steps:
+            quality = quality | step
+            if quality != levels[-1]:
+                levels.append(quality)
+        return levels
+
+    @staticmethod
+    def set_quality(frame3d: Frame3D, dlo: Union[DeformableLinearObject,
+                                                 MultiDeformableLinearObject],
+                    quality: Dict[str, Any]) -> None:
+        frame3d.set_quality(downscale=quality["downscale"], refine=quality["refine"],
+                            morphology=quality["morphology"])
+        dlo.set_quality(num_of_knots=quality["num_of_knots"],
+                        incremental_order=quality["incremental_order"])
+
+    def warmup(self) -> float:
+        """
+        Run the pipeline on synthetic frames matching current parameters, so numba kernels
+        are compiled (or loaded from the on-disk cache) before the first real frame.
+        Tracking state is not touched. Returns the duration in ms.
+        """
+        t1 = perf_counter()
+        # the cheapest quality level covers kernels of the degraded ones
+        for quality in self._quality_levels[:1] + self._quality_levels[1:][-1:]:
+            frame3d, dlo = self.create_pipeline()
+            self.set_quality(frame3d=frame3d, dlo=dlo, quality=quality)
+            img, depth = self.get_warmup_frame(frame3d=frame3d, downscale=quality["downscale"])
+            # the second frame is compared with the previous spline and goes through a tracking
+            # window (strided views), if enabled
+            window = (1, 1, img.shape[1] - 2, img.shape[0] - 2) if self._roi_tracking else None
+            for window in [None, window]:
+                frame3d.execute(img=img, depth=depth, window=window)
+                dlo.execute(frame=frame3d)
+            self.close_pipeline(dlo=dlo)
+        self._warmup_time = (perf_counter() - t1) * 1000
+        return self._warmup_time
+
+    def get_warmup_frame(self, frame3d: Frame3D,
+                         downscale: int = 1) -> Tuple[npt.NDArray[np.uint8],
+                                                      npt.NDArray[np.float64]]:
+        h_min, s_min, v_min, h_max, s_max, v_max = self._hsv_ranges
+        h = (h_min + h_max) // 2 if h_min <= h_max else ((h_min + h_max + 180) // 2) % 180
+        hsv = np.array([[[h, (s_min + s_max) // 2, (v_min + v_max) // 2]]], dtype=np.uint8)
+        cable_bgr = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)[0, 0]
+        # first candidate outside of hsv_ranges becomes the background
+        candidates = np.array([[[0, 0, 0], [255, 255, 255], [128, 128, 128], 255 - cable_bgr]],
+                              dtype=np.uint8)
+        background_bgr = candidates[0, np.argmin(frame3d.threshold(candidates)[0])]
+        depth_min, depth_max = self._depth_ranges
+        # the cable has to stay a few pixels thick at the processing resolution
+        cable = SyntheticCable(
+            width=WARMUP_SHAPE[1] * downscale, height=WARMUP_SHAPE[0] * downscale,
+            num_of_fragments=3, thickness=3 * downscale, cable_bgr=cable_bgr,
+            background_bgr=background_bgr,
+            cable_depth=((depth_min + depth_max) / 2, (depth_max - depth_min) / 4),
+            background_depth=2 * depth_max + 1,
+            depth_dtype=np.uint16 if self._native_depth else np.float64)
+        img, depth, _ = cable.render()
+        return img, depth
 
     def track(self, frame, depth):
         t1 = perf_counter()
-        stamps = self._frame3d.execute(img=frame, depth=depth)
+        if self._quality_scheduler.level != self._quality_level:
+            self._quality_level = self._quality_scheduler.level
+            self.set_quality(frame3d=self._frame3d, dlo=self._dlo,
+                             quality=self._quality_levels[self._quality_level])
+        window = None
+        if self._roi_tracking:
+            window = self._dlo.predict_window(shape=frame.shape[:2], padding=self._roi_padding)
+        stamps = self._frame3d.execute(img=frame, depth=depth, window=window)
         stamps_dlo = self._dlo.execute(frame=self._frame3d)
         t2 = perf_counter()
 
         if stamps_dlo is not None:
             stamps |= stamps_dlo
+        stamps["total"] = (t2 - t1) * 1000
+        self._stamps = stamps
+        self._quality_scheduler.update(stamps["total"])
 
-        if self._debug:
-            output = ""
-            for key in stamps.keys():
-                output += f"{key}: {stamps[key]:.3f} ms\t"
-            output += f"Total: {(t2 - t1) * 1000:.3f} ms"
+        if self._tracking_metrics is not None:
+            # skeleton is checked only for empty frames, inside of the mask bounding rect
+            is_skeleton_empty = False
+            if stamps_dlo is None:
+                x, y, w, h = self._frame3d.mask_roi_coords
+                is_skeleton_empty = not self._frame3d.skeleton[y:y + h, x:x + w].any()
+            self._tracking_metrics.record(stamps, is_empty=stamps_dlo is None,
+                                          is_skeleton_empty=is_skeleton_empty, timestamp=t2)
+
+        if self._trace_recorder is not None:
+            self._trace_recorder.record(start=t1, stamps=stamps, dlo_stages=stamps_dlo or {},
+                                        metadata=self.get_trace_metadata())
+
+        if self._debug and t2 - self._debug_time >= DEBUG_PERIOD:
+            self._debug_time = t2
+            output = self._tracking_metrics.format()
+            if self._latency_budget > 0:
+                output += f"\nquality level: {self._quality_level}"
             print(output)
 
         return self._dlo.spline_coords_3d
+
+    def get_trace_metadata(self) -> Dict[str, Any]:
+        """
+        Scene content of the last frame, window and skeleton in processing coordinates.
+        """
+        x, y, w, h = self._frame3d.mask_roi_coords
+        height, width = self._frame3d.mask.shape[:2]
+        roi = self._frame3d.window or (0, 0, width, height)
+        return {
+            "quality_level": self._quality_level,
+            "downscale": self._frame3d.downscale,
+            "roi": list(roi),
+            "roi_size": roi[2] * roi[3],
+            "skeleton_pixels": int(np.count_nonzero(self._frame3d.skeleton[y:y + h, x:x + w])),
+            "fragments": self._dlo.num_of_fragments,
+            "cables": len(self.get_instances_ids()),
+        }
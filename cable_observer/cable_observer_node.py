@@ -14,41 +14,109 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import array
+import os
+import threading
+import time
+from time import perf_counter
+from typing import Callable, List, Optional, Tuple
+
 import numpy as np
 import numpy.typing as npt
 import rclpy
 from cv_bridge import CvBridge
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
 from geometry_msgs.msg import Point
 from message_filters import ApproximateTimeSynchronizer, Subscriber
+from rcl_interfaces.msg import SetParametersResult
 from rclpy.node import Node
-from sensor_msgs.msg import Image, CameraInfo, PointCloud2
-from sensor_msgs_py.point_cloud2 import create_cloud_xyz32
-from visualization_msgs.msg import Marker
+from rclpy.parameter import Parameter
+from rclpy.time import Time
+from sensor_msgs.msg import Image, CameraInfo, PointCloud2, PointField
+from std_msgs.msg import Float64, Header, UInt8, UInt64
+from std_srvs.srv import Trigger
+from visualization_msgs.msg import Marker, MarkerArray
 
 try:
     from cable_observer.cable_observer import CableObserver
+    from cable_observer.recording import Recorder
+    from cable_observer.utils.latest_slot import LatestSlot
 except Exception:
     from cable_observer import CableObserver
+    from recording import Recorder
+    from utils.latest_slot import LatestSlot
+
+
+CLOUD_FIELDS = [PointField(name='x', offset=0, datatype=PointField.FLOAT32, count=1),
+                PointField(name='y', offset=4, datatype=PointField.FLOAT32, count=1),
+                PointField(name='z', offset=8, datatype=PointField.FLOAT32, count=1)]
+CLOUD_POINT_STEP = 12
+# multi-cable cloud: instance id of every point follows x, y, z
+INSTANCES_CLOUD_FIELDS = CLOUD_FIELDS + [
+    PointField(name='instance', offset=12, datatype=PointField.UINT32, count=1)]
+INSTANCES_CLOUD_DTYPE = np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('instance', '<u4')])
+# marker colours (r, g, b) of cables by instance id, the first one is used for a single cable
+CABLES_COLORS = ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0),
+                 (1.0, 1.0, 0.0), (1.0, 0.0, 1.0), (0.0, 1.0, 1.0))
+# parameters of threads, timers and files set up at start, the others are applied live
+RESTART_PARAMETERS = ('diagnostics_period', 'pipelined', 'record_chunk', 'record_directory')
 
 
 class CableObserverNode(Node):
     def __init__(self):
         super().__init__('cable_observer_node')
+        self._start_time = perf_counter()
+        self._first_marker_time = None
+        self._pipelined = self.declare_parameter('pipelined', False).value
+        self._native_depth = self.declare_parameter('native_depth', False).value
+        self._num_of_cables = self.declare_parameter('num_of_cables', 1).value
+        self._latency_budget = self.declare_parameter('latency_budget', 0.0).value
         self._cable_observer = CableObserver()
         self._frame_id = ''
         self._cable_observer.set_parameters(
+            association_radius=self.declare_parameter('association_radius', 40.0).value,
             debug=self.declare_parameter('debug', False).value,
+            fused=self.declare_parameter('fused', False).value,
             hsv_ranges=self.declare_parameter('hsv_ranges', [0, 0, 0, 179, 255, 255]).value,
+            incremental_order=self.declare_parameter('incremental_order', False).value,
+            latency_budget=self._latency_budget,
+            depth_median_window=self.declare_parameter('depth_median_window', 0).value,
             depth_ranges=self.declare_parameter('depth_ranges', [0, 10000]).value,
             depth_scale=self.declare_parameter('depth_scale', 1.0).value,
+            downscale=self.declare_parameter('downscale', 1).value,
+            mask_backend=self.declare_parameter('mask_backend', 'hsv').value,
+            metrics=self.declare_parameter('metrics', False).value,
             min_length=self.declare_parameter('min_length', 10).value,
+            native_depth=self._native_depth,
+            num_of_cables=self._num_of_cables,
             num_of_knots=self.declare_parameter('num_of_knots', 25).value,
             num_of_pts=self.declare_parameter('num_of_pts', 256).value,
+            num_threads=self.declare_parameter('num_threads', 0).value,
+            path_extractor=self.declare_parameter('path_extractor', 'walk').value,
+            refine=self.declare_parameter('refine', False).value,
+            roi_padding=self.declare_parameter('roi_padding', 50).value,
+            roi_tracking=self.declare_parameter('roi_tracking', False).value,
+            skeleton_backend=self.declare_parameter('skeleton_backend', 'lee').value,
+            spline_fitter=self.declare_parameter('spline_fitter', 'scipy').value,
+            trace_directory=self.declare_parameter('trace_directory', '.').value,
+            trace_frames=self.declare_parameter('trace_frames', 0).value,
+            trace_threshold=self.declare_parameter('trace_threshold', 0.0).value,
             vector_dir_len=self.declare_parameter('vector_dir_len', 5).value,
+            warmup=self.declare_parameter('warmup', True).value,
             z_vertical_shift=self.declare_parameter('z_vertical_shift', 0).value,
         )
+        self.get_logger().info(
+            f"Warmup took {self._cable_observer.get_warmup_time():.0f} ms, "
+            f"node ready {perf_counter() - self._start_time:.3f} s after start")
 
         self._bridge = CvBridge()
+        # synced input pairs are recorded for replay without ROS
+        self._recorder = None
+        record_directory = self.declare_parameter('record_directory', '').value
+        if record_directory:
+            self._recorder = Recorder(
+                record_directory, chunk_frames=self.declare_parameter('record_chunk', 300).value)
+            self.get_logger().info(f"Recording input to {record_directory}")
         self.create_subscription(CameraInfo, '/rgb/camera_info', self.camera_info_callback, 10)
         self._rgb_sub = Subscriber(self, Image, '/rgb/image_raw')
         self._depth_sub = Subscriber(self, Image, '/depth_to_rgb/image_raw')
@@ -56,8 +124,100 @@ class CableObserverNode(Node):
         self._tss.registerCallback(self.images_callback)
         self._projection_mat = np.zeros(shape=(3, 2), dtype=np.float64)
         self._marker_pub = self.create_publisher(Marker, 'marker', 10)
+        self._markers_pub = self.create_publisher(MarkerArray, 'markers', 10)
         self._cloud_pub = self.create_publisher(PointCloud2, 'cloud', 10)
         self._mask_pub = self.create_publisher(Image, 'mask', 10)
+        self._latency_pub = self.create_publisher(Float64, 'latency', 10)
+        self._dropped_frames_pub = self.create_publisher(UInt64, 'dropped_frames', 10)
+        self._quality_level_pub = self.create_publisher(UInt8, 'quality_level', 10)
+        self._diagnostics_pub = self.create_publisher(DiagnosticArray, '/diagnostics', 10)
+        # metrics are published at a low rate, independently of frames
+        self._diagnostics_period = self.declare_parameter('diagnostics_period', 1.0).value
+        self._diagnostics_timer = None
+        self._dump_trace_service = None
+        self.create_monitoring()
+        # markers are built once per cable slot, points are reused and only their coordinates
+        # are updated
+        self._markers_msgs = []
+        self._markers_points = []
+
+        # decode -> track -> publish stages on separate threads, connected by latest-only slots
+        self._slots = [LatestSlot(), LatestSlot(), LatestSlot()]
+        self._is_running = threading.Event()
+        self._threads = []
+        if self._pipelined:
+            self._is_running.set()
+            stages = [self.decode, self.track, self.publish]
+            sinks = self._slots[1:] + [None]
+            for source, stage, sink in zip(self._slots, stages, sinks):
+                thread = threading.Thread(target=self.run_stage, args=(source, stage, sink),
+                                          daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+        # parameters are updated between frames, tracking state is kept
+        self._track_lock = threading.Lock()
+        self.add_on_set_parameters_callback(self.parameters_callback)
+
+    @property
+    def dropped_frames(self) -> int:
+        return sum(slot.dropped for slot in self._slots)
+
+    def destroy_node(self) -> None:
+        self._is_running.clear()
+        for slot in self._slots:
+            slot.close()
+        for thread in self._threads:
+            thread.join()
+        if self._recorder is not None:
+            self._recorder.close()
+        super().destroy_node()
+
+    def run_stage(self, source: LatestSlot, stage: Callable,
+                  sink: Optional[LatestSlot]) -> None:
+        while self._is_running.is_set():
+            item = source.get(timeout=0.1)
+            if item is None:
+                continue
+            # a failing frame is dropped, the stage keeps running
+            try:
+                result = stage(*item)
+            except Exception as e:
+                self.get_logger().error(f"{stage.__name__} failed: {e!r}")
+                continue
+            if sink is not None:
+                sink.put(result)
+
+    def create_monitoring(self) -> None:
+        # metrics and tracing may be enabled after start
+        if self._cable_observer.get_metrics() is not None and self._diagnostics_timer is None:
+            self._diagnostics_timer = self.create_timer(self._diagnostics_period,
+                                                        self.diagnostics_callback)
+        if self._cable_observer.get_trace_recorder() is not None and \
+                self._dump_trace_service is None:
+            self._dump_trace_service = self.create_service(Trigger, 'dump_trace',
+                                                           self.dump_trace_callback)
+
+    def parameters_callback(self, parameters: List[Parameter]) -> SetParametersResult:
+        restart = [parameter.name for parameter in parameters
+                   if parameter.name in RESTART_PARAMETERS]
+        if restart:
+            return SetParametersResult(successful=False,
+                                       reason=f"{', '.join(restart)} require a restart")
+        kwargs = {parameter.name: parameter.value for parameter in parameters}
+        try:
+            with self._track_lock:
+                changed = self._cable_observer.update_parameters(**kwargs)
+        except ValueError as e:
+            return SetParametersResult(successful=False, reason=str(e))
+
+        self._native_depth = kwargs.get('native_depth', self._native_depth)
+        self._num_of_cables = kwargs.get('num_of_cables', self._num_of_cables)
+        self._latency_budget = kwargs.get('latency_budget', self._latency_budget)
+        self.create_monitoring()
+        if changed:
+            self.get_logger().info(f"Parameters updated: {', '.join(changed)}")
+        return SetParametersResult(successful=True)
 
     def camera_info_callback(self, camera_info_msg: CameraInfo) -> None:
         self._projection_mat[0, 0] = camera_info_msg.p[0]  # fx
@@ -65,39 +225,161 @@ class CableObserverNode(Node):
         self._projection_mat[2, 0] = 1.0
         self._projection_mat[0, 1] = camera_info_msg.p[2]  # cx
         self._projection_mat[1, 1] = camera_info_msg.p[6]  # cy
+        if self._recorder is not None:
+            self._recorder.set_camera_info({
+                "frame_id": camera_info_msg.header.frame_id,
+                "width": camera_info_msg.width,
+                "height": camera_info_msg.height,
+                "distortion_model": camera_info_msg.distortion_model,
+                "d": list(camera_info_msg.d),
+                "k": list(camera_info_msg.k),
+                "p": list(camera_info_msg.p),
+            })
 
     def images_callback(self, rgb_msg: Image, depth_msg: Image) -> None:
-        self._frame_id = rgb_msg.header.frame_id
+        if self._recorder is not None:
+            self.record(rgb_msg, depth_msg)
+        if self._pipelined:
+            self._slots[0].put((rgb_msg, depth_msg))
+        else:
+            self.publish(*self.track(*self.decode(rgb_msg, depth_msg)))
+
+    def record(self, rgb_msg: Image, depth_msg: Image) -> None:
+        # messages are copied into the recording as they are, without conversion
+        rgb = self._bridge.imgmsg_to_cv2(rgb_msg, desired_encoding='passthrough')
+        depth = self._bridge.imgmsg_to_cv2(depth_msg, desired_encoding='passthrough')
+        if self._recorder.num_of_frames == 0:
+            self._recorder.set_encodings(rgb=rgb_msg.encoding, depth=depth_msg.encoding)
+        self._recorder.write(rgb=rgb, depth=depth,
+                             stamp=Time.from_msg(rgb_msg.header.stamp).nanoseconds,
+                             depth_stamp=Time.from_msg(depth_msg.header.stamp).nanoseconds)
+
+    def decode(self, rgb_msg: Image, depth_msg: Image) -> Tuple[Header, npt.NDArray[np.uint8],
+                                                                npt.NDArray]:
         rgb = self._bridge.imgmsg_to_cv2(rgb_msg, desired_encoding='passthrough')
-        depth = self._bridge.imgmsg_to_cv2(depth_msg, desired_encoding='64FC1')
-        spline_coords = self._cable_observer.track(frame=rgb[..., :3], depth=depth)
+        # native depth (16UC1 or 32FC1) is a zero-copy view of the message data
+        depth = self._bridge.imgmsg_to_cv2(
+            depth_msg, desired_encoding='passthrough' if self._native_depth else '64FC1')
+        return rgb_msg.header, rgb, depth
+
+    def track(self, header: Header, rgb: npt.NDArray[np.uint8],
+              depth: npt.NDArray) -> Tuple[Header, npt.NDArray[np.float64],
+                                           npt.NDArray[np.int64],
+                                           Optional[npt.NDArray[np.uint8]], int]:
+        with self._track_lock:
+            spline_coords = self._cable_observer.track(frame=rgb[..., :3], depth=depth)
+            instances_ids = self._cable_observer.get_instances_ids().copy()
+            # mask is copied, frame buffers are reused by the next frame
+            mask = self._cable_observer.get_mask() if self.is_subscribed(self._mask_pub) else None
+            quality_level = self._cable_observer.get_quality_level()
+        return header, spline_coords, instances_ids, mask, quality_level
 
-        points_3d = self.coords_to_points_3d(spline_coords.T)
+    def publish(self, header: Header, spline_coords: npt.NDArray[np.float64],
+                instances_ids: npt.NDArray[np.int64],
+                mask: Optional[npt.NDArray[np.uint8]], quality_level: int) -> None:
+        self._frame_id = header.frame_id
+        is_multi_cable = self._num_of_cables > 1
+        # messages are built only for publishers with subscribers, and only with a spline
+        has_spline = len(spline_coords) > 0
+        marker_pub = self._markers_pub if is_multi_cable else self._marker_pub
+        is_marker_subscribed = has_spline and self.is_subscribed(marker_pub)
+        is_cloud_subscribed = has_spline and self.is_subscribed(self._cloud_pub)
+        if is_marker_subscribed or is_cloud_subscribed:
+            # (num_of_pts, 3), or (num_of_cables, num_of_pts, 3) in multi-cable mode
+            points_3d = self.coords_to_points_3d(np.swapaxes(spline_coords, -1, -2))
 
-        # Publish marker
-        marker_msg = self.generate_marker_msg(arr=np.array(
-            [points_3d.T[0], points_3d.T[1], points_3d.T[2]]))
-        self._marker_pub.publish(marker_msg)
+        # Publish marker, one per cable in multi-cable mode
+        if is_marker_subscribed and is_multi_cable:
+            markers_msg = MarkerArray(markers=[Marker(action=Marker.DELETEALL)])
+            for key, instance_id in enumerate(instances_ids):
+                markers_msg.markers.append(self.update_marker_msg(
+                    key=key, points_3d=points_3d[key], instance_id=int(instance_id)))
+            self._markers_pub.publish(markers_msg)
+        elif is_marker_subscribed:
+            self._marker_pub.publish(self.update_marker_msg(key=0, points_3d=points_3d))
+        if self._first_marker_time is None and (is_marker_subscribed or is_cloud_subscribed):
+            self._first_marker_time = perf_counter() - self._start_time
+            self.get_logger().info(
+                f"First spline published {self._first_marker_time:.3f} s after start")
 
         # Publish point cloud
-        cloud_msg = create_cloud_xyz32(rgb_msg.header, points_3d)
-        self._cloud_pub.publish(cloud_msg)
+        if is_cloud_subscribed:
+            self._cloud_pub.publish(self.generate_cloud_msg(
+                header, points_3d, instances_ids if is_multi_cable else None))
 
         # Publish debug mask
-        mask = self._cable_observer.get_mask()
-        img_msg = self._bridge.cv2_to_imgmsg(mask, encoding='mono8', header=rgb_msg.header)
-        self._mask_pub.publish(img_msg)
+        if mask is not None and self.is_subscribed(self._mask_pub):
+            img_msg = self._bridge.cv2_to_imgmsg(mask, encoding='mono8', header=header)
+            self._mask_pub.publish(img_msg)
+
+        # Publish freshness: sensor stamp to publish latency [ms] and dropped frames
+        if self.is_subscribed(self._latency_pub):
+            latency = self.get_clock().now() - Time.from_msg(header.stamp)
+            self._latency_pub.publish(Float64(data=latency.nanoseconds / 1e6))
+        if self.is_subscribed(self._dropped_frames_pub):
+            self._dropped_frames_pub.publish(UInt64(data=self.dropped_frames))
+        if self.is_subscribed(self._quality_level_pub):
+            self._quality_level_pub.publish(UInt8(data=quality_level))
+
+    def dump_trace_callback(self, request: Trigger.Request,
+                            response: Trigger.Response) -> Trigger.Response:
+        path = os.path.join(self.get_parameter('trace_directory').value,
+                            f"cable_observer_trace_{time.strftime('%Y%m%d_%H%M%S')}.json")
+        trace_recorder = self._cable_observer.get_trace_recorder()
+        if trace_recorder is None:
+            response.message = "Tracing is off (trace_frames: 0)"
+            response.success = False
+            return response
+        try:
+            response.message = trace_recorder.dump(path)
+            response.success = True
+        except OSError as e:
+            response.message = str(e)
+            response.success = False
+        return response
+
+    def diagnostics_callback(self) -> None:
+        metrics = self._cable_observer.get_metrics()
+        if metrics is None:
+            return
+        metrics.set_dropped_frames(self.dropped_frames)
+        if not self.is_subscribed(self._diagnostics_pub):
+            return
+
+        summary = metrics.summary()
+        values = [KeyValue(key=key, value=str(summary[key]))
+                  for key in ("fps", "frames", "empty_frames", "empty_skeleton_frames",
+                              "dropped_frames")]
+        values.append(KeyValue(key="quality_level",
+                               value=str(self._cable_observer.get_quality_level())))
+        for stage, quantiles in summary["stages"].items():
+            values.append(KeyValue(key=f"{stage} [ms]", value=" ".join(
+                f"{key} {value:.3f}" for key, value in quantiles.items())))
+
+        # tail latency above the budget is a warning
+        level, message = DiagnosticStatus.OK, f"{summary['fps']:.1f} fps"
+        total_p95 = summary["stages"].get("total", {}).get("p95", 0.0)
+        if 0 < self._latency_budget < total_p95:
+            level = DiagnosticStatus.WARN
+            message += f", p95 {total_p95:.1f} ms over budget {self._latency_budget:.1f} ms"
+        status = DiagnosticStatus(level=level, name=self.get_name(), message=message,
+                                  hardware_id=self._frame_id, values=values)
+        self._diagnostics_pub.publish(DiagnosticArray(
+            header=Header(stamp=self.get_clock().now().to_msg()), status=[status]))
+
+    @staticmethod
+    def is_subscribed(publisher) -> bool:
+        return publisher.get_subscription_count() > 0
 
     def coords_to_points_3d(self, points: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
-        z = points[:, 2]
+        z = points[..., 2]
         z = np.stack([z, z, np.ones_like(z)], axis=-1)
         points_3d = z * (points - self._projection_mat[..., 1]) / self._projection_mat[..., 0]
 
         return points_3d
 
-    def generate_marker_msg(self, arr: npt.NDArray[np.float64]) -> Marker:
+    def generate_marker_msg(self) -> Marker:
         marker_msg = Marker()
-        marker_msg.header.frame_id = self._frame_id
         marker_msg.type = marker_msg.LINE_STRIP
         marker_msg.action = marker_msg.ADD
 
@@ -112,10 +394,48 @@ class CableObserverNode(Node):
 
         marker_msg.pose.orientation.w = 1.0
 
-        marker_msg.points = [Point(x=point[0], y=point[1], z=point[2]) for point in arr.T]
+        return marker_msg
+
+    def update_marker_msg(self, key: int, points_3d: npt.NDArray[np.float64],
+                          instance_id: int = 0) -> Marker:
+        # one tolist() conversion for all coordinates, Point objects are created only when
+        # the number of points grows
+        if key == len(self._markers_msgs):
+            self._markers_msgs.append(self.generate_marker_msg())
+            self._markers_points.append([])
+        marker_msg, marker_points = self._markers_msgs[key], self._markers_points[key]
+        num_of_pts = len(points_3d)
+        marker_points.extend(Point() for _ in range(num_of_pts - len(marker_points)))
+        points = marker_points[:num_of_pts]
+        for point, (x, y, z) in zip(points, points_3d.tolist()):
+            point.x, point.y, point.z = x, y, z
 
+        marker_msg.header.frame_id = self._frame_id
+        marker_msg.id = instance_id
+        marker_msg.color.r, marker_msg.color.g, marker_msg.color.b = \
+            CABLES_COLORS[instance_id % len(CABLES_COLORS)]
+        marker_msg.points = points
         return marker_msg
 
+    @staticmethod
+    def generate_cloud_msg(header: Header, points_3d: npt.NDArray[np.float64],
+                           instances_ids: Optional[npt.NDArray[np.int64]] = None) -> PointCloud2:
+        # fields packed as one contiguous buffer, no per-point packing
+        if instances_ids is None:
+            data = np.ascontiguousarray(points_3d, dtype='<f4')
+            fields, point_step = CLOUD_FIELDS, CLOUD_POINT_STEP
+        else:
+            data = np.empty(points_3d.shape[:2], dtype=INSTANCES_CLOUD_DTYPE)
+            data['x'], data['y'] = points_3d[..., 0], points_3d[..., 1]
+            data['z'] = points_3d[..., 2]
+            data['instance'] = instances_ids[:, np.newaxis]
+            data = data.reshape(-1)
+            fields, point_step = INSTANCES_CLOUD_FIELDS, INSTANCES_CLOUD_DTYPE.itemsize
+        return PointCloud2(header=header, height=1, width=len(data), fields=fields,
+                           is_bigendian=False, point_step=point_step,
+                           row_step=point_step * len(data), is_dense=True,
+                           data=array.array('B', data.tobytes()))
+
 
 def main(args=None):
     rclpy.init(args=args)
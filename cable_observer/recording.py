@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compact record-and-replay of synced RGB/depth frames, replayed without ROS.
+
+A recording is a directory of:
+    rgb_CCCCC.npy, depth_CCCCC.npy - chunks of `chunk_frames` frames (C, H, W[, 3]), written
+        and read through memory maps, the last chunk may be partially filled,
+    index.bin - INDEX_DTYPE record of every frame (chunk, offset and sensor stamps in ns),
+        appended and flushed with every frame,
+    meta.json - encodings, frame id and camera info.
+Frames keep the message dtype (e.g. uint16 depth), replay returns views of the memory maps.
+
+Example:
+    python3 -m cable_observer.recording --input rec --rate 1.0 --param native_depth=true
+"""
+
+import argparse
+import json
+import os
+import sys
+from time import perf_counter, sleep
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+try:
+    from cable_observer import CableObserver
+    from benchmark import DEFAULT_PARAMETERS, parameter, summarize
+except ImportError:
+    from cable_observer.cable_observer import CableObserver
+    from cable_observer.benchmark import DEFAULT_PARAMETERS, parameter, summarize
+
+
+RECORDING_META = "meta.json"
+RECORDING_INDEX = "index.bin"
+INDEX_DTYPE = np.dtype([("chunk", "<u4"), ("offset", "<u4"), ("stamp", "<i8"),
+                        ("depth_stamp", "<i8")])
+
+
+def chunk_path(directory: str, stream: str, chunk: int) -> str:
+    return os.path.join(directory, f"{stream}_{chunk:05d}.npy")
+
+
+class Recorder:
+    """
+    Writer of a recording, frames are copied into memory-mapped chunks.
+
+    A new chunk is started when the current one is full or the frame shape or dtype changes.
+    """
+
+    def __init__(self, directory: str, *, chunk_frames: int = 300,
+                 meta: Optional[Dict[str, Any]] = None) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._chunk_frames = chunk_frames
+        self._meta = {"chunk_frames": chunk_frames, "camera_info": None} | (meta or {})
+        self._chunk = -1
+        self._offset = 0
+        self._rgb = None
+        self._depth = None
+        self._num_of_frames = 0
+        self._index = open(os.path.join(directory, RECORDING_INDEX), "wb")
+        self.write_meta()
+
+    @property
+    def num_of_frames(self) -> int:
+        return self._num_of_frames
+
+    def set_encodings(self, *, rgb: str, depth: str) -> None:
+        self._meta |= {"rgb_encoding": rgb, "depth_encoding": depth}
+        self.write_meta()
+
+    def set_camera_info(self, camera_info: Dict[str, Any]) -> None:
+        if camera_info != self._meta["camera_info"]:
+            self._meta["camera_info"] = camera_info
+            self.write_meta()
+
+    def write_meta(self) -> None:
+        with open(os.path.join(self._directory, RECORDING_META), "w") as f:
+            f.write(json.dumps(self._meta, indent=2) + "\n")
+
+    def write(self, rgb: npt.NDArray[np.uint8], depth: npt.NDArray, stamp: int,
+              depth_stamp: Optional[int] = None) -> None:
+        """
+        Append a frame with its sensor stamps (ns), depth stamp defaults to the rgb one.
+        """
+        if self._rgb is None or self._offset == self._chunk_frames or \
+                self._rgb.shape[1:] != rgb.shape or self._rgb.dtype != rgb.dtype or \
+                self._depth.shape[1:] != depth.shape or self._depth.dtype != depth.dtype:
+            self.open_chunk(rgb=rgb, depth=depth)
+
+        self._rgb[self._offset] = rgb
+        self._depth[self._offset] = depth
+        record = np.array((self._chunk, self._offset, stamp,
+                           stamp if depth_stamp is None else depth_stamp), dtype=INDEX_DTYPE)
+        self._index.write(record.tobytes())
+        self._index.flush()
+        self._offset += 1
+        self._num_of_frames += 1
+
+    def open_chunk(self, rgb: npt.NDArray[np.uint8], depth: npt.NDArray) -> None:
+        self.flush()
+        self._chunk += 1
+        self._offset = 0
+        self._rgb = np.lib.format.open_memmap(
+            chunk_path(self._directory, "rgb", self._chunk), mode="w+", dtype=rgb.dtype,
+            shape=(self._chunk_frames,) + rgb.shape)
+        self._depth = np.lib.format.open_memmap(
+            chunk_path(self._directory, "depth", self._chunk), mode="w+", dtype=depth.dtype,
+            shape=(self._chunk_frames,) + depth.shape)
+
+    def flush(self) -> None:
+        if self._rgb is not None:
+            self._rgb.flush()
+            self._depth.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self._rgb = self._depth = None
+        self._index.close()
+
+
+class Replay:
+    """
+    Reader of a recording, frames are views of read-only memory maps of the chunks.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self._directory = directory
+        with open(os.path.join(directory, RECORDING_META)) as f:
+            self._meta = json.load(f)
+        # a record which was being written when the recorder stopped is ignored
+        index = np.fromfile(os.path.join(directory, RECORDING_INDEX), dtype=np.uint8)
+        num_of_frames = len(index) // INDEX_DTYPE.itemsize
+        self._index = index[:num_of_frames * INDEX_DTYPE.itemsize].view(INDEX_DTYPE)
+        self._chunks: Dict[Tuple[str, int], npt.NDArray] = {}
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @property
+    def meta(self) -> Dict[str, Any]:
+        return self._meta
+
+    @property
+    def camera_info(self) -> Optional[Dict[str, Any]]:
+        return self._meta["camera_info"]
+
+    @property
+    def stamps(self) -> npt.NDArray[np.int64]:
+        return self._index["stamp"]
+
+    def chunk(self, stream: str, chunk: int) -> npt.NDArray:
+        key = (stream, chunk)
+        if key not in self._chunks:
+            self._chunks[key] = np.load(chunk_path(self._directory, stream, chunk),
+                                        mmap_mode="r")
+        return self._chunks[key]
+
+    def __getitem__(self, key: int) -> Tuple[npt.NDArray[np.uint8], npt.NDArray, int]:
+        record = self._index[key]
+        chunk, offset = int(record["chunk"]), int(record["offset"])
+        return (self.chunk("rgb", chunk)[offset], self.chunk("depth", chunk)[offset],
+                int(record["stamp"]))
+
+    def frames(self, start: int = 0, stop: Optional[int] = None,
+               rate: float = 0.0) -> Iterator[Tuple[npt.NDArray[np.uint8], npt.NDArray, int]]:
+        """
+        Generator of (rgb, depth, stamp) of frames [start, stop). With `rate` > 0 frames are
+        paced by their stamps (1.0 - real time), a slow consumer delays frames, none is
+        skipped, so the replayed sequence is the same at any rate.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        t0 = perf_counter()
+        for key in range(start, stop):
+            if rate > 0:
+                delay = (self._index[key]["stamp"] - self._index[start]["stamp"]) / 1e9 / rate
+                sleep(max(0.0, t0 + delay - perf_counter()))
+            yield self[key]
+
+
+def replay(cable_observer: CableObserver, directory: str, *, rate: float = 0.0,
+           native_depth: bool = False) -> Iterator[npt.NDArray[np.float64]]:
+    """
+    Generator of splines of the recorded frames, depth is converted like in the node.
+    """
+    for rgb, depth, _ in Replay(directory).frames(rate=rate):
+        if not native_depth:
+            depth = depth.astype(np.float64)
+        yield cable_observer.track(frame=rgb[..., :3], depth=depth)
+
+
+def main(args=None) -> None:
+    parser = argparse.ArgumentParser(description="Replay a recording through cable observer.")
+    parser.add_argument("--input", type=str, required=True, help="Recording directory.")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="Replay rate (1.0 - real time), 0 - full speed.")
+    parser.add_argument("--param", type=parameter, action="append", default=[],
+                        help="CableObserver parameter as key=json_value, e.g. num_of_knots=15.")
+    parser.add_argument("--output", type=str, default="-", help="Output JSON file (- for stdout).")
+    args = parser.parse_args(args)
+
+    parameters = dict(DEFAULT_PARAMETERS)
+    parameters.update(dict(args.param))
+    cable_observer = CableObserver()
+    cable_observer.set_parameters(**parameters)
+
+    stages: Dict[str, List[float]] = {}
+    empty_frames = 0
+    t1 = perf_counter()
+    for _ in replay(cable_observer, args.input, rate=args.rate,
+                    native_depth=parameters.get("native_depth", False)):
+        stamps = cable_observer.get_stamps()
+        empty_frames += "fit_spline" not in stamps
+        for stage, value in stamps.items():
+            stages.setdefault(stage, []).append(value)
+    t2 = perf_counter()
+
+    num_of_frames = len(stages.get("total", []))
+    report = {
+        "input": args.input,
+        "parameters": parameters,
+        "rate": args.rate,
+        "frames": num_of_frames,
+        "empty_frames": empty_frames,
+        "stages": {stage: summarize(values) for stage, values in stages.items()},
+        "fps": num_of_frames / (t2 - t1) if num_of_frames > 0 else 0.0,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output == "-":
+        sys.stdout.write(output + "\n")
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == '__main__':
+    main()
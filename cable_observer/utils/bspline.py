@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+from numba import njit
+
+
+DEGREE = 3
+
+
+@njit(target_backend='cuda', fastmath=True, cache=True, nogil=True)
+def get_basis(t: np.float64, knots: npt.NDArray[np.float64],
+              basis: npt.NDArray[np.float64]) -> np.int64:
+    """
+    Non-zero basis functions at t written to basis, returns index of the first of them.
+    """
+    num_of_coefs = len(knots) - DEGREE - 1
+    span = np.searchsorted(knots, t, side='right') - 1
+    span = min(max(span, DEGREE), num_of_coefs - 1)
+
+    # Cox-de Boor recursion
+    left = np.empty(DEGREE + 1, dtype=np.float64)
+    right = np.empty(DEGREE + 1, dtype=np.float64)
+    basis[0] = 1.0
+    for j in range(1, DEGREE + 1):
+        left[j] = t - knots[span + 1 - j]
+        right[j] = knots[span + j] - t
+        saved = 0.0
+        for r in range(j):
+            denominator = right[r + 1] + left[j - r]
+            tmp = basis[r] / denominator if denominator != 0.0 else 0.0
+            basis[r] = saved + right[r + 1] * tmp
+            saved = left[j - r] * tmp
+        basis[j] = saved
+    return span - DEGREE
+
+
+class BSpline:
+    """
+    Cubic least-squares B-spline of x, y and z fitted in one banded solve.
+
+    Knots are chosen like in `LSQUnivariateSpline` calls of `DeformableLinearObject`: interior
+    knots are every d-th parameter value, boundary knots are repeated DEGREE + 1 times.
+    Coordinates share one design matrix, so the normal equations are built once and solved
+    for all three right-hand sides. Missing z values (zeros) are linearly interpolated along
+    the parameter before the fit.
+    """
+
+    def __init__(self, *, num_of_knots: int, T: npt.NDArray[np.float64]) -> None:
+        self._num_of_knots = np.int64(num_of_knots)
+        self._T = T
+
+    def fit(self, t: npt.NDArray[np.float64],
+            coords: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+        """
+        Spline (3, len(T)) fitted to coords (3, len(t)) parametrized by non-decreasing t.
+        """
+        from scipy.linalg import solveh_banded
+
+        k = self._num_of_knots - 4
+        d = np.int64((t.shape[0] - 2) / k) + 1
+        knots = np.concatenate([np.full(DEGREE + 1, t[0]), t[1:-1:d],
+                                np.full(DEGREE + 1, t[-1])])
+
+        rhs = coords.T.copy()
+        valid = rhs[:, 2] != 0
+        if valid.any() and not valid.all():
+            rhs[~valid, 2] = np.interp(t[~valid], t[valid], rhs[valid, 2])
+
+        normal_matrix, normal_rhs = self.get_normal_equations(t=t, knots=knots, rhs=rhs)
+        coefs = solveh_banded(normal_matrix, normal_rhs, check_finite=False)
+        return self.evaluate(T=self._T, knots=knots, coefs=coefs)
+
+    @staticmethod
+    @njit(target_backend='cuda', fastmath=True, cache=True, nogil=True)
+    def get_normal_equations(t: npt.NDArray[np.float64], knots: npt.NDArray[np.float64],
+                             rhs: npt.NDArray[np.float64]) -> \
+            Tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+        """
+        Normal equations of the least squares in the upper banded form of `solveh_banded`.
+        """
+        num_of_coefs = len(knots) - DEGREE - 1
+        normal_matrix = np.zeros((DEGREE + 1, num_of_coefs), dtype=np.float64)
+        normal_rhs = np.zeros((num_of_coefs, rhs.shape[1]), dtype=np.float64)
+        basis = np.empty(DEGREE + 1, dtype=np.float64)
+        for key in range(len(t)):
+            first = get_basis(t[key], knots, basis)
+            for a in range(DEGREE + 1):
+                for b in range(a, DEGREE + 1):
+                    normal_matrix[DEGREE + a - b, first + b] += basis[a] * basis[b]
+                for c in range(rhs.shape[1]):
+                    normal_rhs[first + a, c] += basis[a] * rhs[key, c]
+        return normal_matrix, normal_rhs
+
+    @staticmethod
+    @njit(target_backend='cuda', fastmath=True, cache=True, nogil=True)
+    def evaluate(T: npt.NDArray[np.float64], knots: npt.NDArray[np.float64],
+                 coefs: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+        coords = np.zeros((coefs.shape[1], len(T)), dtype=np.float64)
+        basis = np.empty(DEGREE + 1, dtype=np.float64)
+        for key in range(len(T)):
+            first = get_basis(T[key], knots, basis)
+            for a in range(DEGREE + 1):
+                for c in range(coefs.shape[1]):
+                    coords[c, key] += basis[a] * coefs[first + a, c]
+        return coords
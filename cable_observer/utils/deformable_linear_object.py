@@ -15,173 +15,428 @@
 # limitations under the License.
 
 from time import perf_counter
-from typing import Union
+from typing import Optional, Tuple
 
 import numpy as np
 import numpy.typing as npt
 from numba import njit
 from numba.typed import List, Dict
 from numba.core import types
-from scipy.interpolate import LSQUnivariateSpline
-from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import PolynomialFeatures
 
 try:
+    from utils.bspline import BSpline
     from utils.frame import Frame
+    from utils.skeleton_graph import SkeletonGraph
 except ImportError:
+    from cable_observer.utils.bspline import BSpline
     from cable_observer.utils.frame import Frame
+    from cable_observer.utils.skeleton_graph import SkeletonGraph
+
+
+PATH_EXTRACTORS = ("walk", "graph")
+SPLINE_FITTERS = ("scipy", "batched")
+# above this number of paths the ordering uses candidate pairs instead of a dense matrix
+DENSE_ORDER_MAX_PATHS = 32
+# initial radius [px] of candidate pairs search, doubled until the greedy choice is exact
+ORDER_RADIUS = 64.0
+# max displacement [px] of path ends between frames to reuse the previous order
+ORDER_MATCH_RADIUS = 20.0
 
 
 class DeformableLinearObject:
     def __init__(self, *, min_length: int = 10,
                  num_of_knots: int = 25, num_of_pts: int = 256,
-                 vector_dir_len: int = 5, z_vertical_shift: int = 0) -> None:
+                 vector_dir_len: int = 5, z_vertical_shift: int = 0,
+                 path_extractor: str = "walk", spline_fitter: str = "scipy",
+                 depth_median_window: int = 0, incremental_order: bool = False) -> None:
+        self._graph = SkeletonGraph()
         self._num_of_knots = np.int64(num_of_knots)
-        self._num_of_pts = np.int64(num_of_pts)
+        self._num_of_pts = None
+        # ordered chain of the previous frame: (begin, end) of every path in traversal direction
+        # and the number of paths it was chosen from
+        self._incremental_order = incremental_order
+        self._chain_ends = np.empty((0, 2, 2), dtype=np.float64)
+        self._num_of_chain_candidates = 0
+        # paths left after filtering in the last frame
+        self._num_of_fragments = 0
+
+        self._previous_spline_coords_3d = np.array([], dtype=np.float64)
+        self._spline_coords_3d = np.array([], dtype=np.float64)
+        self.set_parameters(min_length=min_length, num_of_pts=num_of_pts,
+                            vector_dir_len=vector_dir_len, z_vertical_shift=z_vertical_shift,
+                            path_extractor=path_extractor, spline_fitter=spline_fitter,
+                            depth_median_window=depth_median_window)
+
+    @staticmethod
+    def check_parameters(path_extractor: str, spline_fitter: str,
+                         depth_median_window: int) -> None:
+        if path_extractor not in PATH_EXTRACTORS:
+            raise ValueError(f"Unknown path extractor '{path_extractor}', "
+                             f"expected {PATH_EXTRACTORS}")
+        if spline_fitter not in SPLINE_FITTERS:
+            raise ValueError(f"Unknown spline fitter '{spline_fitter}', "
+                             f"expected {SPLINE_FITTERS}")
+        if depth_median_window < 0 or (depth_median_window > 0 and depth_median_window % 2 == 0):
+            raise ValueError(f"Depth median window has to be 0 (off) or odd, "
+                             f"got {depth_median_window}")
+
+    def set_parameters(self, *, min_length: int, num_of_pts: int, vector_dir_len: int,
+                       z_vertical_shift: int, path_extractor: str, spline_fitter: str,
+                       depth_median_window: int) -> None:
+        """
+        Settings which may be changed between frames, tracking state is kept. Spline sampling
+        is rebuilt only when `num_of_pts` changes, previous splines are resampled then.
+        """
+        self.check_parameters(path_extractor=path_extractor, spline_fitter=spline_fitter,
+                              depth_median_window=depth_median_window)
+        self._path_extractor = path_extractor
+        self._spline_fitter = spline_fitter
         self._vector_dir_len = np.int64(vector_dir_len)
         self._min_length = np.int64(min_length)
         self._z_vertical_shift = np.int64(z_vertical_shift)
+        # holes in sampled depth are filled with median of (2 * r + 1)^2 window, windows 0 and 1
+        # (r = 0) are disabled
+        self._depth_median_radius = np.int64(depth_median_window // 2)
+        if num_of_pts == self._num_of_pts:
+            return
 
+        self._num_of_pts = np.int64(num_of_pts)
         self._T = np.linspace(0., 1., num_of_pts, dtype=np.float64)
-        self._previous_spline_coords_3d = np.array([], dtype=np.float64)
-        self._spline_coords_3d = np.array([], dtype=np.float64)
-
-        spline_idxs = np.linspace(0, num_of_pts - 1, num_of_pts,
-                                        dtype=np.int64)[:, np.newaxis]
-        poly = PolynomialFeatures(degree=4, include_bias=False)
-        self._poly_features = poly.fit_transform(spline_idxs)
-        self._poly_reg_model = LinearRegression()
+        self._bspline = BSpline(num_of_knots=int(self._num_of_knots), T=self._T)
+
+        # z outliers are fixed by a projection on 4th degree polynomials of spline index,
+        # basis is built on [-1, 1] for conditioning
+        spline_idxs = np.linspace(-1., 1., num_of_pts, dtype=np.float64)
+        # kept factored (n x 5 and 5 x n), the projection matrix would be n x n
+        self._poly_features = np.vander(spline_idxs, 5, increasing=True)
+        self._poly_features_pinv = np.linalg.pinv(self._poly_features)
+
+        self._previous_spline_coords_3d = self.resample_spline(
+            spline_coords=self._previous_spline_coords_3d, T=self._T)
+        self._spline_coords_3d = self.resample_spline(
+            spline_coords=self._spline_coords_3d, T=self._T)
+
+    def set_quality(self, *, num_of_knots: int, incremental_order: bool) -> None:
+        """
+        Spline resolution and ordering mode, may be changed between frames, tracking state is kept.
+        """
+        if num_of_knots != self._num_of_knots:
+            self._num_of_knots = np.int64(num_of_knots)
+            self._bspline = BSpline(num_of_knots=num_of_knots, T=self._T)
+        if incremental_order != self._incremental_order:
+            self._incremental_order = incremental_order
+            self._chain_ends = np.empty((0, 2, 2), dtype=np.float64)
+            self._num_of_chain_candidates = 0
 
     def execute(self, frame: Frame) -> Dict[str, float]:
         t1 = perf_counter()
+        self._num_of_fragments = 0
         if frame.skeleton.max() == 0.0:
             return
 
         t2 = perf_counter()
-        paths_coords_2d, paths_lengths_2d = self.generate_paths(frame=frame)
+        paths_coords_2d, paths_offsets, paths_lengths_2d = self.generate_paths(frame=frame)
 
         t3 = perf_counter()
-        paths_coords_2d_filtered = List.empty_list(types.ListType(types.int64[:]))
-        paths_lengths_2d_filtered = List.empty_list(types.float64)
-        self.paths_filter(
-            paths_coords_2d_filtered=paths_coords_2d_filtered,
-            paths_lengths_2d_filtered=paths_lengths_2d_filtered, paths_coords_2d=paths_coords_2d,
+        paths_ids = self.paths_filter(
             paths_lengths_2d=paths_lengths_2d, min_length=self._min_length)
+        self._num_of_fragments = len(paths_ids)
+        # the spline fit needs a few coordinates per knot interval, lengths of downscaled paths
+        # are in full resolution pixels while their coordinates are sparse
+        if self.count_coords(paths_offsets, paths_ids) < self.min_num_of_coords:
+            return
+
+        t4 = perf_counter()
+        stamps = self.fit_paths(
+            frame=frame, paths_coords_2d=paths_coords_2d, paths_offsets=paths_offsets,
+            paths_lengths_2d=paths_lengths_2d, paths_ids=paths_ids)
+
+        return {
+            "skeleton check": (t2 - t1)*1000,
+            "generate_paths": (t3 - t2)*1000,
+            "paths_filter": (t4 - t3)*1000,
+        } | stamps
+
+    def fit_paths(self, frame: Frame, paths_coords_2d: npt.NDArray[np.int32],
+                  paths_offsets: npt.NDArray[np.int64], paths_lengths_2d: npt.NDArray[np.float64],
+                  paths_ids: npt.NDArray[np.int64]) -> Dict[str, float]:
+        """
+        Fit the spline to the paths given by `paths_ids` and update tracking state.
+        """
+        t1 = perf_counter()
+        paths_order, paths_reversed, is_reused = self.order_paths(
+            paths_coords_2d=paths_coords_2d, paths_offsets=paths_offsets, paths_ids=paths_ids)
+        paths_idxs = self.get_paths_idxs(
+            paths_offsets=paths_offsets, paths_order=paths_order, paths_reversed=paths_reversed)
+
+        t2 = perf_counter()
+        depth_ranges, depth_scale = frame.depth_sampling
+        paths_coords_z = self.get_paths_coords_z(
+            paths_coords_2d=paths_coords_2d, paths_idxs=paths_idxs,
+            depth=frame.depth, depth_ranges=depth_ranges, depth_scale=depth_scale,
+            z_vertical_shift=self._z_vertical_shift, median_radius=self._depth_median_radius)
+
+        t3 = perf_counter()
+        gaps_lengths_2d = self.get_gaps_lengths(
+            paths_coords_2d=paths_coords_2d, paths_offsets=paths_offsets,
+            paths_order=paths_order, paths_reversed=paths_reversed)
 
         t4 = perf_counter()
-        paths_coords_2d_sorted, paths_lengths_2d_sorted = self.sort_paths(
-            paths_coords_2d=paths_coords_2d_filtered, paths_lengths_2d=paths_lengths_2d_filtered)
+        linspace_2d = self.get_linspaces(
+            paths_offsets=paths_offsets, paths_lengths_2d=paths_lengths_2d,
+            paths_order=paths_order, gaps_lengths_2d=gaps_lengths_2d)
 
         t5 = perf_counter()
-        paths_coords_z = List.empty_list(types.ListType(types.float64))
-        self.get_paths_coords_z(
-            paths_coords_z=paths_coords_z, paths_coords_2d=paths_coords_2d_sorted,
-            depth=frame.depth, z_vertical_shift=self._z_vertical_shift)
+        full_path_coords_3d = self.concatenate_paths_3d(
+            paths_coords_2d=paths_coords_2d, paths_idxs=paths_idxs,
+            paths_coords_z=paths_coords_z)
 
         t6 = perf_counter()
-        gaps_lengths_2d = List.empty_list(types.float64)
-        self.get_gaps_lengths(
-            gaps_lengths_2d=gaps_lengths_2d, paths_coords_2d=paths_coords_2d_sorted)
+        frame.refine_coords(path_coords_3d=full_path_coords_3d)
 
         t7 = perf_counter()
-        linspaces_2d = List.empty_list(types.float64[:])
-        self.get_linspaces(paths_coords_2d=paths_coords_2d_sorted,
-                           paths_lengths_2d=paths_lengths_2d_sorted,
-                           gaps_lengths_2d=gaps_lengths_2d, linspaces_2d=linspaces_2d)
-        linspace_2d = np.concatenate(linspaces_2d)
-
-        t8 = perf_counter()
-        full_path_coords_3d = List.empty_list(types.float64[:])
-        self.concatenate_paths_3d(
-            paths_coords_2d=paths_coords_2d_sorted, paths_lengths_2d=paths_lengths_2d_sorted,
-            gaps_lengths_2d=gaps_lengths_2d, paths_coords_z=paths_coords_z,
-            full_path_coords_3d=full_path_coords_3d)
-
-        t9 = perf_counter()
         spline_coords_3d = self.fit_spline(
             path_coords_3d=full_path_coords_3d, linspace_2d=linspace_2d)
 
-        t10 = perf_counter()
-        self._spline_coords_3d = self.validate_spline_order(
-            spline_coords=spline_coords_3d, previous_spline_coords=self._previous_spline_coords_3d)
+        t8 = perf_counter()
+        # reused chain keeps the direction of the previous spline
+        if is_reused:
+            self._spline_coords_3d = spline_coords_3d
+        else:
+            self._spline_coords_3d = self.validate_spline_order(
+                spline_coords=spline_coords_3d,
+                previous_spline_coords=self._previous_spline_coords_3d)
 
-        t11 = perf_counter()
+        t9 = perf_counter()
 
         self._previous_spline_coords_3d = spline_coords_3d
 
         return {
-            "skeleton check": (t2 - t1)*1000,
-            "generate_paths": (t3 - t2)*1000,
-            "paths_filter": (t4 - t3)*1000,
-            "sort_paths": (t5 - t4)*1000,
-            "get_paths_coords_z": (t6 - t5)*1000,
-            "get_gaps_lengths": (t7 - t6)*1000,
-            "get_linspaces": (t8 - t7)*1000,
-            "concatenate_paths_3d": (t9 - t8)*1000,
-            "fit_spline": (t10 - t9)*1000,
-            "validate_spline_order": (t11 - t10)*1000
+            "sort_paths": (t2 - t1)*1000,
+            "get_paths_coords_z": (t3 - t2)*1000,
+            "get_gaps_lengths": (t4 - t3)*1000,
+            "get_linspaces": (t5 - t4)*1000,
+            "concatenate_paths_3d": (t6 - t5)*1000,
+            "refine_coords": (t7 - t6)*1000,
+            "fit_spline": (t8 - t7)*1000,
+            "validate_spline_order": (t9 - t8)*1000
         }
 
     @property
     def spline_coords_3d(self) -> npt.NDArray[np.float64]:
         return self._spline_coords_3d
 
-    def generate_paths(self, frame: Frame) -> Union[List[List[types.int64[:]]],
-                                                    List[types.float64]]:
-        paths_coords_2d = List.empty_list(types.ListType(types.int64[:]))
-        paths_lengths_2d = List.empty_list(types.float64)
-        skeleton_pad = np.pad(array=frame.skeleton, pad_width=1)
+    @staticmethod
+    def resample_spline(spline_coords: npt.NDArray[np.float64],
+                        T: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+        """
+        Spline (3, num_of_pts) linearly resampled at T in [0, 1].
+        """
+        if len(spline_coords) == 0:
+            return spline_coords
+        t = np.linspace(0., 1., spline_coords.shape[1], dtype=np.float64)
+        return np.stack([np.interp(T, t, coords) for coords in spline_coords])
 
-        for end_idxs in frame.ends_idxs.T:
-            if skeleton_pad[end_idxs[0] + 1, end_idxs[1] + 1] == 0.0:  # with padding shift
-                continue
-            path_coords_2d = List.empty_list(types.int64[:])
-            length_2d = self.walk(path_coords_2d=path_coords_2d,
-                                  skeleton=skeleton_pad, end_idxs=end_idxs)
-            paths_coords_2d.append(path_coords_2d)
-            paths_lengths_2d.append(length_2d)
+    @property
+    def num_of_fragments(self) -> int:
+        return self._num_of_fragments
 
-        return paths_coords_2d, paths_lengths_2d
+    @property
+    def min_length(self) -> np.int64:
+        return self._min_length
+
+    @property
+    def min_num_of_coords(self) -> int:
+        return 2 * int(self._num_of_knots)
 
     @staticmethod
-    @njit(target_backend='cuda', fastmath=True)
-    def walk(path_coords_2d: List[types.int64[:]], skeleton: npt.NDArray[np.uint8],
-             end_idxs: npt.NDArray[np.int64]) -> np.float64:
-        path_coords_2d.append(np.array([end_idxs[1], end_idxs[0]]))
-        is_finished = False
-        length_2d = 0.0
-
-        while not is_finished:
-            is_finished = True
-            act_coords = path_coords_2d[-1] + 1  # add padding shift
-            skeleton[act_coords[1], act_coords[0]] = 0.0
-            for dx, dy in [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]:
-                if skeleton[act_coords[1] + dy, act_coords[0] + dx]:
-                    # substract padding shift
-                    path_coords_2d.append(
-                        np.array([act_coords[0] + dx - 1, act_coords[1] + dy - 1]))
-                    length_2d += np.linalg.norm(np.array([dx, dy], dtype=np.float64))
-                    is_finished = False
-                    break
+    def count_coords(paths_offsets: npt.NDArray[np.int64],
+                     paths_ids: npt.NDArray[np.int64]) -> int:
+        return int((paths_offsets[paths_ids + 1] - paths_offsets[paths_ids]).sum())
+
+    def predict_window(self, shape: Tuple[int, int],
+                       padding: int) -> Optional[Tuple[int, int, int, int]]:
+        """
+        Predict window (x, y, w, h) of the next frame as a padded bounding rect of the
+        previous spline. None if there is no previous spline.
+        """
+        if len(self._previous_spline_coords_3d) == 0:
+            return None
+
+        x_min, y_min = np.floor(self._previous_spline_coords_3d[:2].min(axis=1)) - padding
+        x_max, y_max = np.ceil(self._previous_spline_coords_3d[:2].max(axis=1)) + padding + 1
+        x_min, y_min = int(max(x_min, 0)), int(max(y_min, 0))
+        x_max, y_max = int(min(x_max, shape[1])), int(min(y_max, shape[0]))
+        if x_max <= x_min or y_max <= y_min:
+            return None
+
+        return x_min, y_min, x_max - x_min, y_max - y_min
+
+    def generate_paths(self, frame: Frame) -> Tuple[npt.NDArray[np.int32],
+                                                    npt.NDArray[np.int64],
+                                                    npt.NDArray[np.float64]]:
+        """
+        Paths as one contiguous (x, y) buffer with offsets: path i is
+        paths_coords_2d[paths_offsets[i]:paths_offsets[i + 1]].
+        """
+        # copy only skeleton roi, workspace keeps the rest (and the padding) zeroed
+        x, y, w, h = frame.mask_roi_coords
+        skeleton_pad = frame.workspace.get("skeleton_pad", np.uint8, pad=1,
+                                           window=(x + 1, y + 1, w, h))
+        if self._path_extractor == "graph":
+            # junctions are kept, the graph splits paths at them
+            skeleton_pad[y + 1:y + 1 + h, x + 1:x + 1 + w] = frame.unpruned_skeleton_roi
+            self._graph.execute(skeleton_pad=skeleton_pad, roi=frame.mask_roi_coords)
+            return self.upscale_paths(
+                paths_coords_2d=self._graph.edges_coords, paths_offsets=self._graph.edges_offsets,
+                paths_lengths_2d=self._graph.edges_lengths, downscale=frame.downscale)
+
+        skeleton_roi = frame.skeleton[y:y + h, x:x + w]
+        skeleton_pad[y + 1:y + 1 + h, x + 1:x + 1 + w] = skeleton_roi
+
+        # every skeleton pixel is walked at most once
+        ends_idxs = np.asarray(frame.ends_idxs, dtype=np.int64).reshape(2, -1)
+        paths_coords_2d = np.empty((np.count_nonzero(skeleton_roi), 2), dtype=np.int32)
+        paths_offsets = np.zeros(ends_idxs.shape[1] + 1, dtype=np.int64)
+        paths_lengths_2d = np.empty(ends_idxs.shape[1], dtype=np.float64)
+        num_of_paths, num_of_coords = self.walk(
+            paths_coords_2d=paths_coords_2d, paths_offsets=paths_offsets,
+            paths_lengths_2d=paths_lengths_2d, skeleton=skeleton_pad, ends_idxs=ends_idxs)
+
+        return self.upscale_paths(
+            paths_coords_2d=paths_coords_2d[:num_of_coords],
+            paths_offsets=paths_offsets[:num_of_paths + 1],
+            paths_lengths_2d=paths_lengths_2d[:num_of_paths], downscale=frame.downscale)
 
-        return length_2d
+    @staticmethod
+    def upscale_paths(paths_coords_2d: npt.NDArray[np.int32], paths_offsets: npt.NDArray[np.int64],
+                      paths_lengths_2d: npt.NDArray[np.float64], downscale: int) -> \
+            Tuple[npt.NDArray[np.int32], npt.NDArray[np.int64], npt.NDArray[np.float64]]:
+        """
+        Paths of the downscaled skeleton in full resolution coordinates and lengths.
+        """
+        if downscale == 1:
+            return paths_coords_2d, paths_offsets, paths_lengths_2d
+        return (paths_coords_2d * np.int32(downscale), paths_offsets,
+                paths_lengths_2d * downscale)
+
+    @property
+    def graph(self) -> SkeletonGraph:
+        return self._graph
+
+    @staticmethod
+    @njit(target_backend='cuda', fastmath=True, cache=True)
+    def walk(paths_coords_2d: npt.NDArray[np.int32], paths_offsets: npt.NDArray[np.int64],
+             paths_lengths_2d: npt.NDArray[np.float64], skeleton: npt.NDArray[np.uint8],
+             ends_idxs: npt.NDArray[np.int64]) -> Tuple[np.int64, np.int64]:
+        dxs = np.array([-1, -1, -1, 0, 0, 1, 1, 1])
+        dys = np.array([-1, 0, 1, -1, 1, -1, 0, 1])
+        step_lengths = np.sqrt(dxs * dxs + dys * dys).astype(np.float64)
+        num_of_paths = 0
+        num_of_coords = 0
+
+        for key in range(ends_idxs.shape[1]):
+            # with padding shift
+            y, x = ends_idxs[0, key] + 1, ends_idxs[1, key] + 1
+            if skeleton[y, x] == 0:
+                continue
+            length_2d = 0.0
+            is_finished = False
+            while not is_finished:
+                # substract padding shift
+                paths_coords_2d[num_of_coords, 0] = x - 1
+                paths_coords_2d[num_of_coords, 1] = y - 1
+                num_of_coords += 1
+                skeleton[y, x] = 0
+                is_finished = True
+                for k in range(8):
+                    if skeleton[y + dys[k], x + dxs[k]]:
+                        y, x = y + dys[k], x + dxs[k]
+                        length_2d += step_lengths[k]
+                        is_finished = False
+                        break
+            paths_lengths_2d[num_of_paths] = length_2d
+            num_of_paths += 1
+            paths_offsets[num_of_paths] = num_of_coords
+
+        return num_of_paths, num_of_coords
 
     @staticmethod
-    @njit(target_backend='cuda', fastmath=True)
-    def paths_filter(paths_coords_2d_filtered: List[List[types.int64[:]]],
-                     paths_lengths_2d_filtered: List[types.float64],
-                     paths_coords_2d: List[List[types.int64[:]]],
-                     paths_lengths_2d: List[types.float64],
-                     min_length: np.float64) -> None:
-
-        for key, value in enumerate(paths_lengths_2d):
-            if value >= min_length:
-                paths_coords_2d_filtered.append(paths_coords_2d[key])
-                paths_lengths_2d_filtered.append(value)
-
-    def sort_paths(self, paths_coords_2d: List[List[types.int64[:]]],
-                   paths_lengths_2d: List[types.float64]) -> Union[List[List[types.int64[:]]],
-                                                                   List[types.float64]]:
+    @njit(target_backend='cuda', fastmath=True, cache=True)
+    def paths_filter(paths_lengths_2d: npt.NDArray[np.float64],
+                     min_length: np.float64) -> npt.NDArray[np.int64]:
+        return np.flatnonzero(paths_lengths_2d >= min_length)
+
+    def order_paths(self, paths_coords_2d: npt.NDArray[np.int32],
+                    paths_offsets: npt.NDArray[np.int64],
+                    paths_ids: npt.NDArray[np.int64]) -> Tuple[npt.NDArray[np.int64],
+                                                               npt.NDArray[np.bool_], bool]:
+        """
+        `sort_paths` result and a flag if the previous chain was reused. With incremental order,
+        paths matched one to one to the previous chain by ends proximity keep its order, the
+        full ordering runs when the number of paths changes or matching fails.
+        """
+        is_reused = False
+        if self._incremental_order and len(paths_ids) == self._num_of_chain_candidates:
+            paths_order, paths_reversed, is_reused = self.match_chain(
+                paths_coords_2d=paths_coords_2d, paths_offsets=paths_offsets,
+                paths_ids=paths_ids, chain_ends=self._chain_ends, radius=ORDER_MATCH_RADIUS)
+        if not is_reused:
+            paths_order, paths_reversed = self.sort_paths(
+                paths_coords_2d=paths_coords_2d, paths_offsets=paths_offsets, paths_ids=paths_ids)
+
+        if self._incremental_order:
+            firsts, lasts = paths_offsets[paths_order], paths_offsets[paths_order + 1] - 1
+            begins = np.where(paths_reversed, lasts, firsts)
+            ends = np.where(paths_reversed, firsts, lasts)
+            self._chain_ends = np.stack(
+                [paths_coords_2d[begins], paths_coords_2d[ends]], axis=1).astype(np.float64)
+            self._num_of_chain_candidates = len(paths_ids)
+        return paths_order, paths_reversed, is_reused
+
+    @staticmethod
+    @njit(target_backend='cuda', fastmath=True, cache=True, nogil=True)
+    def match_chain(paths_coords_2d: npt.NDArray[np.int32], paths_offsets: npt.NDArray[np.int64],
+                    paths_ids: npt.NDArray[np.int64], chain_ends: npt.NDArray[np.float64],
+                    radius: np.float64) -> Tuple[npt.NDArray[np.int64], npt.NDArray[np.bool_],
+                                                 bool]:
+        """
+        Paths matched greedily to consecutive chain positions, both ends of a path have to be
+        within `radius` of the ends of the chain path, in either direction.
+        """
+        num_of_chain_paths = len(chain_ends)
+        paths_order = np.empty(num_of_chain_paths, dtype=np.int64)
+        paths_reversed = np.empty(num_of_chain_paths, dtype=np.bool_)
+        is_used = np.zeros(len(paths_ids), dtype=np.bool_)
+        for k in range(num_of_chain_paths):
+            best_dist = radius
+            best_key = -1
+            for key in range(len(paths_ids)):
+                if is_used[key]:
+                    continue
+                first = paths_coords_2d[paths_offsets[paths_ids[key]]].astype(np.float64)
+                last = paths_coords_2d[paths_offsets[paths_ids[key] + 1] - 1].astype(np.float64)
+                dist = max(np.linalg.norm(first - chain_ends[k, 0]),
+                           np.linalg.norm(last - chain_ends[k, 1]))
+                dist_reversed = max(np.linalg.norm(last - chain_ends[k, 0]),
+                                    np.linalg.norm(first - chain_ends[k, 1]))
+                if min(dist, dist_reversed) <= best_dist:
+                    best_dist = min(dist, dist_reversed)
+                    best_key = key
+                    paths_reversed[k] = dist_reversed < dist
+            if best_key < 0:
+                return paths_order, paths_reversed, False
+            is_used[best_key] = True
+            paths_order[k] = paths_ids[best_key]
+        return paths_order, paths_reversed, True
+
+    def sort_paths(self, paths_coords_2d: npt.NDArray[np.int32],
+                   paths_offsets: npt.NDArray[np.int64],
+                   paths_ids: npt.NDArray[np.int64]) -> Tuple[npt.NDArray[np.int64],
+                                                              npt.NDArray[np.bool_]]:
+        """
+        Order of the paths given by `paths_ids` and flags of paths to be traversed reversed.
+        """
         MAX = 1e10
         m = 0.05
         conn = List.empty_list(types.int64[:])
@@ -193,48 +448,44 @@ class DeformableLinearObject:
             key_type=types.int64,
             value_type=types.int64,
         )
-        len_paths_coords_2d = len(paths_coords_2d)
+        len_paths_coords_2d = len(paths_ids)
 
         for i in range(len_paths_coords_2d):
             stats[i] = 0
-        resultant_paths_coords_2d = List.empty_list(types.ListType(types.int64[:]))
-        resultant_paths_lengths_2d = List.empty_list(types.float64)
 
         # calculate dists between all endings
-        begins = np.array([c[0] for c in paths_coords_2d])
-        ends = np.array([c[-1] for c in paths_coords_2d])
-
-        begin_vectors = np.array(
-            [path_coords_2d[0] -
-             path_coords_2d[min(self._vector_dir_len, len(path_coords_2d) - 1)]
-             for path_coords_2d in paths_coords_2d],
-            dtype=np.float64)
-        end_vectors = np.array(
-            [path_coords_2d[-1] -
-             path_coords_2d[max(-self._vector_dir_len - 1, - len(path_coords_2d))]
-             for path_coords_2d in paths_coords_2d],
-            dtype=np.float64)
-        begin_directions = np.array([np.arctan2(begin_vector[0], begin_vector[1])
-                                    for begin_vector in begin_vectors], dtype=np.float64)
-        end_directions = np.array([np.arctan2(end_vector[0], end_vector[1])
-                                  for end_vector in end_vectors], dtype=np.float64)
+        firsts = paths_offsets[paths_ids]
+        lasts = paths_offsets[paths_ids + 1] - 1
+        shifts = np.minimum(self._vector_dir_len, lasts - firsts)
+        begins = paths_coords_2d[firsts].astype(np.float64)
+        ends = paths_coords_2d[lasts].astype(np.float64)
+        begin_vectors = begins - paths_coords_2d[firsts + shifts]
+        end_vectors = ends - paths_coords_2d[lasts - shifts]
+        begin_directions = np.arctan2(begin_vectors[:, 0], begin_vectors[:, 1])
+        end_directions = np.arctan2(end_vectors[:, 0], end_vectors[:, 1])
 
         be = np.concatenate([begins, ends], axis=0)
-        dists = np.linalg.norm(be[np.newaxis] - be[:, np.newaxis], axis=-1)
         be_dirs = np.concatenate([begin_directions, end_directions], axis=0)
-        dists_dirs = np.abs(np.pi - np.abs(be_dirs[np.newaxis] - be_dirs[:, np.newaxis]))
 
-        dists = m * dists + (1 - m) * dists_dirs
+        # greadily choose connections
+        if len_paths_coords_2d > DENSE_ORDER_MAX_PATHS:
+            self.find_order_of_paths_sparse(
+                conn=conn, skips=skips, stats=stats, be=be, be_dirs=be_dirs,
+                len_paths_coords_2d=len_paths_coords_2d, m=m)
+        else:
+            dists = np.linalg.norm(be[np.newaxis] - be[:, np.newaxis], axis=-1)
+            dists_dirs = np.abs(np.pi - np.abs(be_dirs[np.newaxis] - be_dirs[:, np.newaxis]))
 
-        dists[np.arange(2 * len_paths_coords_2d),
-              (np.arange(2 * len_paths_coords_2d) + len_paths_coords_2d) %
-              (2 * len_paths_coords_2d)] = MAX
-        dists[np.arange(2 * len_paths_coords_2d), np.arange(2 * len_paths_coords_2d)] = MAX
+            dists = m * dists + (1 - m) * dists_dirs
 
-        # greadily choose connections
-        self.find_order_of_paths(
-            conn=conn, skips=skips, stats=stats, dists=dists,
-            len_paths_coords_2d=len_paths_coords_2d)
+            dists[np.arange(2 * len_paths_coords_2d),
+                  (np.arange(2 * len_paths_coords_2d) + len_paths_coords_2d) %
+                  (2 * len_paths_coords_2d)] = MAX
+            dists[np.arange(2 * len_paths_coords_2d), np.arange(2 * len_paths_coords_2d)] = MAX
+
+            self.find_order_of_paths(
+                conn=conn, skips=skips, stats=stats, dists=dists,
+                len_paths_coords_2d=len_paths_coords_2d)
 
         # find starting index
         z = np.array(conn)
@@ -246,16 +497,16 @@ class DeformableLinearObject:
                 break
 
         # traverse and build path
-        self.pick_best_paths(
-            paths_coords_2d=paths_coords_2d, paths_lengths_2d=paths_lengths_2d,
-            len_paths_coords_2d=len_paths_coords_2d,
-            resultant_paths_coords_2d=resultant_paths_coords_2d,
-            resultant_paths_lengths_2d=resultant_paths_lengths_2d, start_id=start_id, skips=skips)
+        paths_order = np.empty(len_paths_coords_2d, dtype=np.int64)
+        paths_reversed = np.empty(len_paths_coords_2d, dtype=np.bool_)
+        num_of_paths = self.pick_best_paths(
+            paths_order=paths_order, paths_reversed=paths_reversed,
+            len_paths_coords_2d=len_paths_coords_2d, start_id=start_id, skips=skips)
 
-        return resultant_paths_coords_2d, resultant_paths_lengths_2d
+        return paths_ids[paths_order[:num_of_paths]], paths_reversed[:num_of_paths]
 
     @staticmethod
-    @njit(target_backend='cuda', fastmath=True)
+    @njit(target_backend='cuda', fastmath=True, cache=True, nogil=True)
     def find_order_of_paths(
             conn: List[types.int64[:]],
             skips: Dict[types.int64, types.int64],
@@ -289,95 +540,275 @@ class DeformableLinearObject:
             loss += m_value
         return loss
 
+    def find_order_of_paths_sparse(
+            self, conn: List[types.int64[:]],
+            skips: Dict[types.int64, types.int64],
+            stats: Dict[types.int64, types.int64],
+            be: npt.NDArray[np.float64], be_dirs: npt.NDArray[np.float64],
+            len_paths_coords_2d: np.int64, m: np.float64) -> None:
+        """
+        Same greedy choice as `find_order_of_paths` without the dense distances matrix.
+
+        Candidate pairs of endings are taken from a KD-tree within a radius and kept in
+        a priority queue sorted by (distance, index in the dense matrix), which reproduces
+        argmin tie breaking. Pairs beyond the radius cost at least m * radius, so the queue
+        head is the global minimum while it is cheaper; otherwise the radius is doubled.
+        Dense rows and columns cleared by the greedy are tracked as alive flags.
+        """
+        from scipy.spatial import cKDTree
+
+        num_of_ends = 2 * len_paths_coords_2d
+        rows_alive = np.ones(num_of_ends, dtype=np.bool_)
+        cols_alive = np.ones(num_of_ends, dtype=np.bool_)
+        num_of_singles = np.zeros(1, dtype=np.int64)
+
+        values = np.empty(0, dtype=np.float64)
+        idxs = np.empty(0, dtype=np.int64)
+        prev_radius = -1.0
+        radius = ORDER_RADIUS
+        while True:
+            # only endings still present in the dense matrix take part in the search
+            ends_ids = np.flatnonzero(rows_alive | cols_alive)
+            ends = be[ends_ids]
+            if radius >= np.linalg.norm(ends.max(axis=0) - ends.min(axis=0)):
+                radius = np.inf
+                pairs = np.stack(np.triu_indices(len(ends_ids), k=1), axis=1)
+            else:
+                pairs = cKDTree(ends).query_pairs(radius * (1 + 1e-6) + 1e-6,
+                                                  output_type='ndarray')
+            pairs = ends_ids[pairs.reshape(-1, 2)]
+            i, j = pairs[:, 0], pairs[:, 1]
+            diff = be[j] - be[i]
+            pairs_dists = np.sqrt(diff[:, 0] * diff[:, 0] + diff[:, 1] * diff[:, 1])
+            valid = (i % len_paths_coords_2d != j % len_paths_coords_2d) & \
+                (pairs_dists > prev_radius) & (pairs_dists <= radius)
+            i, j, pairs_dists = i[valid], j[valid], pairs_dists[valid]
+            pairs_dirs = np.abs(np.pi - np.abs(be_dirs[j] - be_dirs[i]))
+            pairs_values = m * pairs_dists + (1 - m) * pairs_dirs
+
+            # both directions of a pair, the dense matrix clears rows and columns separately
+            values = np.concatenate([values, pairs_values, pairs_values])
+            idxs = np.concatenate([idxs, i * num_of_ends + j, j * num_of_ends + i])
+            alive = rows_alive[idxs // num_of_ends] & cols_alive[idxs % num_of_ends]
+            values, idxs = values[alive], idxs[alive]
+            order = np.lexsort((idxs, values))
+            values, idxs = values[order], idxs[order]
+
+            key, is_finished = self.pop_connections(
+                conn=conn, skips=skips, stats=stats, values=values, idxs=idxs,
+                bound=m * radius, rows_alive=rows_alive, cols_alive=cols_alive,
+                num_of_singles=num_of_singles, len_paths_coords_2d=len_paths_coords_2d)
+            if is_finished or np.isinf(radius):
+                break
+            values, idxs = values[key:], idxs[key:]
+            prev_radius = radius
+            radius *= 2
+
     @staticmethod
-    @njit(target_backend='cuda', fastmath=True)
+    @njit(target_backend='cuda', fastmath=True, cache=True, nogil=True)
+    def pop_connections(
+            conn: List[types.int64[:]],
+            skips: Dict[types.int64, types.int64],
+            stats: Dict[types.int64, types.int64],
+            values: npt.NDArray[np.float64], idxs: npt.NDArray[np.int64],
+            bound: np.float64, rows_alive: npt.NDArray[np.bool_],
+            cols_alive: npt.NDArray[np.bool_], num_of_singles: npt.NDArray[np.int64],
+            len_paths_coords_2d: np.int64) -> Tuple[np.int64, bool]:
+        num_of_ends = 2 * len_paths_coords_2d
+
+        def has_candidates():
+            # any alive (row, column) pair of endings of different paths
+            row_path_id, col_path_id = -1, -1
+            for end_id in range(num_of_ends):
+                path_id = end_id % len_paths_coords_2d
+                if rows_alive[end_id]:
+                    if row_path_id == -1:
+                        row_path_id = path_id
+                    elif row_path_id != path_id:
+                        row_path_id = -2
+                if cols_alive[end_id]:
+                    if col_path_id == -1:
+                        col_path_id = path_id
+                    elif col_path_id != path_id:
+                        col_path_id = -2
+            if row_path_id == -1 or col_path_id == -1:
+                return False
+            return row_path_id == -2 or col_path_id == -2 or row_path_id != col_path_id
+
+        key = 0
+        while True:
+            if not has_candidates():
+                return key, True
+            while key < len(idxs) and not (rows_alive[idxs[key] // num_of_ends] and
+                                           cols_alive[idxs[key] % num_of_ends]):
+                key += 1
+            if key == len(idxs) or values[key] >= bound:
+                return key, False
+
+            mx = idxs[key] // num_of_ends
+            my = idxs[key] % num_of_ends
+            key += 1
+            rows_alive[mx] = False
+            rows_alive[my] = False
+            if stats[mx % len_paths_coords_2d] == 1 and stats[my % len_paths_coords_2d] == 1 \
+                    and num_of_singles[0] == 2:
+                continue
+            cols_alive[mx] = False
+            cols_alive[my] = False
+            if not has_candidates():
+                return key, True
+            conn.append(np.array([mx % len_paths_coords_2d, my % len_paths_coords_2d]))
+            skips[mx] = my
+            skips[my] = mx
+            for path_id in (mx % len_paths_coords_2d, my % len_paths_coords_2d):
+                stats[path_id] += 1
+                num_of_singles[0] += 1 if stats[path_id] == 1 else -1
+
+    @staticmethod
+    @njit(target_backend='cuda', fastmath=True, cache=True, nogil=True)
     def pick_best_paths(
-            paths_coords_2d: List[List[types.int64[:]]],
-            paths_lengths_2d: List[types.float64],
-            len_paths_coords_2d: np.int64, resultant_paths_coords_2d: List[List[types.int64[:]]],
-            resultant_paths_lengths_2d: List[types.float64],
-            start_id: np.int64, skips: Dict[types.int64, types.int64]) -> None:
+            paths_order: npt.NDArray[np.int64], paths_reversed: npt.NDArray[np.bool_],
+            len_paths_coords_2d: np.int64, start_id: np.int64,
+            skips: Dict[types.int64, types.int64]) -> np.int64:
+        num_of_paths = 0
         act_id = start_id if start_id in skips else start_id + len_paths_coords_2d
         while True:
-            path_coords_2d = paths_coords_2d[act_id % len_paths_coords_2d]
-            length_2d = paths_lengths_2d[act_id % len_paths_coords_2d]
-            if act_id < len_paths_coords_2d:
-                path_coords_2d = path_coords_2d[::-1]
-            resultant_paths_coords_2d.append(path_coords_2d)
-            resultant_paths_lengths_2d.append(length_2d)
+            paths_order[num_of_paths] = act_id % len_paths_coords_2d
+            paths_reversed[num_of_paths] = act_id < len_paths_coords_2d
+            num_of_paths += 1
             if act_id not in skips:
                 break
             act_id = skips[act_id]
             act_id = act_id + len_paths_coords_2d \
                 if act_id < len_paths_coords_2d else act_id - len_paths_coords_2d
+        return num_of_paths
 
     @staticmethod
-    @njit(target_backend='cuda', fastmath=True)
-    def get_paths_coords_z(paths_coords_z: List[List[types.float64]],
-                           paths_coords_2d: List[List[types.int64[:]]],
-                           depth: npt.NDArray[np.float64], z_vertical_shift=np.float64) -> None:
-
-        for path_coords_2d in paths_coords_2d:
-            z_coords = [
-                [np.int64(
-                    min(
-                        max(
-                            np.around(
-                                path_coord[0] + z_vertical_shift / depth.shape[1] * 2 *
-                                (depth.shape[1] / 2 - path_coord[0])),
-                            0),
-                        depth.shape[1] - 1)),
-                 path_coord[1]] for path_coord in path_coords_2d]
-            z = [depth[z_coord[1], z_coord[0]] for z_coord in z_coords]
-            paths_coords_z.append(List(z))
+    @njit(target_backend='cuda', fastmath=True, cache=True, nogil=True)
+    def get_paths_idxs(paths_offsets: npt.NDArray[np.int64], paths_order: npt.NDArray[np.int64],
+                       paths_reversed: npt.NDArray[np.bool_]) -> npt.NDArray[np.int64]:
+        """
+        Indices of coordinates of the ordered paths, reversed paths are an index flip.
+        """
+        num_of_coords = 0
+        for key in paths_order:
+            num_of_coords += paths_offsets[key + 1] - paths_offsets[key]
+        paths_idxs = np.empty(num_of_coords, dtype=np.int64)
+        i = 0
+        for key in range(len(paths_order)):
+            first, stop = paths_offsets[paths_order[key]], paths_offsets[paths_order[key] + 1]
+            for j in range(stop - first):
+                paths_idxs[i] = stop - 1 - j if paths_reversed[key] else first + j
+                i += 1
+        return paths_idxs
 
     @staticmethod
-    @njit(target_backend='cuda', fastmath=True)
-    def get_gaps_lengths(
-            paths_coords_2d: List[List[types.int64[:]]],
-            gaps_lengths_2d: List[types.float64]) -> List:
-        for key, _ in enumerate(paths_coords_2d[:-1]):
-            gap_length = np.linalg.norm(
-                (paths_coords_2d[key][-1] - paths_coords_2d[key + 1][0]).astype(np.float64))
-            gaps_lengths_2d.append(gap_length)
+    @njit(target_backend='cuda', fastmath=True, cache=True, nogil=True)
+    def get_paths_coords_z(paths_coords_2d: npt.NDArray[np.int32],
+                           paths_idxs: npt.NDArray[np.int64],
+                           depth: npt.NDArray, depth_ranges: npt.NDArray[np.float64],
+                           depth_scale: np.float64, z_vertical_shift=np.float64,
+                           median_radius: np.int64 = 0) -> npt.NDArray[np.float64]:
+        """
+        Depth gathered at path coordinates. Depth of any dtype, ranges (raw units) and scale
+        are applied to sampled pixels only. Holes (out of ranges or zero) are filled with
+        median of valid pixels in the window of `median_radius` if it is positive.
+        """
+        paths_coords_z = np.empty(len(paths_idxs), dtype=np.float64)
+        window = np.empty((2 * median_radius + 1) ** 2, dtype=np.float64)
+        for key in range(len(paths_idxs)):
+            x = paths_coords_2d[paths_idxs[key], 0]
+            y = paths_coords_2d[paths_idxs[key], 1]
+            z_x = np.int64(
+                min(
+                    max(
+                        np.around(
+                            x + z_vertical_shift / depth.shape[1] * 2 * (depth.shape[1] / 2 - x)),
+                        0),
+                    depth.shape[1] - 1))
+            z = depth[y, z_x]
+            if z >= depth_ranges[0] and z <= depth_ranges[1]:
+                paths_coords_z[key] = z * depth_scale
+            else:
+                paths_coords_z[key] = 0.0
+            if paths_coords_z[key] != 0.0 or median_radius == 0:
+                continue
+
+            num_of_valid = 0
+            for v in range(max(y - median_radius, 0),
+                           min(y + median_radius + 1, depth.shape[0])):
+                for u in range(max(z_x - median_radius, 0),
+                               min(z_x + median_radius + 1, depth.shape[1])):
+                    z = depth[v, u]
+                    if z != 0 and z >= depth_ranges[0] and z <= depth_ranges[1]:
+                        window[num_of_valid] = z
+                        num_of_valid += 1
+            if num_of_valid > 0:
+                paths_coords_z[key] = np.median(window[:num_of_valid]) * depth_scale
+        return paths_coords_z
 
     @staticmethod
-    @njit(target_backend='cuda', fastmath=True)
-    def get_linspaces(
-            paths_coords_2d: List[List[types.int64[:]]],
-            paths_lengths_2d: List[types.float64],
-            gaps_lengths_2d: List[types.float64],
-            linspaces_2d: List[types.float64[:]]) -> None:
-        full_length = sum(paths_lengths_2d) + sum(gaps_lengths_2d)
-        curr_value = 0
-        for key, path_length_2d in enumerate(paths_lengths_2d):
-            linspaces_2d.append(np.linspace(curr_value, curr_value + path_length_2d / full_length,
-                                            len(paths_coords_2d[key])))
+    @njit(target_backend='cuda', fastmath=True, cache=True, nogil=True)
+    def get_gaps_lengths(paths_coords_2d: npt.NDArray[np.int32],
+                         paths_offsets: npt.NDArray[np.int64],
+                         paths_order: npt.NDArray[np.int64],
+                         paths_reversed: npt.NDArray[np.bool_]) -> npt.NDArray[np.float64]:
+        gaps_lengths_2d = np.empty(max(len(paths_order) - 1, 0), dtype=np.float64)
+        for key in range(len(paths_order) - 1):
+            prev_id, next_id = paths_order[key], paths_order[key + 1]
+            prev_end = paths_offsets[prev_id] if paths_reversed[key] \
+                else paths_offsets[prev_id + 1] - 1
+            next_begin = paths_offsets[next_id + 1] - 1 if paths_reversed[key + 1] \
+                else paths_offsets[next_id]
+            gaps_lengths_2d[key] = np.linalg.norm(
+                (paths_coords_2d[prev_end] - paths_coords_2d[next_begin]).astype(np.float64))
+        return gaps_lengths_2d
+
+    @staticmethod
+    @njit(target_backend='cuda', fastmath=True, cache=True, nogil=True)
+    def get_linspaces(paths_offsets: npt.NDArray[np.int64],
+                      paths_lengths_2d: npt.NDArray[np.float64],
+                      paths_order: npt.NDArray[np.int64],
+                      gaps_lengths_2d: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+        """
+        Concatenated linspaces of the ordered paths, one value per path coordinate.
+        """
+        paths_length_2d = 0.0
+        for key in paths_order:
+            paths_length_2d += paths_lengths_2d[key]
+        gaps_length_2d = 0.0
+        for gap_length_2d in gaps_lengths_2d:
+            gaps_length_2d += gap_length_2d
+        full_length = paths_length_2d + gaps_length_2d
+
+        linspace_2d = np.empty(paths_offsets[-1], dtype=np.float64)
+        num_of_coords = 0
+        curr_value = 0.0
+        for key in range(len(paths_order)):
+            path_length_2d = paths_lengths_2d[paths_order[key]]
+            len_path = paths_offsets[paths_order[key] + 1] - paths_offsets[paths_order[key]]
+            linspace_2d[num_of_coords:num_of_coords + len_path] = np.linspace(
+                curr_value, curr_value + path_length_2d / full_length, len_path)
+            num_of_coords += len_path
             curr_value += path_length_2d / full_length
             if key < len(gaps_lengths_2d):
                 curr_value += gaps_lengths_2d[key] / full_length
+        return linspace_2d[:num_of_coords]
 
     @staticmethod
-    @njit(target_backend='cuda', fastmath=True)
-    def concatenate_paths_3d(
-            paths_coords_2d: List[List[types.int64[:]]],
-            paths_lengths_2d: List[types.float64],
-            gaps_lengths_2d: List[types.float64],
-            paths_coords_z: List[List[types.float64]],
-            full_path_coords_3d: List[types.int64[:]]) -> np.float64:
-        for key_1, path_coords_2d in enumerate(paths_coords_2d):
-            for key_2, coord_2d in enumerate(path_coords_2d):
-                full_path_coords_3d.append(
-                    np.array(
-                        [coord_2d[0],
-                         coord_2d[1],
-                         paths_coords_z[key_1][key_2]],
-                        dtype=np.float64))
-        full_path_length_2d = sum(paths_lengths_2d) + sum(gaps_lengths_2d)
-        return full_path_length_2d
+    @njit(target_backend='cuda', fastmath=True, cache=True, nogil=True)
+    def concatenate_paths_3d(paths_coords_2d: npt.NDArray[np.int32],
+                             paths_idxs: npt.NDArray[np.int64],
+                             paths_coords_z: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+        full_path_coords_3d = np.empty((3, len(paths_idxs)), dtype=np.float64)
+        for key in range(len(paths_idxs)):
+            full_path_coords_3d[0, key] = paths_coords_2d[paths_idxs[key], 0]
+            full_path_coords_3d[1, key] = paths_coords_2d[paths_idxs[key], 1]
+            full_path_coords_3d[2, key] = paths_coords_z[key]
+        return full_path_coords_3d
 
     @staticmethod
-    @njit(target_backend='cuda', fastmath=True)
+    @njit(target_backend='cuda', fastmath=True, cache=True, nogil=True)
     def validate_spline_order(spline_coords: npt.NDArray[np.float64],
                               previous_spline_coords: npt.NDArray[np.float64]) -> \
             npt.NDArray[np.float64]:
@@ -392,9 +823,24 @@ class DeformableLinearObject:
         else:
             return spline_coords
 
-    def fit_spline(self, path_coords_3d: List[types.float64[:]],
+    def fit_spline(self, path_coords_3d: npt.NDArray[np.float64],
                    linspace_2d: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
-        xyz = np.stack(path_coords_3d, axis=1)
+        if self._spline_fitter == "batched":
+            spline_coords = self._bspline.fit(t=linspace_2d, coords=path_coords_3d)
+        else:
+            spline_coords = self.fit_spline_scipy(
+                path_coords_3d=path_coords_3d, linspace_2d=linspace_2d)
+
+        # fix z outliers
+        spline_coords[2] = self._poly_features @ (self._poly_features_pinv @ spline_coords[2])
+
+        return spline_coords
+
+    def fit_spline_scipy(self, path_coords_3d: npt.NDArray[np.float64],
+                         linspace_2d: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+        from scipy.interpolate import LSQUnivariateSpline
+
+        xyz = path_coords_3d
         k = self._num_of_knots - 4
         d = np.int64((linspace_2d.shape[0] - 2) / k) + 1
         knots = linspace_2d[1:-1:d]
@@ -411,13 +857,7 @@ class DeformableLinearObject:
         except IndexError:
             self.z_spline = LSQUnivariateSpline(linspace_2d, xyz[2], knots)
 
-        spline_coords = np.stack(
+        return np.stack(
             (self.x_spline(self._T),
              self.y_spline(self._T),
              self.z_spline(self._T)))
-
-        # fix z outliers
-        self._poly_reg_model.fit(self._poly_features, spline_coords[2])
-        spline_coords[2] = self._poly_reg_model.predict(self._poly_features)
-
-        return spline_coords
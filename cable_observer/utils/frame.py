@@ -15,13 +15,22 @@
 # limitations under the License.
 
 from abc import ABC, abstractmethod
-from typing import Dict
+from typing import Dict, Optional, Tuple
 
 import numpy as np
 import numpy.typing as npt
 from numba import types
 from numba.typed import List
 
+try:
+    from utils.workspace import Workspace
+except ImportError:
+    from cable_observer.utils.workspace import Workspace
+
+
+# depth which is already gated and scaled, finite as kernels are compiled with fastmath
+NO_DEPTH_RANGES = np.array([np.finfo(np.float64).min, np.finfo(np.float64).max])
+
 
 class Frame(ABC):
     def __init__(self) -> None:
@@ -30,7 +39,11 @@ class Frame(ABC):
         self._mask_roi_coords = np.array([], dtype=np.int64)
         self._depth = np.array([], dtype=np.float64)
         self._skeleton = np.array([], dtype=np.uint8)
+        self._unpruned_skeleton_roi = np.array([], dtype=np.uint8)
         self._ends_idxs = List.empty_list(types.int64[:])
+        self._window = None
+        self._downscale = 1
+        self._workspace = Workspace()
 
     @abstractmethod
     def execute(self) -> Dict[str, float]:
@@ -56,6 +69,15 @@ class Frame(ABC):
     def skeleton(self) -> npt.NDArray[np.uint8]:
         return self._skeleton
 
+    @property
+    @abstractmethod
+    def unpruned_skeleton_roi(self) -> npt.NDArray[np.uint8]:
+        """
+        Skeleton within `mask_roi_coords` before pixels with more than two neighbours
+        (junctions) are removed, `skeleton` is pruned.
+        """
+        return self._unpruned_skeleton_roi
+
     @property
     @abstractmethod
     def ends_idxs(self) -> List[types.int64[:]]:
@@ -65,3 +87,37 @@ class Frame(ABC):
     @abstractmethod
     def depth(self) -> npt.NDArray[np.float32]:
         return self._depth
+
+    @property
+    @abstractmethod
+    def depth_sampling(self) -> Tuple[npt.NDArray[np.float64], np.float64]:
+        """
+        Ranges (raw units) and scale which are still to be applied to sampled `depth` values.
+        """
+        return NO_DEPTH_RANGES, np.float64(1.0)
+
+    @property
+    @abstractmethod
+    def downscale(self) -> int:
+        """
+        Processing resolution divisor, mask, skeleton and `window` are in processing coordinates,
+        `depth` is in full resolution.
+        """
+        return self._downscale
+
+    @abstractmethod
+    def refine_coords(self, path_coords_3d: npt.NDArray[np.float64]) -> None:
+        """
+        Refine (x, y) rows of ordered full resolution path coordinates in place.
+        """
+        pass
+
+    @property
+    @abstractmethod
+    def window(self) -> Optional[Tuple[int, int, int, int]]:
+        return self._window
+
+    @property
+    @abstractmethod
+    def workspace(self) -> Workspace:
+        return self._workspace
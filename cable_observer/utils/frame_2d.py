@@ -14,42 +14,98 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from functools import lru_cache
 from time import perf_counter
-from typing import Dict
+from typing import Dict, Optional, Tuple
 
 import cv2
 import numpy as np
 import numpy.typing as npt
-from skimage.morphology import skeletonize
 from numba import njit
 from numba.typed import List
 from numba.core import types
 
 try:
-    from utils.frame import Frame
+    from utils.frame import Frame, NO_DEPTH_RANGES
+    from utils.workspace import Workspace
 except ImportError:
-    from cable_observer.utils.frame import Frame
+    from cable_observer.utils.frame import Frame, NO_DEPTH_RANGES
+    from cable_observer.utils.workspace import Workspace
+
+
+MASK_BACKENDS = ("hsv", "lut")
+SKELETON_BACKENDS = ("lee", "guo_hall")
+DOWNSCALES = (1, 2, 4)
+MORPHOLOGY_KERNEL = 3  # px, full resolution size of the opening kernel
+# max distance [px] from a coarse path point to the cable border searched by the refinement
+REFINE_RADIUS = 32
 
 
 class Frame2D(Frame):
-    def __init__(self, *, hsv_ranges: List[int] = [0, 0, 0, 179, 255, 255]) -> None:
+    def __init__(self, *, hsv_ranges: List[int] = [0, 0, 0, 179, 255, 255],
+                 roi_guard: int = 1, mask_backend: str = "hsv",
+                 skeleton_backend: str = "lee", downscale: int = 1,
+                 refine: bool = False) -> None:
+        self.check_backends(mask_backend=mask_backend, skeleton_backend=skeleton_backend)
         self._hsv_ranges = np.array(hsv_ranges, dtype=np.uint8)
+        self._mask_backend = mask_backend
+        self._skeleton_backend = skeleton_backend
+        # full resolution pixels
+        self._roi_guard = max(1, roi_guard)
+        self._img = None
+        self._window = None
+        self._workspace = Workspace()
         self._mask = np.array([], dtype=np.uint8)
         self._mask_roi = np.array([], dtype=np.uint8)
         self._mask_roi_coords = np.array([], dtype=np.int64)
         self._depth = np.array([], dtype=np.float64)
         self._skeleton = np.array([], dtype=np.uint8)
+        self._unpruned_skeleton_roi = np.array([], dtype=np.uint8)
         self._ends_idxs = List.empty_list(types.int64[:])
+        self.set_quality(downscale=downscale, refine=refine)
+
+    @staticmethod
+    def check_backends(mask_backend: str, skeleton_backend: str) -> None:
+        if mask_backend not in MASK_BACKENDS:
+            raise ValueError(f"Unknown mask backend '{mask_backend}', expected {MASK_BACKENDS}")
+        if skeleton_backend not in SKELETON_BACKENDS:
+            raise ValueError(f"Unknown skeleton backend '{skeleton_backend}', "
+                             f"expected {SKELETON_BACKENDS}")
 
-    def execute(self, img: npt.NDArray[np.uint8]) -> Dict[str, float]:
+    @staticmethod
+    def check_downscale(downscale: int) -> None:
+        if downscale not in DOWNSCALES:
+            raise ValueError(f"Unsupported downscale {downscale}, expected {DOWNSCALES}")
+
+    def set_parameters(self, *, hsv_ranges: List[int], roi_guard: int, mask_backend: str,
+                       skeleton_backend: str) -> None:
+        """
+        Settings which may be changed between frames. Frame buffers are kept, the lookup
+        table of the mask is cached per `hsv_ranges`.
+        """
+        self.check_backends(mask_backend=mask_backend, skeleton_backend=skeleton_backend)
+        self._hsv_ranges = np.array(hsv_ranges, dtype=np.uint8)
+        self._mask_backend = mask_backend
+        self._skeleton_backend = skeleton_backend
+        self._roi_guard = max(1, roi_guard)
+
+    def set_quality(self, *, downscale: int = 1, refine: bool = False,
+                    morphology: bool = True) -> None:
+        """
+        Processing resolution and optional stages, may be changed between frames.
+        Mask, skeleton and paths are computed at 1 / downscale of the image resolution.
+        """
+        self.check_downscale(downscale=downscale)
+        self._downscale = downscale
+        self._refine = refine
+        self._morphology = morphology
+
+    def execute(self, img: npt.NDArray[np.uint8],
+                window: Optional[Tuple[int, int, int, int]] = None) -> Dict[str, float]:
         t1 = perf_counter()
-        if len(img.shape) == 3 and img.shape[2] == 3:
-            hsv_img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-            self._mask = self.set_hsv_mask(hsv_img=hsv_img, hsv_ranges=self._hsv_ranges)
-        else:
-            self._mask = self.set_binary_mask(img=img)
+        self._window = self.set_mask(img=img, window=window)
         t2 = perf_counter()
-        self.set_morphology()
+        self.set_morphology(erode=self._morphology, dilate=self._morphology)
         t3 = perf_counter()
         self.set_skeleton()
         t4 = perf_counter()
@@ -75,6 +131,10 @@ class Frame2D(Frame):
     def skeleton(self) -> npt.NDArray[np.uint8]:
         return self._skeleton
 
+    @property
+    def unpruned_skeleton_roi(self) -> npt.NDArray[np.uint8]:
+        return self._unpruned_skeleton_roi
+
     @property
     def ends_idxs(self) -> List[types.int64[:]]:
         return self._ends_idxs
@@ -83,26 +143,151 @@ class Frame2D(Frame):
     def depth(self) -> npt.NDArray[np.float64]:
         return self._depth
 
+    @property
+    def depth_sampling(self) -> Tuple[npt.NDArray[np.float64], np.float64]:
+        return NO_DEPTH_RANGES, np.float64(1.0)
+
+    @property
+    def downscale(self) -> int:
+        return self._downscale
+
+    @property
+    def window(self) -> Optional[Tuple[int, int, int, int]]:
+        return self._window
+
+    @property
+    def roi_guard(self) -> int:
+        return max(1, -(-self._roi_guard // self._downscale))
+
+    @property
+    def workspace(self) -> Workspace:
+        return self._workspace
+
+    @property
+    def hsv_lut(self) -> npt.NDArray[np.uint8]:
+        return self.build_hsv_lut(hsv_ranges=tuple(int(v) for v in self._hsv_ranges))
+
+    def threshold(self, img: npt.NDArray[np.uint8],
+                  mask: Optional[npt.NDArray[np.uint8]] = None) -> npt.NDArray[np.uint8]:
+        if len(img.shape) == 3 and img.shape[2] == 3 and self._mask_backend == "lut":
+            return self.set_lut_mask(img=img, lut=self.hsv_lut, mask=mask)
+        elif len(img.shape) == 3 and img.shape[2] == 3:
+            hsv_img = None
+            if mask is not None:
+                hsv_img = self._workspace.get("hsv", np.uint8, channels=3)
+                hsv_img = hsv_img[:img.shape[0], :img.shape[1]]
+            hsv_img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV, dst=hsv_img)
+            return self.set_hsv_mask(hsv_img=hsv_img, hsv_ranges=self._hsv_ranges, mask=mask)
+        else:
+            return self.set_binary_mask(img=img, mask=mask)
+
+    def set_mask(self, img: npt.NDArray[np.uint8],
+                 window: Optional[Tuple[int, int, int, int]] = None) -> \
+            Optional[Tuple[int, int, int, int]]:
+        """
+        Threshold the image, only inside the window (x, y, w, h) if given.
+
+        Falls back to the full frame when the window mask is empty or the cable reaches
+        the window border (closer than `roi_guard` pixels), i.e. it may leave the window.
+        Returns the window which was actually processed, None for the full frame.
+        """
+        img, window = self.downscale_input(img=img, window=window)
+        self._workspace.reset(img.shape)
+        if window is not None:
+            x, y, w, h = window
+            mask = self._workspace.get("mask", np.uint8, window=window)
+            mask_window = self.threshold(img=img[y:y + h, x:x + w], mask=mask[y:y + h, x:x + w])
+            if self.is_inside_window(mask_window=mask_window, window=window,
+                                     shape=img.shape[:2], guard=self.roi_guard):
+                self._mask = mask
+                return window
+
+        self._mask = self.threshold(img=img, mask=self._workspace.get("mask", np.uint8))
+        return None
+
+    def downscale_input(self, img: npt.NDArray,
+                        window: Optional[Tuple[int, int, int, int]] = None) -> \
+            Tuple[npt.NDArray, Optional[Tuple[int, int, int, int]]]:
+        """
+        Strided (nearest) view of the image and the window mapped to processing coordinates.
+        The full resolution image is kept for `refine_coords`.
+        """
+        self._img = img
+        s = self._downscale
+        if s == 1:
+            return img, window
+
+        img = img[::s, ::s]
+        if window is not None:
+            x, y, w, h = window
+            x_max = min(-(-(x + w) // s), img.shape[1])
+            y_max = min(-(-(y + h) // s), img.shape[0])
+            window = (x // s, y // s, x_max - x // s, y_max - y // s)
+        return img, window
+
+    def refine_coords(self, path_coords_3d: npt.NDArray[np.float64]) -> None:
+        # only colour images are refined, the mask of the full resolution image is classified
+        # on the fly at pixels along the normals
+        if not self._refine or self._downscale == 1 or self._img is None or \
+                len(self._img.shape) != 3 or self._img.shape[2] != 3:
+            return
+        self.refine_centres(img=self._img, lut=self.hsv_lut, path_coords_3d=path_coords_3d,
+                            step=np.int64(2), radius=np.int64(REFINE_RADIUS))
+
+    @staticmethod
+    def is_inside_window(mask_window: npt.NDArray[np.uint8], window: Tuple[int, int, int, int],
+                         shape: Tuple[int, int], guard: int) -> bool:
+        x, y, w, h = window
+        if not mask_window.any():
+            return False
+        if y > 0 and mask_window[:guard].any():
+            return False
+        if x > 0 and mask_window[:, :guard].any():
+            return False
+        if y + h < shape[0] and mask_window[-guard:].any():
+            return False
+        if x + w < shape[1] and mask_window[:, -guard:].any():
+            return False
+        return True
+
     def set_morphology(self, *, erode: bool = True, dilate: bool = True) -> None:
         self._mask_roi_coords = cv2.boundingRect(self._mask)
         self._mask_roi = self._mask[self._mask_roi_coords[1]:
                                     self._mask_roi_coords[1] + self._mask_roi_coords[3],
                                     self._mask_roi_coords[0]:
                                     self._mask_roi_coords[0] + self._mask_roi_coords[2]]
+        # empty mask, nothing to filter
+        if self._mask_roi.size == 0:
+            return
+        # opening removes structures thinner than the kernel, it is scaled with the resolution
+        # and skipped when it shrinks to a single pixel (the cable is only a few pixels wide)
+        kernel = np.ones((MORPHOLOGY_KERNEL // self._downscale,) * 2)
+        if kernel.shape[0] < 2:
+            return
         if erode:
-            cv2.erode(src=self._mask_roi, kernel=np.ones((3, 3)), dst=self._mask_roi)
+            cv2.erode(src=self._mask_roi, kernel=kernel, dst=self._mask_roi)
         if dilate:
-            cv2.dilate(src=self._mask_roi, kernel=np.ones((3, 3)), dst=self._mask_roi)
-        mask_morph = np.zeros_like(self._mask)
-        mask_morph[self._mask_roi_coords[1]:
-                   self._mask_roi_coords[1] + self._mask_roi_coords[3],
-                   self._mask_roi_coords[0]:
-                   self._mask_roi_coords[0] + self._mask_roi_coords[2]] = self._mask_roi
+            cv2.dilate(src=self._mask_roi, kernel=kernel, dst=self._mask_roi)
+        # mask is modified in place, it is already zero outside of the bounding rect
 
-        self._mask = mask_morph
+    def skeletonize(self, img: npt.NDArray[np.uint8]) -> npt.NDArray[np.uint8]:
+        if self._skeleton_backend == "guo_hall":
+            return self.thin(img=img)
+        else:
+            # skimage is imported on first use, it is slow to import
+            from skimage.morphology import skeletonize
+            return skeletonize(img, method="lee")
 
     def set_skeleton(self) -> None:
-        skeleton_roi = skeletonize(self._mask_roi, method="lee")
+        if self._mask_roi.size == 0:
+            self._skeleton = self._workspace.get("skeleton", np.uint8,
+                                                 window=self._mask_roi_coords)
+            self._unpruned_skeleton_roi = np.zeros(self._mask_roi.shape, dtype=np.uint8)
+            self._ends_idxs = np.empty((2, 0), dtype=np.int64)
+            return
+
+        skeleton_roi = self.skeletonize(img=self._mask_roi)
+        self._unpruned_skeleton_roi = skeleton_roi
         kernel = np.ones((3, 3), dtype=np.float64)
         less_than_3 = cv2.filter2D(skeleton_roi, -1, kernel / 3) <= 1.0 + 1e-6
         less_than_2 = (
@@ -122,7 +307,7 @@ class Frame2D(Frame):
             ends_idxs = np.array(np.where(skeleton_roi), dtype=np.int64)
             ends_idxs += [[self._mask_roi_coords[1]], [self._mask_roi_coords[0]]]
 
-        skeleton = np.zeros_like(self._mask)
+        skeleton = self._workspace.get("skeleton", np.uint8, window=self._mask_roi_coords)
         skeleton[self._mask_roi_coords[1]:
                  self._mask_roi_coords[1] + self._mask_roi_coords[3],
                  self._mask_roi_coords[0]:
@@ -132,15 +317,157 @@ class Frame2D(Frame):
         self._ends_idxs = ends_idxs
 
     @staticmethod
-    @njit(target_backend='cuda', fastmath=True)
-    def set_binary_mask(img: npt.NDArray[np.uint8]) -> npt.NDArray[np.uint8]:
-        return np.where(img > 0, 1, 0).astype(np.uint8)
+    @njit(target_backend='cuda', fastmath=True, cache=True)
+    def thin(img: npt.NDArray[np.uint8]) -> npt.NDArray[np.uint8]:
+        """
+        Guo-Hall thinning, same rules as cv2.ximgproc.thinning but pixels outside of the image
+        are treated as background. Only remaining foreground pixels are visited.
+        """
+        skeleton = np.zeros((img.shape[0] + 2, img.shape[1] + 2), dtype=np.uint8)
+        num_of_pts = 0
+        for y in range(img.shape[0]):
+            for x in range(img.shape[1]):
+                if img[y, x]:
+                    skeleton[y + 1, x + 1] = 1
+                    num_of_pts += 1
+        pts = np.empty((num_of_pts, 2), dtype=np.int64)
+        k = 0
+        for y in range(img.shape[0]):
+            for x in range(img.shape[1]):
+                if img[y, x]:
+                    pts[k, 0] = y + 1
+                    pts[k, 1] = x + 1
+                    k += 1
+
+        removed = np.zeros(num_of_pts, dtype=np.bool_)
+        changed = True
+        while changed:
+            changed = False
+            for step in range(2):
+                for k in range(num_of_pts):
+                    y, x = pts[k]
+                    p2, p3 = skeleton[y - 1, x], skeleton[y - 1, x + 1]
+                    p4, p5 = skeleton[y, x + 1], skeleton[y + 1, x + 1]
+                    p6, p7 = skeleton[y + 1, x], skeleton[y + 1, x - 1]
+                    p8, p9 = skeleton[y, x - 1], skeleton[y - 1, x - 1]
+                    c = ((not p2) and (p3 or p4)) + ((not p4) and (p5 or p6)) + \
+                        ((not p6) and (p7 or p8)) + ((not p8) and (p9 or p2))
+                    n1 = (p9 or p2) + (p3 or p4) + (p5 or p6) + (p7 or p8)
+                    n2 = (p2 or p3) + (p4 or p5) + (p6 or p7) + (p8 or p9)
+                    n = min(n1, n2)
+                    if step == 0:
+                        m = (p6 or p7 or not p9) and p8
+                    else:
+                        m = (p2 or p3 or not p5) and p4
+                    removed[k] = c == 1 and n >= 2 and n <= 3 and not m
+
+                # remove marked pixels and compact the list of remaining ones
+                n = 0
+                for k in range(num_of_pts):
+                    if removed[k]:
+                        skeleton[pts[k, 0], pts[k, 1]] = 0
+                        changed = True
+                    else:
+                        pts[n] = pts[k]
+                        n += 1
+                num_of_pts = n
+
+        return skeleton[1:-1, 1:-1].copy()
+
+    @staticmethod
+    @njit(target_backend='cuda', fastmath=True, cache=True, nogil=True)
+    def refine_centres(img: npt.NDArray[np.uint8], lut: npt.NDArray[np.uint8],
+                       path_coords_3d: npt.NDArray[np.float64], step: np.int64,
+                       radius: np.int64) -> None:
+        """
+        Move every point of the ordered path to the middle of the cable cross-section.
+        The section is measured along the normal (tangent from neighbours `step` points away)
+        in the full resolution image, points which are not on the cable are kept.
+        """
+        coords_2d = path_coords_3d[:2].copy()
+        num_of_coords = coords_2d.shape[1]
+        for key in range(num_of_coords):
+            prev_key, next_key = max(key - step, 0), min(key + step, num_of_coords - 1)
+            tx = coords_2d[0, next_key] - coords_2d[0, prev_key]
+            ty = coords_2d[1, next_key] - coords_2d[1, prev_key]
+            norm = np.sqrt(tx * tx + ty * ty)
+            if norm == 0.0:
+                continue
+            nx, ny = -ty / norm, tx / norm
+
+            extents = np.zeros(2, dtype=np.int64)
+            for side in range(2):
+                sign = 1.0 - 2.0 * side
+                for d in range(radius + 1):
+                    x = np.int64(np.around(coords_2d[0, key] + sign * d * nx))
+                    y = np.int64(np.around(coords_2d[1, key] + sign * d * ny))
+                    if x < 0 or y < 0 or x >= img.shape[1] or y >= img.shape[0]:
+                        break
+                    idx = (np.int64(img[y, x, 0]) << 16) | (np.int64(img[y, x, 1]) << 8) | \
+                        np.int64(img[y, x, 2])
+                    if not (lut[idx >> 3] >> (idx & 7)) & 1:
+                        break
+                    extents[side] = d + 1
+            if extents[0] == 0 or extents[0] > radius or extents[1] > radius:
+                continue
+
+            shift = (extents[0] - extents[1]) / 2
+            path_coords_3d[0, key] = coords_2d[0, key] + shift * nx
+            path_coords_3d[1, key] = coords_2d[1, key] + shift * ny
+
+    @staticmethod
+    @lru_cache(maxsize=8)
+    def build_hsv_lut(hsv_ranges: Tuple[int, ...]) -> npt.NDArray[np.uint8]:
+        """
+        Bit-packed lookup table of `set_hsv_mask` results for every BGR colour.
+        Bit (b << 16 | g << 8 | r) is set when the colour falls into hsv_ranges.
+        Cached per hsv_ranges, so it is rebuilt only when the ranges change.
+        """
+        hsv_ranges = np.array(hsv_ranges, dtype=np.uint8)
+        lut = np.empty(2**24 // 8, dtype=np.uint8)
+        gr = np.indices((256, 256), dtype=np.uint8)
+        bgr = np.empty((256, 256, 3), dtype=np.uint8)
+        bgr[..., 1] = gr[0]
+        bgr[..., 2] = gr[1]
+        chunk = 256 * 256 // 8
+        for b in range(256):
+            bgr[..., 0] = b
+            hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV)
+            mask = Frame2D.set_hsv_mask(hsv_img=hsv, hsv_ranges=hsv_ranges)
+            lut[b * chunk:(b + 1) * chunk] = np.packbits(mask.ravel(), bitorder="little")
+        lut.setflags(write=False)
+        return lut
+
+    @staticmethod
+    @njit(target_backend='cuda', fastmath=True, cache=True)
+    def set_lut_mask(img: npt.NDArray[np.uint8], lut: npt.NDArray[np.uint8],
+                     mask: npt.NDArray[np.uint8] = None) -> npt.NDArray[np.uint8]:
+        if mask is None:
+            mask = np.empty(img.shape[:2], dtype=np.uint8)
+        for y in range(img.shape[0]):
+            for x in range(img.shape[1]):
+                idx = (np.int64(img[y, x, 0]) << 16) | (np.int64(img[y, x, 1]) << 8) | \
+                    np.int64(img[y, x, 2])
+                mask[y, x] = (lut[idx >> 3] >> (idx & 7)) & 1
+        return mask
+
+    @staticmethod
+    @njit(target_backend='cuda', fastmath=True, cache=True)
+    def set_binary_mask(img: npt.NDArray[np.uint8],
+                        mask: npt.NDArray[np.uint8] = None) -> npt.NDArray[np.uint8]:
+        if mask is None:
+            mask = np.empty(img.shape[:2], dtype=np.uint8)
+        for y in range(img.shape[0]):
+            for x in range(img.shape[1]):
+                mask[y, x] = 1 if img[y, x] > 0 else 0
+        return mask
 
     @staticmethod
-    @njit(target_backend='cuda', fastmath=True)
-    def set_hsv_mask(hsv_img: npt.NDArray[np.uint8],
-                     hsv_ranges: npt.NDArray[np.uint8]) -> npt.NDArray[np.uint8]:
-        mask = np.zeros_like(hsv_img[..., 0], dtype=np.uint8)
+    @njit(target_backend='cuda', fastmath=True, cache=True)
+    def set_hsv_mask(hsv_img: npt.NDArray[np.uint8], hsv_ranges: npt.NDArray[np.uint8],
+                     mask: npt.NDArray[np.uint8] = None) -> npt.NDArray[np.uint8]:
+        if mask is None:
+            mask = np.empty(hsv_img.shape[:2], dtype=np.uint8)
 
         if hsv_ranges[0] < hsv_ranges[3]:
             for y in range(hsv_img.shape[0]):
@@ -151,6 +478,8 @@ class Frame2D(Frame):
                         and hsv_img[y, x, 2] >= hsv_ranges[2] \
                         and hsv_img[y, x, 2] <= hsv_ranges[5]:
                         mask[y, x] = 1
+                    else:
+                        mask[y, x] = 0
         else:
             for y in range(hsv_img.shape[0]):
                 for x in range(hsv_img.shape[1]):
@@ -160,4 +489,6 @@ class Frame2D(Frame):
                         and hsv_img[y, x, 2] >= hsv_ranges[2] \
                         and hsv_img[y, x, 2] <= hsv_ranges[5]:
                         mask[y, x] = 1
+                    else:
+                        mask[y, x] = 0
         return mask
@@ -15,39 +15,76 @@
 # limitations under the License.
 
 from time import perf_counter
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
-import cv2
+import numba
 import numpy as np
 import numpy.typing as npt
-from numba import njit
+from numba import njit, prange
 
 try:
+    from utils.frame import NO_DEPTH_RANGES
     from utils.frame_2d import Frame2D
 except ImportError:
+    from cable_observer.utils.frame import NO_DEPTH_RANGES
     from cable_observer.utils.frame_2d import Frame2D
 
 
 class Frame3D(Frame2D):
     def __init__(self, *, hsv_ranges: List[int] = [0, 0, 0, 179, 255, 255],
-                 depth_ranges: List[float] = [0.0, 10000.0], depth_scale: float = 1.0) -> None:
-        super().__init__(hsv_ranges=hsv_ranges)
+                 depth_ranges: List[float] = [0.0, 10000.0], depth_scale: float = 1.0,
+                 roi_guard: int = 1, mask_backend: str = "hsv", fused: bool = False,
+                 num_threads: int = 0, skeleton_backend: str = "lee",
+                 native_depth: bool = False, downscale: int = 1, refine: bool = False) -> None:
+        super().__init__(hsv_ranges=hsv_ranges, roi_guard=roi_guard, mask_backend=mask_backend,
+                         skeleton_backend=skeleton_backend, downscale=downscale, refine=refine)
         self._depth_ranges = np.array(depth_ranges, dtype=np.float64)
         self._depth_scale = np.float64(depth_scale)
+        self._fused = fused
+        self._num_threads = min(num_threads, numba.config.NUMBA_NUM_THREADS)
+        # native depth (any dtype, e.g. uint16) is kept as is, ranges and scale are applied
+        # only to sampled pixels, see `depth_sampling`
+        self._native_depth = native_depth
 
-    def execute(self, img: npt.NDArray[np.uint8],
-                depth: npt.NDArray[np.float64]) -> Dict[str, float]:
+    def set_parameters(self, *, depth_ranges: List[float], depth_scale: float, fused: bool,
+                       num_threads: int, native_depth: bool, **kwargs) -> None:
+        super().set_parameters(**kwargs)
+        self._depth_ranges = np.array(depth_ranges, dtype=np.float64)
+        self._depth_scale = np.float64(depth_scale)
+        self._fused = fused
+        self._num_threads = min(num_threads, numba.config.NUMBA_NUM_THREADS)
+        self._native_depth = native_depth
+
+    @property
+    def sampled_depth(self) -> bool:
+        # downscaled processing samples full resolution depth at path coordinates, as native
+        return self._native_depth or self._downscale > 1
+
+    @property
+    def depth_sampling(self) -> Tuple[npt.NDArray[np.float64], np.float64]:
+        if self.sampled_depth:
+            return self._depth_ranges, self._depth_scale
+        return NO_DEPTH_RANGES, np.float64(1.0)
+
+    def execute(self, img: npt.NDArray[np.uint8], depth: npt.NDArray[np.float64],
+                window: Optional[Tuple[int, int, int, int]] = None) -> Dict[str, float]:
         t1 = perf_counter()
-        if len(img.shape) == 3 and img.shape[2] == 3:
-            hsv_img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-            self._mask = self.set_hsv_mask(hsv_img=hsv_img, hsv_ranges=self._hsv_ranges)
+        if self._fused and len(img.shape) == 3 and img.shape[2] == 3:
+            # the only parallel kernels, numba threads of the calling thread are restored
+            num_threads = numba.get_num_threads()
+            if self._num_threads > 0:
+                numba.set_num_threads(self._num_threads)
+            try:
+                self._window = self.set_mask_depth(img=img, depth=depth, window=window)
+            finally:
+                numba.set_num_threads(num_threads)
+            t2 = t3 = perf_counter()
         else:
-            self._mask = self.set_binary_mask(img=img)
-        t2 = perf_counter()
-        self._depth = self.set_depth_roi(
-            depth=depth, depth_ranges=self._depth_ranges, depth_scale=self._depth_scale)
-        t3 = perf_counter()
-        self.set_morphology()
+            self._window = self.set_mask(img=img, window=window)
+            t2 = perf_counter()
+            self.set_depth(depth=depth)
+            t3 = perf_counter()
+        self.set_morphology(erode=self._morphology, dilate=self._morphology)
         t4 = perf_counter()
         self.set_skeleton()
         t5 = perf_counter()
@@ -58,20 +95,127 @@ class Frame3D(Frame2D):
             "skeleton": (t5 - t4)*1000
         }
 
+    def set_depth(self, depth: npt.NDArray) -> None:
+        if self.sampled_depth:
+            self._depth = depth
+            return
+
+        depth_roi = self._workspace.get("depth_roi", np.float64, window=self._window)
+        if self._window is None:
+            self._depth = self.set_depth_roi(
+                depth=depth, depth_ranges=self._depth_ranges, depth_scale=self._depth_scale,
+                depth_roi=depth_roi)
+        else:
+            x, y, w, h = self._window
+            self.set_depth_roi(
+                depth=depth[y:y + h, x:x + w], depth_ranges=self._depth_ranges,
+                depth_scale=self._depth_scale, depth_roi=depth_roi[y:y + h, x:x + w])
+            self._depth = depth_roi
+
+    def set_mask_depth(self, img: npt.NDArray[np.uint8], depth: npt.NDArray[np.float64],
+                       window: Optional[Tuple[int, int, int, int]] = None) -> \
+            Optional[Tuple[int, int, int, int]]:
+        """
+        Fused counterpart of `set_mask` and `set_depth`, pixels outside of depth_ranges
+        never enter the mask. Colour is always thresholded with the lookup table (`hsv_lut`),
+        `mask_backend` is not used. Returns the window which was actually processed.
+        """
+        full_depth = depth
+        img, window = self.downscale_input(img=img, window=window)
+        depth = depth[::self._downscale, ::self._downscale]
+        self._workspace.reset(img.shape)
+        if window is not None:
+            x, y, w, h = window
+            mask = self._workspace.get("mask", np.uint8, window=window)
+            if self.sampled_depth:
+                depth_roi = full_depth
+                self.set_fused_mask(
+                    img=img[y:y + h, x:x + w], depth=depth[y:y + h, x:x + w], lut=self.hsv_lut,
+                    depth_ranges=self._depth_ranges, mask=mask[y:y + h, x:x + w])
+            else:
+                depth_roi = self._workspace.get("depth_roi", np.float64, window=window)
+                self.set_fused_mask_depth(
+                    img=img[y:y + h, x:x + w], depth=depth[y:y + h, x:x + w], lut=self.hsv_lut,
+                    depth_ranges=self._depth_ranges, depth_scale=self._depth_scale,
+                    mask=mask[y:y + h, x:x + w], depth_roi=depth_roi[y:y + h, x:x + w])
+            if self.is_inside_window(mask_window=mask[y:y + h, x:x + w], window=window,
+                                     shape=img.shape[:2], guard=self.roi_guard):
+                self._mask = mask
+                self._depth = depth_roi
+                return window
+
+        if self.sampled_depth:
+            self._mask = self.set_fused_mask(
+                img=img, depth=depth, lut=self.hsv_lut, depth_ranges=self._depth_ranges,
+                mask=self._workspace.get("mask", np.uint8))
+            self._depth = full_depth
+        else:
+            self._mask, self._depth = self.set_fused_mask_depth(
+                img=img, depth=depth, lut=self.hsv_lut,
+                depth_ranges=self._depth_ranges, depth_scale=self._depth_scale,
+                mask=self._workspace.get("mask", np.uint8),
+                depth_roi=self._workspace.get("depth_roi", np.float64))
+        return None
+
+    @staticmethod
+    @njit(parallel=True, fastmath=True, cache=True)
+    def set_fused_mask(img: npt.NDArray[np.uint8], depth: npt.NDArray,
+                       lut: npt.NDArray[np.uint8], depth_ranges: npt.NDArray[np.float64],
+                       mask: npt.NDArray[np.uint8] = None) -> npt.NDArray[np.uint8]:
+        # native depth counterpart of `set_fused_mask_depth`, depth is only read
+        if mask is None:
+            mask = np.empty(img.shape[:2], dtype=np.uint8)
+        for y in prange(img.shape[0]):
+            for x in range(img.shape[1]):
+                if depth[y, x] >= depth_ranges[0] and depth[y, x] <= depth_ranges[1]:
+                    idx = (np.int64(img[y, x, 0]) << 16) | (np.int64(img[y, x, 1]) << 8) | \
+                        np.int64(img[y, x, 2])
+                    mask[y, x] = (lut[idx >> 3] >> (idx & 7)) & 1
+                else:
+                    mask[y, x] = 0
+        return mask
+
+    @staticmethod
+    @njit(parallel=True, fastmath=True, cache=True)
+    def set_fused_mask_depth(img: npt.NDArray[np.uint8], depth: npt.NDArray[np.float64],
+                             lut: npt.NDArray[np.uint8], depth_ranges: npt.NDArray[np.float64],
+                             depth_scale: np.float64, mask: npt.NDArray[np.uint8] = None,
+                             depth_roi: npt.NDArray[np.float64] = None) -> \
+            Tuple[npt.NDArray[np.uint8], npt.NDArray[np.float64]]:
+        if mask is None:
+            mask = np.empty(img.shape[:2], dtype=np.uint8)
+        if depth_roi is None:
+            depth_roi = np.empty(depth.shape, dtype=np.float64)
+        for y in prange(img.shape[0]):
+            for x in range(img.shape[1]):
+                if depth[y, x] >= depth_ranges[0] and depth[y, x] <= depth_ranges[1]:
+                    depth_roi[y, x] = depth[y, x] * depth_scale
+                    idx = (np.int64(img[y, x, 0]) << 16) | (np.int64(img[y, x, 1]) << 8) | \
+                        np.int64(img[y, x, 2])
+                    mask[y, x] = (lut[idx >> 3] >> (idx & 7)) & 1
+                else:
+                    depth_roi[y, x] = 0.0
+                    mask[y, x] = 0
+        return mask, depth_roi
+
     @staticmethod
-    @njit(target_backend='cuda', fastmath=True)
+    @njit(target_backend='cuda', fastmath=True, cache=True)
     def set_depth_roi(depth: npt.NDArray[np.float64],
                       depth_ranges: npt.NDArray[np.float64],
-                      depth_scale: np.float64) -> npt.NDArray[np.float64]:
+                      depth_scale: np.float64,
+                      depth_roi: npt.NDArray[np.float64] = None) -> npt.NDArray[np.float64]:
         # numpy implementation
         # depth_roi = np.where((depth >= depth_ranges[0]) & (
         #     depth <= depth_ranges[1]), depth * depth_scale, 0.0)
 
         # numba implementation
-        depth_roi = np.zeros_like(depth)
+        if depth_roi is None:
+            depth_roi = np.empty(depth.shape, dtype=np.float64)
         for u in range(depth.shape[0]):
             for v in range(depth.shape[1]):
                 if depth[u, v] >= depth_ranges[0] and depth[u, v] <= depth_ranges[1]:
                     depth_roi[u, v] = depth[u, v] * depth_scale
+                else:
+                    depth_roi[u, v] = 0.0
 
         return depth_roi
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from typing import Any, Optional
+
+
+class LatestSlot:
+    """
+    Thread-safe buffer of a single item between pipeline stages.
+
+    A new item replaces the one which was not taken yet (the stale one is dropped and counted),
+    so a slow consumer always gets the freshest item instead of a queue of old ones.
+    """
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._item = None
+        self._has_item = False
+        self._is_closed = False
+        self._dropped = 0
+
+    @property
+    def dropped(self) -> int:
+        return self._dropped
+
+    def put(self, item: Any) -> bool:
+        """
+        Store the item, returns True if a previous item was dropped.
+        """
+        with self._condition:
+            is_dropped = self._has_item
+            if is_dropped:
+                self._dropped += 1
+            self._item = item
+            self._has_item = True
+            self._condition.notify()
+        return is_dropped
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Any]:
+        """
+        Take the item, waiting for it up to timeout seconds. None on timeout or when closed.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._has_item or self._is_closed,
+                                            timeout=timeout):
+                return None
+            if not self._has_item:
+                return None
+            item = self._item
+            self._item = None
+            self._has_item = False
+        return item
+
+    def close(self) -> None:
+        with self._condition:
+            self._is_closed = True
+            self._condition.notify_all()
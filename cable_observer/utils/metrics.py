@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+from time import perf_counter
+from typing import Any, Dict, Optional
+
+import numpy as np
+import numpy.typing as npt
+
+
+# log-spaced histogram bins [ms] from 1 us to 100 s, 5% relative resolution
+HISTOGRAM_MIN = 1e-3
+HISTOGRAM_RATIO = 1.05
+NUM_OF_BINS = int(math.log(1e5 / HISTOGRAM_MIN) / math.log(HISTOGRAM_RATIO)) + 1
+INV_LOG_RATIO = 1.0 / math.log(HISTOGRAM_RATIO)
+# frames per histogram generation, quantiles cover the last 1 to 2 windows
+METRICS_WINDOW = 600
+QUANTILES = (50, 95, 99)
+
+
+class RollingHistogram:
+    """
+    Fixed-memory histogram of the last `window` to 2 * `window` samples.
+
+    Samples are counted in log-spaced bins of two generations, the older generation is
+    cleared and becomes the current one every `window` samples. Bins are plain lists,
+    a sample costs a log and an increment.
+    """
+
+    def __init__(self, window: int = METRICS_WINDOW) -> None:
+        self._window = window
+        self._counts = [[0] * NUM_OF_BINS, [0] * NUM_OF_BINS]
+        self._generation = 0
+        self._num_of_samples = 0
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts[0]) + sum(self._counts[1])
+
+    def add(self, value: float) -> None:
+        idx = int(math.log(max(value, HISTOGRAM_MIN) / HISTOGRAM_MIN) * INV_LOG_RATIO)
+        self._counts[self._generation][min(idx, NUM_OF_BINS - 1)] += 1
+        self._num_of_samples += 1
+        if self._num_of_samples >= self._window:
+            self._generation ^= 1
+            self._counts[self._generation] = [0] * NUM_OF_BINS
+            self._num_of_samples = 0
+
+    def quantiles(self, qs=QUANTILES) -> npt.NDArray[np.float64]:
+        """
+        Quantiles (percent) as geometric centres of bins, NaN without samples.
+        """
+        cumsum = np.cumsum(np.array(self._counts, dtype=np.int64).sum(axis=0))
+        if cumsum[-1] == 0:
+            return np.full(len(qs), np.nan)
+        idxs = np.searchsorted(cumsum, np.array(qs, dtype=np.float64) / 100 * cumsum[-1])
+        return HISTOGRAM_MIN * HISTOGRAM_RATIO ** (idxs + 0.5)
+
+
+class Metrics:
+    """
+    Rolling statistics of tracked frames: stage durations, frame rate and frame counters.
+
+    Memory is fixed: a histogram per stage and a ring of the last `window` frame timestamps.
+    """
+
+    def __init__(self, window: int = METRICS_WINDOW) -> None:
+        self._window = window
+        self._stages: Dict[str, RollingHistogram] = {}
+        self._timestamps = [0.0] * window
+        self._num_of_frames = 0
+        self._num_of_empty_frames = 0
+        self._num_of_empty_skeleton_frames = 0
+        self._num_of_dropped_frames = 0
+
+    def record(self, stamps: Dict[str, float], *, is_empty: bool = False,
+               is_skeleton_empty: bool = False, timestamp: Optional[float] = None) -> None:
+        """
+        Account a tracked frame with its stage durations (ms).
+        """
+        for stage, value in stamps.items():
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = RollingHistogram(window=self._window)
+            histogram.add(value)
+        self._timestamps[self._num_of_frames % self._window] = \
+            perf_counter() if timestamp is None else timestamp
+        self._num_of_frames += 1
+        self._num_of_empty_frames += is_empty
+        self._num_of_empty_skeleton_frames += is_skeleton_empty
+
+    def set_dropped_frames(self, num_of_dropped_frames: int) -> None:
+        """
+        Frames dropped before tracking (total), counted by the caller.
+        """
+        self._num_of_dropped_frames = num_of_dropped_frames
+
+    @property
+    def fps(self) -> float:
+        """
+        Frame rate over the last `window` frames.
+        """
+        num_of_frames = min(self._num_of_frames, self._window)
+        if num_of_frames < 2:
+            return 0.0
+        newest = self._timestamps[(self._num_of_frames - 1) % self._window]
+        oldest = self._timestamps[(self._num_of_frames - num_of_frames) % self._window]
+        return (num_of_frames - 1) / (newest - oldest) if newest > oldest else 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "frames": self._num_of_frames,
+            "fps": self.fps,
+            "empty_frames": self._num_of_empty_frames,
+            "empty_skeleton_frames": self._num_of_empty_skeleton_frames,
+            "dropped_frames": self._num_of_dropped_frames,
+            "stages": {stage: dict(zip([f"p{q}" for q in QUANTILES],
+                                       histogram.quantiles().tolist()))
+                       for stage, histogram in self._stages.items()},
+        }
+
+    def format(self) -> str:
+        summary = self.summary()
+        output = f"{summary['fps']:.1f} fps, {summary['frames']} frames " \
+            f"({summary['empty_frames']} empty, {summary['empty_skeleton_frames']} " \
+            f"without skeleton, {summary['dropped_frames']} dropped)"
+        for stage, quantiles in summary["stages"].items():
+            output += f"\n{stage}: " + " ".join(
+                f"{key} {value:.3f}" for key, value in quantiles.items()) + " ms"
+        return output
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+try:
+    from utils.deformable_linear_object import DeformableLinearObject
+    from utils.frame import Frame
+except ImportError:
+    from cable_observer.utils.deformable_linear_object import DeformableLinearObject
+    from cable_observer.utils.frame import Frame
+
+
+class MultiDeformableLinearObject:
+    """
+    Tracker of up to `num_of_cables` cables of the same colour.
+
+    Paths are extracted once per frame (graph extractor) and separated into instances:
+    - a path is associated with the previous spline of a cable if most of its pixels lie within
+      `association_radius` of that spline,
+    - paths are grouped with paths passing within `association_radius` of any of their ends
+      (junctions and occlusion gaps), a group never joins two tracked cables,
+    - groups without a tracked cable are ordered like paths of a single cable and cut at gaps
+      longer than `association_radius`, these chains become new cables, longest first.
+    Every cable keeps its own DeformableLinearObject (tracking state), cables are fitted in
+    parallel on a thread pool. Cables not observed in a frame are dropped.
+    Splines are returned as (num_of_cables, 3, num_of_pts) with `instances_ids`, ids are kept
+    as long as a cable is observed.
+    """
+
+    def __init__(self, *, num_of_cables: int = 2, association_radius: float = 40.0,
+                 **kwargs) -> None:
+        self._num_of_cables = num_of_cables
+        self._association_radius = association_radius
+        self._dlo_kwargs = kwargs
+        # paths are extracted and filtered once for all cables, graph edges end at junctions,
+        # walked paths would run through crossings of cables
+        self._extractor = DeformableLinearObject(**(kwargs | {"path_extractor": "graph"}))
+        self._dlos: Dict[int, DeformableLinearObject] = {}
+        self._next_id = 0
+        self._num_of_fragments = 0
+        # created with the first frame of several cables, see `close`
+        self._executor = None
+
+        num_of_pts = kwargs.get("num_of_pts", 256)
+        self._spline_coords_3d = np.empty((0, 3, num_of_pts), dtype=np.float64)
+        self._instances_ids = np.empty(0, dtype=np.int64)
+
+    def set_parameters(self, *, association_radius: float, **kwargs) -> None:
+        """
+        Settings of `DeformableLinearObject.set_parameters` applied to all cables, tracking
+        state (cables and their ids) is kept.
+        """
+        self._extractor.set_parameters(**(kwargs | {"path_extractor": "graph"}))
+        self._association_radius = association_radius
+        self._dlo_kwargs |= kwargs
+        for dlo in self._dlos.values():
+            dlo.set_parameters(**kwargs)
+        if len(self._instances_ids) > 0:
+            self._spline_coords_3d = np.stack(
+                [self._dlos[instance_id].spline_coords_3d for instance_id in self._instances_ids])
+        else:
+            self._spline_coords_3d = np.empty((0, 3, kwargs["num_of_pts"]), dtype=np.float64)
+
+    def set_quality(self, *, num_of_knots: int, incremental_order: bool) -> None:
+        self._dlo_kwargs |= {"num_of_knots": num_of_knots, "incremental_order": incremental_order}
+        for dlo in [self._extractor, *self._dlos.values()]:
+            dlo.set_quality(num_of_knots=num_of_knots, incremental_order=incremental_order)
+
+    def execute(self, frame: Frame) -> Dict[str, float]:
+        t1 = perf_counter()
+        self._num_of_fragments = 0
+        if frame.skeleton.max() == 0.0:
+            return
+
+        t2 = perf_counter()
+        paths_coords_2d, paths_offsets, paths_lengths_2d = \
+            self._extractor.generate_paths(frame=frame)
+
+        t3 = perf_counter()
+        paths_ids = self._extractor.paths_filter(
+            paths_lengths_2d=paths_lengths_2d, min_length=self._extractor.min_length)
+        self._num_of_fragments = len(paths_ids)
+        if len(paths_ids) == 0:
+            return
+
+        t4 = perf_counter()
+        instances = self.separate_instances(
+            paths_coords_2d=paths_coords_2d, paths_offsets=paths_offsets,
+            paths_lengths_2d=paths_lengths_2d, paths_ids=paths_ids)
+        if len(instances) == 0:
+            return
+        self._dlos = {instance_id: self._dlos.get(instance_id) or
+                      DeformableLinearObject(**self._dlo_kwargs) for instance_id in instances}
+
+        t5 = perf_counter()
+        jobs = [(self._dlos[instance_id], instance_paths_ids)
+                for instance_id, instance_paths_ids in instances.items()]
+        if len(jobs) == 1:
+            stamps_dlos = [jobs[0][0].fit_paths(
+                frame, paths_coords_2d, paths_offsets, paths_lengths_2d, jobs[0][1])]
+        else:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._num_of_cables)
+            stamps_dlos = list(self._executor.map(
+                lambda job: job[0].fit_paths(
+                    frame, paths_coords_2d, paths_offsets, paths_lengths_2d, job[1]), jobs))
+
+        t6 = perf_counter()
+        self._instances_ids = np.array(sorted(self._dlos), dtype=np.int64)
+        self._spline_coords_3d = np.stack(
+            [self._dlos[instance_id].spline_coords_3d for instance_id in self._instances_ids])
+
+        # stages of the cables are summed (cpu time), fit_instances is the wall time
+        stamps = {
+            "skeleton check": (t2 - t1)*1000,
+            "generate_paths": (t3 - t2)*1000,
+            "paths_filter": (t4 - t3)*1000,
+            "separate_instances": (t5 - t4)*1000,
+        }
+        for stamps_dlo in stamps_dlos:
+            for stage, value in stamps_dlo.items():
+                stamps[stage] = stamps.get(stage, 0.0) + value
+        stamps["fit_instances"] = (t6 - t5)*1000
+        return stamps
+
+    def close(self) -> None:
+        """
+        Stop threads of the fitting pool, it is created again if the tracker is used later.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    @property
+    def spline_coords_3d(self) -> npt.NDArray[np.float64]:
+        return self._spline_coords_3d
+
+    @property
+    def instances_ids(self) -> npt.NDArray[np.int64]:
+        return self._instances_ids
+
+    @property
+    def num_of_fragments(self) -> int:
+        return self._num_of_fragments
+
+    def predict_window(self, shape: Tuple[int, int],
+                       padding: int) -> Optional[Tuple[int, int, int, int]]:
+        """
+        Union of predicted windows of all cables. None if there is no previous spline, new
+        cables are found only inside of the window.
+        """
+        windows = [dlo.predict_window(shape=shape, padding=padding) for dlo in self._dlos.values()]
+        windows = np.array([window for window in windows if window is not None])
+        if len(windows) == 0:
+            return None
+
+        x_min, y_min = windows[:, :2].min(axis=0)
+        x_max, y_max = (windows[:, :2] + windows[:, 2:]).max(axis=0)
+        return int(x_min), int(y_min), int(x_max - x_min), int(y_max - y_min)
+
+    def separate_instances(self, paths_coords_2d: npt.NDArray[np.int32],
+                           paths_offsets: npt.NDArray[np.int64],
+                           paths_lengths_2d: npt.NDArray[np.float64],
+                           paths_ids: npt.NDArray[np.int64]) -> Dict[int, npt.NDArray[np.int64]]:
+        """
+        Paths ids of every cable instance, keyed by instance id.
+        """
+        from scipy.spatial import cKDTree
+
+        # coordinates of the filtered paths, k-th path owns coords_paths == k
+        firsts, stops = paths_offsets[paths_ids], paths_offsets[paths_ids + 1]
+        coords_idxs = np.concatenate([np.arange(first, stop)
+                                      for first, stop in zip(firsts, stops)])
+        coords_paths = np.repeat(np.arange(len(paths_ids)), stops - firsts)
+        coords = paths_coords_2d[coords_idxs].astype(np.float64)
+
+        # association with previous splines, majority of path pixels has to be close to a cable
+        paths_cables = np.full(len(paths_ids), -1, dtype=np.int64)
+        if len(self._instances_ids) > 0:
+            spline_coords_2d = self._spline_coords_3d[:, :2].transpose(0, 2, 1).reshape(-1, 2)
+            dists, spline_idxs = cKDTree(spline_coords_2d).query(
+                coords, distance_upper_bound=self._association_radius)
+            is_close = np.isfinite(dists)
+            votes = np.zeros((len(paths_ids), len(self._instances_ids)), dtype=np.int64)
+            np.add.at(votes, (coords_paths[is_close],
+                              spline_idxs[is_close] // self._spline_coords_3d.shape[2]), 1)
+            is_associated = 2 * votes.max(axis=1) >= stops - firsts
+            paths_cables[is_associated] = self._instances_ids[votes[is_associated].argmax(axis=1)]
+
+        # grouping of paths close to ends of other paths
+        parents = np.arange(len(paths_ids))
+        groups_cables = paths_cables.copy()
+
+        def find(key: int) -> int:
+            while parents[key] != key:
+                parents[key] = parents[parents[key]]
+                key = parents[key]
+            return key
+
+        ends = paths_coords_2d[np.concatenate([firsts, stops - 1])].astype(np.float64)
+        neighbours = cKDTree(coords).query_ball_point(ends, r=self._association_radius)
+        for key, coords_neighbours in enumerate(neighbours):
+            a = find(key % len(paths_ids))
+            for b in np.unique(coords_paths[coords_neighbours]):
+                b = find(b)
+                if a == b or (groups_cables[a] >= 0 and groups_cables[b] >= 0 and
+                              groups_cables[a] != groups_cables[b]):
+                    continue
+                parents[b] = a
+                groups_cables[a] = max(groups_cables[a], groups_cables[b])
+
+        roots = np.array([find(key) for key in range(len(paths_ids))], dtype=np.int64)
+        paths_cables = groups_cables[roots]
+
+        # the spline fit needs a few coordinates per knot interval
+        instances = {int(cable): paths_ids[paths_cables == cable]
+                     for cable in np.unique(paths_cables[paths_cables >= 0])}
+        instances = {instance_id: instance_paths_ids
+                     for instance_id, instance_paths_ids in instances.items()
+                     if self._extractor.count_coords(paths_offsets, instance_paths_ids) >=
+                     self._extractor.min_num_of_coords}
+
+        # new cables are chains of the remaining groups, longest first, up to the number of cables
+        chains = []
+        for root in np.unique(roots[paths_cables < 0]):
+            chains.extend(self.split_chains(
+                paths_coords_2d=paths_coords_2d, paths_offsets=paths_offsets,
+                paths_ids=paths_ids[roots == root]))
+        chains_lengths = [paths_lengths_2d[chain].sum() for chain in chains]
+        for key in np.argsort(chains_lengths)[::-1]:
+            if len(instances) >= self._num_of_cables:
+                break
+            # short chains (clutter) do not start a cable
+            if self._extractor.count_coords(paths_offsets, chains[key]) < \
+                    self._extractor.min_num_of_coords:
+                continue
+            instances[self._next_id] = np.sort(chains[key])
+            self._next_id += 1
+
+        return instances
+
+    def split_chains(self, paths_coords_2d: npt.NDArray[np.int32],
+                     paths_offsets: npt.NDArray[np.int64],
+                     paths_ids: npt.NDArray[np.int64]) -> List[npt.NDArray[np.int64]]:
+        """
+        Paths ordered as in a single cable and split at gaps longer than `association_radius`,
+        so cables crossing each other are separated by direction continuity.
+        """
+        chains = []
+        while len(paths_ids) > 0:
+            paths_order, paths_reversed = self._extractor.sort_paths(
+                paths_coords_2d=paths_coords_2d, paths_offsets=paths_offsets, paths_ids=paths_ids)
+            gaps_lengths_2d = self._extractor.get_gaps_lengths(
+                paths_coords_2d=paths_coords_2d, paths_offsets=paths_offsets,
+                paths_order=paths_order, paths_reversed=paths_reversed)
+            chains.extend(np.split(
+                paths_order, np.flatnonzero(gaps_lengths_2d > self._association_radius) + 1))
+            paths_ids = np.setdiff1d(paths_ids, paths_order)
+        return chains
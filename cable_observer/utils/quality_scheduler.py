@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Optional
+
+
+class QualityScheduler:
+    """
+    Latency budget controller choosing a quality level (0 - full quality) for the next frame.
+
+    Frame durations are smoothed with an exponential moving average, restarted at every level
+    switch and trusted after `settle` frames. Over the budget the quality is lowered by one
+    level. It is raised back only after `patience` consecutive frames below `headroom` of the
+    budget; a raised level which does not fit the budget doubles the patience (up to
+    `max_patience`), so the scheduler does not oscillate between two levels.
+    """
+
+    def __init__(self, *, budget: float, num_of_levels: int, smoothing: float = 0.3,
+                 headroom: float = 0.6, settle: int = 3, patience: int = 30,
+                 max_patience: int = 960) -> None:
+        self._budget = budget
+        self._num_of_levels = num_of_levels
+        self._smoothing = smoothing
+        self._headroom = headroom
+        self._settle = settle
+        self._initial_patience = patience
+        self._patience = patience
+        self._max_patience = max_patience
+        self._level = 0
+        self._is_raised = False
+        self.switch(level=0)
+
+    @property
+    def level(self) -> int:
+        return self._level
+
+    @property
+    def average(self) -> Optional[float]:
+        """
+        Smoothed duration (ms) of frames at the current level.
+        """
+        return self._average
+
+    def update(self, duration: float) -> int:
+        """
+        Account duration (ms) of a frame processed at the current level, returns the level
+        of the next frame.
+        """
+        if self._budget <= 0 or self._num_of_levels <= 1:
+            return self._level
+
+        self._num_of_frames += 1
+        if self._average is None:
+            self._average = duration
+        else:
+            self._average += self._smoothing * (duration - self._average)
+        if self._num_of_frames < self._settle:
+            return self._level
+
+        if self._average > self._budget and self._level < self._num_of_levels - 1:
+            if self._is_raised:
+                self._patience = min(2 * self._patience, self._max_patience)
+            self._is_raised = False
+            self.switch(level=self._level + 1)
+        elif self._average < self._headroom * self._budget and self._level > 0:
+            self._num_of_fast_frames += 1
+            if self._num_of_fast_frames >= self._patience:
+                self._is_raised = True
+                self.switch(level=self._level - 1)
+        else:
+            self._num_of_fast_frames = 0
+
+        # a raised level which holds for the whole patience is stable, backoff is reset
+        if self._is_raised and self._num_of_frames >= self._patience:
+            self._is_raised = False
+            self._patience = self._initial_patience
+        return self._level
+
+    def switch(self, level: int) -> None:
+        self._level = level
+        self._average = None
+        self._num_of_frames = 0
+        self._num_of_fast_frames = 0
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+from numba import njit
+from numba.core import types
+from numba.typed import List
+
+
+class SkeletonGraph:
+    """
+    Graph of a skeleton traced in a single compiled pass.
+
+    Nodes are skeleton pixels with other than two neighbours (endpoints and junctions),
+    adjacent node pixels are merged into one node placed at their centroid, node degree is
+    its number of edges.
+    Edges are pixel chains between nodes, node pixels included on both ends, stored in one
+    contiguous (x, y) buffer with offsets: edge i is edges_coords[offsets[i]:offsets[i + 1]].
+    Closed loops without any node are stored as edges with both node ids equal to -1.
+    The padded skeleton passed to `execute` is used as scratch memory and modified.
+    """
+
+    def __init__(self) -> None:
+        self._nodes_coords = np.empty((0, 2), dtype=np.int64)
+        self._nodes_degrees = np.empty(0, dtype=np.int64)
+        self._edges_coords = np.empty((0, 2), dtype=np.int32)
+        self._edges_offsets = np.zeros(1, dtype=np.int64)
+        self._edges_lengths = np.empty(0, dtype=np.float64)
+        self._edges_nodes = np.empty((0, 2), dtype=np.int64)
+
+    def execute(self, skeleton_pad: npt.NDArray[np.uint8],
+                roi: Tuple[int, int, int, int]) -> None:
+        (self._nodes_coords, self._nodes_degrees, self._edges_coords, self._edges_offsets,
+         self._edges_lengths, self._edges_nodes) = self.extract(
+            skeleton_pad=skeleton_pad, roi=np.array(roi, dtype=np.int64))
+
+    @property
+    def nodes_coords(self) -> npt.NDArray[np.int64]:
+        return self._nodes_coords
+
+    @property
+    def nodes_degrees(self) -> npt.NDArray[np.int64]:
+        return self._nodes_degrees
+
+    @property
+    def edges_coords(self) -> npt.NDArray[np.int32]:
+        return self._edges_coords
+
+    @property
+    def edges_offsets(self) -> npt.NDArray[np.int64]:
+        return self._edges_offsets
+
+    @property
+    def edges_lengths(self) -> npt.NDArray[np.float64]:
+        return self._edges_lengths
+
+    @property
+    def edges_nodes(self) -> npt.NDArray[np.int64]:
+        return self._edges_nodes
+
+    @staticmethod
+    @njit(target_backend='cuda', fastmath=True, cache=True)
+    def extract(skeleton_pad: npt.NDArray[np.uint8], roi: npt.NDArray[np.int64]) -> \
+            Tuple[npt.NDArray[np.int64], npt.NDArray[np.int64], npt.NDArray[np.int32],
+                  npt.NDArray[np.int64], npt.NDArray[np.float64], npt.NDArray[np.int64]]:
+        # skeleton_pad is a scratch copy padded by one pixel, roi (x, y, w, h) is given without
+        # padding; pixels are marked in place: 1 - chain, 2 - traced chain, 3 - node
+        CHAIN, TRACED, NODE = 1, 2, 3
+        dxs = np.array([-1, -1, -1, 0, 0, 1, 1, 1])
+        dys = np.array([-1, 0, 1, -1, 1, -1, 0, 1])
+        step_lengths = np.sqrt(dxs * dxs + dys * dys).astype(np.float64)
+        width = skeleton_pad.shape[1]
+
+        # node pixels are found in scan order, so their linear indices are sorted
+        pixels_idxs_list = List.empty_list(types.int64)
+        num_of_pts = 0
+        for y in range(roi[1] + 1, roi[1] + roi[3] + 1):
+            for x in range(roi[0] + 1, roi[0] + roi[2] + 1):
+                if skeleton_pad[y, x] == 0:
+                    continue
+                num_of_pts += 1
+                degree = 0
+                for k in range(8):
+                    degree += skeleton_pad[y + dys[k], x + dxs[k]] > 0
+                if degree != 2:
+                    pixels_idxs_list.append(y * width + x)
+        num_of_pixels = len(pixels_idxs_list)
+        pixels_idxs = np.empty(num_of_pixels, dtype=np.int64)
+        for i in range(num_of_pixels):
+            pixels_idxs[i] = pixels_idxs_list[i]
+            skeleton_pad[pixels_idxs[i] // width, pixels_idxs[i] % width] = NODE
+
+        # adjacent node pixels (8-connected junctions) are merged into a single node
+        parents = np.arange(num_of_pixels)
+        for i in range(num_of_pixels):
+            y, x = pixels_idxs[i] // width, pixels_idxs[i] % width
+            for k in range(8):
+                if skeleton_pad[y + dys[k], x + dxs[k]] != NODE:
+                    continue
+                a = i
+                b = np.searchsorted(pixels_idxs, (y + dys[k]) * width + x + dxs[k])
+                while parents[a] != a:
+                    a = parents[a]
+                while parents[b] != b:
+                    b = parents[b]
+                parents[max(a, b)] = min(a, b)
+        pixels_nodes = np.empty(num_of_pixels, dtype=np.int64)
+        num_of_nodes = 0
+        for i in range(num_of_pixels):
+            if parents[i] == i:
+                pixels_nodes[i] = num_of_nodes
+                num_of_nodes += 1
+            else:
+                pixels_nodes[i] = pixels_nodes[parents[i]]
+        # node is placed at the centroid of its pixels
+        nodes_sums = np.zeros((num_of_nodes, 3), dtype=np.float64)
+        for i in range(num_of_pixels):
+            nodes_sums[pixels_nodes[i], 0] += pixels_idxs[i] % width - 1
+            nodes_sums[pixels_nodes[i], 1] += pixels_idxs[i] // width - 1
+            nodes_sums[pixels_nodes[i], 2] += 1
+        nodes_coords = np.empty((num_of_nodes, 2), dtype=np.int64)
+        for node_id in range(num_of_nodes):
+            nodes_coords[node_id, 0] = np.int64(np.round(nodes_sums[node_id, 0] /
+                                                         nodes_sums[node_id, 2]))
+            nodes_coords[node_id, 1] = np.int64(np.round(nodes_sums[node_id, 1] /
+                                                         nodes_sums[node_id, 2]))
+
+        max_num_of_edges = 8 * num_of_pixels + num_of_pts // 3 + 1
+        coords = np.empty((num_of_pts + 8 * num_of_pixels + 1, 2), dtype=np.int32)
+        offsets = np.zeros(max_num_of_edges + 1, dtype=np.int64)
+        lengths = np.zeros(max_num_of_edges, dtype=np.float64)
+        edges_nodes = np.full((max_num_of_edges, 2), -1, dtype=np.int64)
+        nodes_degrees = np.zeros(num_of_nodes, dtype=np.int64)
+        num_of_coords = 0
+        num_of_edges = 0
+        num_of_traced = 0
+
+        for i in range(num_of_pixels):
+            ny, nx = pixels_idxs[i] // width, pixels_idxs[i] % width
+            for k in range(8):
+                y, x = ny + dys[k], nx + dxs[k]
+                if skeleton_pad[y, x] != CHAIN:
+                    continue
+
+                coords[num_of_coords, 0] = nx - 1
+                coords[num_of_coords, 1] = ny - 1
+                num_of_coords += 1
+                length = 0.0
+                py, px = ny, nx
+                step = k
+                while True:
+                    coords[num_of_coords, 0] = x - 1
+                    coords[num_of_coords, 1] = y - 1
+                    num_of_coords += 1
+                    length += step_lengths[step]
+                    if skeleton_pad[y, x] == NODE:
+                        break
+                    skeleton_pad[y, x] = TRACED
+                    num_of_traced += 1
+                    is_finished = True
+                    for k2 in range(8):
+                        qy, qx = y + dys[k2], x + dxs[k2]
+                        if (skeleton_pad[qy, qx] != CHAIN and skeleton_pad[qy, qx] != NODE) or \
+                                (qy == py and qx == px):
+                            continue
+                        py, px, y, x, step = y, x, qy, qx, k2
+                        is_finished = False
+                        break
+                    if is_finished:
+                        break
+
+                edges_nodes[num_of_edges, 0] = pixels_nodes[i]
+                nodes_degrees[pixels_nodes[i]] += 1
+                if skeleton_pad[y, x] == NODE:
+                    node_id = pixels_nodes[np.searchsorted(pixels_idxs, y * width + x)]
+                    edges_nodes[num_of_edges, 1] = node_id
+                    nodes_degrees[node_id] += 1
+                lengths[num_of_edges] = length
+                num_of_edges += 1
+                offsets[num_of_edges] = num_of_coords
+
+        # closed loops without nodes, only if some chain pixels were not traced yet
+        if num_of_traced + num_of_pixels < num_of_pts:
+            for sy in range(roi[1] + 1, roi[1] + roi[3] + 1):
+                for sx in range(roi[0] + 1, roi[0] + roi[2] + 1):
+                    if skeleton_pad[sy, sx] != CHAIN:
+                        continue
+                    y, x = sy, sx
+                    length = 0.0
+                    while True:
+                        coords[num_of_coords, 0] = x - 1
+                        coords[num_of_coords, 1] = y - 1
+                        num_of_coords += 1
+                        skeleton_pad[y, x] = TRACED
+                        is_finished = True
+                        for k in range(8):
+                            qy, qx = y + dys[k], x + dxs[k]
+                            if skeleton_pad[qy, qx] != CHAIN:
+                                continue
+                            y, x = qy, qx
+                            length += step_lengths[k]
+                            is_finished = False
+                            break
+                        if is_finished:
+                            break
+                    lengths[num_of_edges] = length
+                    num_of_edges += 1
+                    offsets[num_of_edges] = num_of_coords
+
+        return (nodes_coords, nodes_degrees, coords[:num_of_coords].copy(),
+                offsets[:num_of_edges + 1].copy(), lengths[:num_of_edges].copy(),
+                edges_nodes[:num_of_edges].copy())
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Iterator, Optional, Tuple
+
+import cv2
+import numpy as np
+import numpy.typing as npt
+
+
+CABLE_BGR = (0, 0, 200)  # red, matches hsv_ranges from param/defaults.param.yaml
+BACKGROUND_BGR = (90, 110, 100)
+BACKGROUND_DEPTH = 1500.0  # raw units, outside of default depth_ranges
+CABLE_DEPTH = (500.0, 150.0)  # raw units, mean and amplitude along the cable
+GAP_RATIO = 0.03  # fraction of cable length removed between fragments
+
+
+class SyntheticCable:
+    """
+    Generator of synthetic BGR and depth frames with known cable geometry.
+
+    The cable is a cubic Bezier curve drawn with a constant width. It is split into
+    `num_of_fragments` pieces separated by gaps (simulated occlusions). Every call of `render`
+    moves the control points by a few pixels, which mimics a cable observed at camera rate.
+    Ground truth is returned as (x, y, z) rows, the same layout as `spline_coords_3d`.
+    """
+
+    def __init__(self, *, width: int = 640, height: int = 480, num_of_fragments: int = 1,
+                 noise: float = 0.0, holes: float = 0.0, depth_scale: float = 0.001,
+                 depth_dtype: npt.DTypeLike = np.float64, num_of_samples: int = 2048,
+                 thickness: Optional[int] = None,
+                 cable_bgr: Tuple[int, int, int] = CABLE_BGR,
+                 background_bgr: Tuple[int, int, int] = BACKGROUND_BGR,
+                 cable_depth: Tuple[float, float] = CABLE_DEPTH,
+                 background_depth: float = BACKGROUND_DEPTH, seed: int = 0) -> None:
+        self._width = width
+        self._height = height
+        self._num_of_fragments = max(1, num_of_fragments)
+        self._noise = noise
+        self._holes = holes
+        self._depth_scale = depth_scale
+        self._depth_dtype = depth_dtype
+        self._cable_bgr = tuple(int(c) for c in cable_bgr)
+        self._background_bgr = tuple(int(c) for c in background_bgr)
+        self._cable_depth = cable_depth
+        self._background_depth = background_depth
+        self._rng = np.random.default_rng(seed)
+        self._thickness = thickness or max(3, int(round(min(width, height) / 60)))
+        self._T = np.linspace(0., 1., num_of_samples, dtype=np.float64)
+
+        margin = np.array([0.1 * width, 0.1 * height])
+        size = np.array([width, height]) - 2 * margin
+        self._control_pts = margin + self._rng.random((4, 2)) * size
+        # keep the cable spread over the image, first and last control points on opposite sides
+        self._control_pts[0, 0] = margin[0]
+        self._control_pts[3, 0] = width - margin[0]
+        self._velocity = self._rng.normal(0.0, 1.0, size=(4, 2))
+        self._phase = self._rng.random() * 2 * np.pi
+
+    @property
+    def thickness(self) -> int:
+        return self._thickness
+
+    def curve(self) -> npt.NDArray[np.float64]:
+        t = self._T[:, np.newaxis]
+        p = self._control_pts
+        xy = (1 - t) ** 3 * p[0] + 3 * (1 - t) ** 2 * t * p[1] + \
+            3 * (1 - t) * t ** 2 * p[2] + t ** 3 * p[3]
+        z = self._cable_depth[0] + self._cable_depth[1] * np.sin(2 * np.pi * self._T + self._phase)
+        return np.stack([xy[:, 0], xy[:, 1], z])
+
+    def step(self) -> None:
+        self._control_pts += self._velocity
+        low = np.array([0.05 * self._width, 0.05 * self._height])
+        high = np.array([0.95 * self._width, 0.95 * self._height])
+        bounce = (self._control_pts < low) | (self._control_pts > high)
+        self._velocity[bounce] *= -1
+        self._control_pts = np.clip(self._control_pts, low, high)
+        self._phase += 0.05
+
+    def render(self) -> Tuple[npt.NDArray[np.uint8], npt.NDArray, npt.NDArray[np.float64]]:
+        coords = self.curve()
+        img = np.empty((self._height, self._width, 3), dtype=np.uint8)
+        img[:] = self._background_bgr
+        depth = np.full((self._height, self._width), self._background_depth, dtype=np.float64)
+
+        # visible mask of samples, gaps simulate occlusions between fragments
+        visible = np.ones(coords.shape[1], dtype=bool)
+        gap = int(GAP_RATIO * coords.shape[1])
+        for k in range(1, self._num_of_fragments):
+            centre = int(k * coords.shape[1] / self._num_of_fragments)
+            visible[max(0, centre - gap // 2):centre + gap // 2 + 1] = False
+
+        pts = np.round(coords[:2].T).astype(np.int32)
+        for i in range(len(pts) - 1):
+            if not (visible[i] and visible[i + 1]):
+                continue
+            cv2.line(img, tuple(pts[i]), tuple(pts[i + 1]), self._cable_bgr, self._thickness)
+            cv2.line(depth, tuple(pts[i]), tuple(pts[i + 1]), float(coords[2, i]),
+                     self._thickness)
+
+        if self._noise > 0:
+            noisy = img.astype(np.float32) + self._rng.normal(0.0, self._noise, img.shape)
+            img = np.clip(noisy, 0, 255).astype(np.uint8)
+            depth += self._rng.normal(0.0, self._noise, depth.shape)
+        if self._holes > 0:
+            depth[self._rng.random(depth.shape) < self._holes] = 0.0
+
+        depth = np.clip(depth, 0, None).astype(self._depth_dtype)
+        coords[2] *= self._depth_scale
+        return img, depth, coords
+
+    def sequence(self, num_of_frames: int) -> Iterator[Tuple[npt.NDArray[np.uint8], npt.NDArray,
+                                                             npt.NDArray[np.float64]]]:
+        for _ in range(num_of_frames):
+            yield self.render()
+            self.step()
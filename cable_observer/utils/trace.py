@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+
+# multi-cable stamps hold per-cable stages summed over cables, their wall time is this stage
+PARALLEL_STAGE = "fit_instances"
+
+
+class TraceRecorder:
+    """
+    Ring buffer of stage spans of the last `capacity` frames, dumped as Chrome trace JSON
+    (chrome://tracing, ui.perfetto.dev).
+
+    Frames are stored as raw stamps (stages are measured back to back, spans are laid out
+    in stamp order from the frame start) with metadata, events are built only on dump.
+    With `threshold` (ms) the buffer is dumped to `directory` when a frame takes longer,
+    at most once per `capacity` frames so consecutive dumps do not overlap.
+    """
+
+    def __init__(self, *, capacity: int = 300, threshold: float = 0.0,
+                 directory: str = ".") -> None:
+        # frames are appended by the tracking thread and copied by dumps
+        self._lock = threading.Lock()
+        self._frames = deque(maxlen=capacity)
+        self._capacity = capacity
+        self._threshold = threshold
+        self._directory = directory
+        self._num_of_frames = 0
+        self._last_dump_frame = None
+        self._writers: List[threading.Thread] = []
+
+    def record(self, start: float, stamps: Dict[str, float], dlo_stages: Dict[str, float],
+               metadata: Dict[str, Any]) -> Optional[str]:
+        """
+        Store a frame started at `start` (perf_counter, s). Returns the path of the trace if
+        the frame exceeded the threshold and the buffer is being dumped.
+        """
+        frame = self._num_of_frames
+        with self._lock:
+            self._frames.append((frame, start, dict(stamps), set(dlo_stages), metadata))
+        self._num_of_frames += 1
+
+        if self._threshold <= 0 or stamps.get("total", 0.0) <= self._threshold:
+            return None
+        if self._last_dump_frame is not None and \
+                frame - self._last_dump_frame < self._capacity:
+            return None
+        self._last_dump_frame = frame
+        path = os.path.join(self._directory, "cable_observer_trace_" +
+                            time.strftime("%Y%m%d_%H%M%S") + f"_{frame:08d}.json")
+        # events are built and written off the tracking thread
+        writer = threading.Thread(target=self.dump, args=(path, self.snapshot()), daemon=True)
+        writer.start()
+        self._writers = [thread for thread in self._writers if thread.is_alive()] + [writer]
+        return path
+
+    def join(self) -> None:
+        """
+        Wait for dumps which are still being written.
+        """
+        for writer in self._writers:
+            writer.join()
+        self._writers = []
+
+    def snapshot(self) -> List:
+        with self._lock:
+            return list(self._frames)
+
+    def dump(self, path: str, frames: Optional[List] = None) -> str:
+        """
+        Write frames (the whole buffer by default) as Chrome trace JSON, returns the path.
+        """
+        frames = self.snapshot() if frames is None else frames
+        events = [{"name": "process_name", "ph": "M", "pid": os.getpid(),
+                   "args": {"name": "cable_observer"}},
+                  {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": 1,
+                   "args": {"name": "track"}},
+                  {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": 2,
+                   "args": {"name": "cables (summed)"}}]
+        for frame in frames:
+            events.extend(self.frame_events(*frame))
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        return path
+
+    @staticmethod
+    def frame_events(frame: int, start: float, stamps: Dict[str, float], dlo_stages: set,
+                     metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
+        pid = os.getpid()
+        ts = start * 1e6
+        events = [{"name": f"frame {frame}", "cat": "frame", "ph": "X", "pid": pid, "tid": 1,
+                   "ts": ts, "dur": stamps.get("total", 0.0) * 1e3,
+                   "args": dict(metadata, frame=frame)}]
+        # per-cable stages run in parallel inside of PARALLEL_STAGE, they are shown
+        # on a separate track from its start
+        stages = [stage for stage in stamps if stage != "total"]
+        parallel = set()
+        if PARALLEL_STAGE in stamps:
+            parallel = set(stages[stages.index("separate_instances") + 1:
+                                  stages.index(PARALLEL_STAGE)])
+        cursor = ts
+        parallel_cursor = None
+        for stage in stages:
+            dur = stamps[stage] * 1e3
+            category = "dlo" if stage in dlo_stages else "frame3d"
+            if stage in parallel:
+                parallel_cursor = cursor if parallel_cursor is None else parallel_cursor
+                events.append({"name": stage, "cat": category, "ph": "X", "pid": pid, "tid": 2,
+                               "ts": parallel_cursor, "dur": dur})
+                parallel_cursor += dur
+                continue
+            events.append({"name": stage, "cat": category, "ph": "X", "pid": pid, "tid": 1,
+                           "ts": cursor, "dur": dur})
+            cursor += dur
+        return events
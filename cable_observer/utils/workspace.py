@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+
+class Workspace:
+    """
+    Per-frame buffers keyed on frame shape.
+
+    Buffers are allocated on first use and reused across frames; all of them are dropped
+    when the frame shape changes. Windows are (x, y, w, h) in buffer coordinates.
+    """
+
+    def __init__(self) -> None:
+        self._shape = None
+        self._buffers: Dict[str, npt.NDArray] = {}
+        self._windows: Dict[str, Optional[Tuple[int, int, int, int]]] = {}
+
+    @property
+    def shape(self) -> Optional[Tuple[int, int]]:
+        return self._shape
+
+    def reset(self, shape: Tuple[int, int]) -> None:
+        shape = tuple(shape[:2])
+        if shape != self._shape:
+            self._shape = shape
+            self._buffers.clear()
+            self._windows.clear()
+
+    def get(self, name: str, dtype: npt.DTypeLike, *, pad: int = 0, channels: int = 0,
+            window: Optional[Tuple[int, int, int, int]] = None) -> npt.NDArray:
+        """
+        Buffer of the frame shape, padded with `pad` pixels on each side.
+
+        Without `window` the caller is expected to overwrite the whole buffer. With `window`
+        the caller overwrites only the window, so the region written in the previous frame
+        is cleared and the buffer is guaranteed to be zero outside of the window.
+        """
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.dtype != dtype:
+            shape = (self._shape[0] + 2 * pad, self._shape[1] + 2 * pad)
+            if channels > 0:
+                shape += (channels,)
+            buffer = np.zeros(shape, dtype=dtype)
+            self._buffers[name] = buffer
+            self._windows[name] = window
+            return buffer
+
+        if window is not None and self._windows[name] != window:
+            previous_window = self._windows[name]
+            if previous_window is None:
+                buffer.fill(0)
+            else:
+                x, y, w, h = previous_window
+                buffer[y:y + h, x:x + w] = 0
+        self._windows[name] = window
+        return buffer
@@ -0,0 +1,63 @@
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+from cable_observer.batch import process_sequence, read_frames, track_frames
+from cable_observer.benchmark import DEFAULT_PARAMETERS
+from cable_observer.cable_observer import CableObserver
+from cable_observer.utils.synthetic import SyntheticCable
+
+
+def test_chunks_match_sequential(tmp_path):
+    frames = list(SyntheticCable(width=320, height=240, num_of_fragments=2, seed=3).sequence(12))
+    np.save(tmp_path / "rgb.npy", np.stack([img for img, _, _ in frames]))
+    np.save(tmp_path / "depth.npy", np.stack([depth for _, depth, _ in frames]))
+    rgb, depth = str(tmp_path / "rgb.npy"), str(tmp_path / "depth.npy")
+
+    cable_observer = CableObserver()
+    cable_observer.set_parameters(**DEFAULT_PARAMETERS)
+    expected = np.stack([spline_coords for spline_coords, _ in
+                         track_frames(cable_observer, read_frames(rgb, depth))])
+
+    summary = process_sequence(rgb, depth, str(tmp_path / "output"), DEFAULT_PARAMETERS,
+                               num_of_workers=2, chunk_size=5, overlap=2)
+    splines = np.load(tmp_path / "output" / "splines.npy", mmap_mode="r")
+    instances = np.load(tmp_path / "output" / "instances.npy", mmap_mode="r")
+
+    assert summary["frames"] == 12
+    assert splines.shape == (12, 1, 3, 256)
+    assert np.all(instances == 0)
+    # chunks start from a fresh state, the direction is aligned afterwards
+    assert np.allclose(splines, expected)
+
+
+def test_empty_frame_is_nan(tmp_path):
+    frames = list(SyntheticCable(width=320, height=240, seed=3).sequence(8))
+    rgb = np.stack([img for img, _, _ in frames])
+    depth = np.stack([depth for _, depth, _ in frames])
+    rgb[4] = rgb[4, 0, 0]  # background only, no cable
+    np.save(tmp_path / "rgb.npy", rgb)
+    np.save(tmp_path / "depth.npy", depth)
+
+    summary = process_sequence(str(tmp_path / "rgb.npy"), str(tmp_path / "depth.npy"),
+                               str(tmp_path / "output"), DEFAULT_PARAMETERS,
+                               num_of_workers=1, chunk_size=8, overlap=0)
+    splines = np.load(tmp_path / "output" / "splines.npy", mmap_mode="r")
+    instances = np.load(tmp_path / "output" / "instances.npy", mmap_mode="r")
+
+    # the previous spline is not repeated on a frame without a spline
+    assert summary["empty_frames"] == 1
+    assert np.isnan(splines[4]).all() and np.all(instances[4] == -1)
+    assert not np.isnan(np.delete(splines, 4, axis=0)).any()
+    assert np.all(np.delete(instances, 4, axis=0) == 0)
@@ -0,0 +1,30 @@
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+from scipy.interpolate import LSQUnivariateSpline
+from cable_observer.utils.bspline import BSpline
+
+
+def test_bspline_matches_scipy():
+    rng = np.random.default_rng(0)
+    t = np.sort(rng.random(500))
+    t[0], t[-1] = 0.0, 1.0
+    coords = np.stack([np.cos(3 * t), np.sin(5 * t), 1 + t ** 2]) + rng.normal(0, 0.01, (3, 500))
+    T = np.linspace(0., 1., 256)
+    num_of_knots = 25
+    d = np.int64((t.shape[0] - 2) / (num_of_knots - 4)) + 1
+    expected = np.stack([LSQUnivariateSpline(t, c, t[1:-1:d])(T) for c in coords])
+    spline_coords = BSpline(num_of_knots=num_of_knots, T=T).fit(t=t, coords=coords)
+    assert np.allclose(spline_coords, expected, atol=1e-9), "B-spline differs from FITPACK"
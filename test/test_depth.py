@@ -0,0 +1,65 @@
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+from cable_observer.benchmark import DEFAULT_PARAMETERS
+from cable_observer.cable_observer import CableObserver
+from cable_observer.utils.deformable_linear_object import DeformableLinearObject
+from cable_observer.utils.synthetic import SyntheticCable
+
+DEPTH_RANGES = np.array([200.0, 900.0])
+
+
+def sample_depth(depth, coords, median_radius):
+    paths_coords_2d = np.array(coords, dtype=np.int32)
+    return DeformableLinearObject.get_paths_coords_z(
+        paths_coords_2d=paths_coords_2d, paths_idxs=np.arange(len(coords), dtype=np.int64),
+        depth=depth, depth_ranges=DEPTH_RANGES, depth_scale=np.float64(0.001),
+        z_vertical_shift=0.0, median_radius=np.int64(median_radius))
+
+
+def test_depth_median_fills_holes():
+    depth = np.full((9, 9), 500.0)
+    depth[3:6, 3:6] = [[400.0, 450.0, 600.0], [700.0, 0.0, 1000.0], [550.0, 0.0, 650.0]]
+    # hole at (x, y) = (4, 4) filled with median of 6 valid neighbours, valid pixels are kept
+    paths_coords_z = sample_depth(depth, [[4, 4], [1, 1]], median_radius=1)
+    assert paths_coords_z == pytest.approx([np.median([400, 450, 600, 700, 550, 650]) / 1000,
+                                            0.5])
+    assert sample_depth(depth, [[4, 4]], median_radius=0)[0] == 0.0
+    # window without valid pixels leaves the hole
+    assert sample_depth(np.zeros((9, 9)), [[4, 4]], median_radius=2)[0] == 0.0
+
+
+@pytest.mark.parametrize("window", [-1, 2, 4])
+def test_depth_median_window_validation(window):
+    with pytest.raises(ValueError):
+        DeformableLinearObject(depth_median_window=window)
+
+
+@pytest.mark.parametrize("fused, depth_median_window", [(False, 0), (True, 0), (False, 5)])
+def test_native_depth(fused, depth_median_window):
+    # raw uint16 depth scaled at sampled pixels gives the same z as float64 depth scaled per frame
+    img, depth, _ = SyntheticCable(width=640, height=480, holes=0.05, depth_dtype=np.uint16,
+                                   seed=0).render()
+    spline_coords = {}
+    for native_depth in (False, True):
+        cable_observer = CableObserver()
+        cable_observer.set_parameters(**DEFAULT_PARAMETERS, fused=fused,
+                                      depth_median_window=depth_median_window,
+                                      native_depth=native_depth)
+        frame_depth = depth if native_depth else depth.astype(np.float64)
+        spline_coords[native_depth] = cable_observer.track(frame=img, depth=frame_depth)
+    assert len(spline_coords[True]) > 0 and spline_coords[True][2].mean() > 0.2
+    assert np.allclose(spline_coords[True], spline_coords[False], rtol=0.0, atol=1e-9)
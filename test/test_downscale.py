@@ -0,0 +1,57 @@
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+from cable_observer.benchmark import DEFAULT_PARAMETERS, spline_error
+from cable_observer.cable_observer import CableObserver
+from cable_observer.utils.synthetic import SyntheticCable
+
+
+@pytest.mark.parametrize("downscale, refine, max_error", [
+    (1, False, 0.5),
+    (2, False, 1.0),
+    (2, True, 0.5),
+])
+def test_downscale(downscale, refine, max_error):
+    cable_observer = CableObserver()
+    cable_observer.set_parameters(**DEFAULT_PARAMETERS, downscale=downscale, refine=refine)
+    cable = SyntheticCable(width=640, height=480, num_of_fragments=2, seed=0)
+    for img, depth, coords in cable.sequence(5):
+        spline_coords = cable_observer.track(frame=img, depth=depth)
+        assert spline_error(spline_coords=spline_coords, coords=coords) < max_error
+        assert np.abs(spline_coords[2] - coords[2].mean()).max() < 0.3, "Depth not sampled"
+
+
+@pytest.mark.parametrize("num_of_fragments", [1, 2, 3])
+def test_downscale_thin_cable(num_of_fragments):
+    # the cable is 2 pxs wide at 1/4 resolution
+    cable_observer = CableObserver()
+    cable_observer.set_parameters(**DEFAULT_PARAMETERS, downscale=4, refine=True)
+    cable = SyntheticCable(width=640, height=480, num_of_fragments=num_of_fragments,
+                           seed=num_of_fragments)
+    for img, depth, coords in cable.sequence(10):
+        spline_coords = cable_observer.track(frame=img, depth=depth)
+        assert spline_error(spline_coords=spline_coords, coords=coords) < 0.5
+
+
+def test_downscale_too_few_coords():
+    # a few sparse pixels of the cable are left, no spline instead of a failed fit
+    cable_observer = CableObserver()
+    cable_observer.set_parameters(**DEFAULT_PARAMETERS, downscale=4)
+    img, depth, _ = SyntheticCable(width=640, height=480, num_of_fragments=3, thickness=1,
+                                   seed=2).render()
+    spline_coords = cable_observer.track(frame=img, depth=depth)
+    assert cable_observer._dlo.num_of_fragments > 0
+    assert len(spline_coords) == 0 and "fit_spline" not in cable_observer.get_stamps()
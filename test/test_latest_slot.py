@@ -0,0 +1,31 @@
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from cable_observer.utils.latest_slot import LatestSlot
+
+
+def test_latest_slot():
+    slot = LatestSlot()
+    assert not slot.put(1)
+    assert slot.put(2), "Stale item was not dropped"
+    assert slot.get(timeout=0.1) == 2 and slot.dropped == 1
+    assert slot.get(timeout=0.01) is None
+
+    results = []
+    consumer = threading.Thread(target=lambda: results.append(slot.get()))
+    consumer.start()
+    slot.close()
+    consumer.join(timeout=1.0)
+    assert not consumer.is_alive() and results == [None], "Closing did not wake the consumer"
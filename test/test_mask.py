@@ -0,0 +1,87 @@
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numba
+import numpy as np
+import pytest
+from cable_observer.utils.frame_2d import Frame2D
+from cable_observer.utils.deformable_linear_object import DeformableLinearObject
+from cable_observer.utils.frame_3d import Frame3D
+from cable_observer.utils.synthetic import SyntheticCable
+
+HSV_RANGES = [170, 100, 100, 10, 255, 255]
+DEPTH_RANGES = [200, 900]
+
+
+@pytest.mark.parametrize("hsv_ranges", [
+    [20, 50, 50, 100, 200, 255],
+    [170, 100, 100, 10, 255, 255]  # hue wrap-around
+])
+def test_lut_mask(hsv_ranges):
+    img = np.random.default_rng(0).integers(0, 256, size=(120, 160, 3), dtype=np.uint8)
+    frame_hsv = Frame2D(hsv_ranges=hsv_ranges, mask_backend="hsv")
+    frame_lut = Frame2D(hsv_ranges=hsv_ranges, mask_backend="lut")
+    assert np.array_equal(frame_hsv.threshold(img), frame_lut.threshold(img)), \
+        "LUT mask differs from HSV mask"
+
+
+@pytest.mark.parametrize("window", [None, (40, 100, 570, 260), (300, 200, 40, 40)])
+def test_fused_mask_depth(window):
+    # windows: none, enclosing the cable (kept) and cut by the cable (full frame fallback)
+    img, depth, _ = SyntheticCable(width=640, height=480, holes=0.05, seed=0).render()
+    depth[:, :320] = np.where(depth[:, :320] > 0, 1000.0, 0.0)  # cable partly beyond the range
+    frames = {fused: Frame3D(hsv_ranges=HSV_RANGES, depth_ranges=DEPTH_RANGES, depth_scale=0.001,
+                             mask_backend="lut", fused=fused) for fused in (False, True)}
+    fused_window = frames[True].set_mask_depth(img=img, depth=depth, window=window)
+    assert fused_window == frames[False].set_mask(img=img, window=window)
+    frames[False].set_depth(depth=depth)
+    in_range = (depth >= DEPTH_RANGES[0]) & (depth <= DEPTH_RANGES[1])
+    assert np.array_equal(frames[True].mask, np.where(in_range, frames[False].mask, 0))
+    assert np.array_equal(frames[True].depth, frames[False].depth)
+
+
+def test_fused_num_threads_restored():
+    img, depth, _ = SyntheticCable(width=320, height=240, seed=0).render()
+    num_threads = numba.get_num_threads()
+    frame = Frame3D(hsv_ranges=HSV_RANGES, depth_ranges=DEPTH_RANGES, fused=True, num_threads=1)
+    frame.execute(img=img, depth=depth)
+    assert numba.get_num_threads() == num_threads
+
+
+@pytest.mark.parametrize("margin, roi_guard, is_kept", [
+    (15, 10, True),  # cable inside the window
+    (5, 10, False),  # cable within roi_guard of the window border
+    (-20, 1, False),  # cable leaves the window
+    (None, 1, False),  # cable outside of the window
+])
+def test_mask_window_fallback(margin, roi_guard, is_kept):
+    img, depth, _ = SyntheticCable(width=640, height=480, num_of_fragments=2, seed=0).render()
+    window = (0, 0, 40, 40)
+    if margin is not None:
+        ys, xs = np.nonzero(Frame2D(hsv_ranges=HSV_RANGES).threshold(img))
+        x, y = xs.min() - margin, ys.min() - margin
+        window = (x, y, xs.max() + margin + 1 - x, ys.max() + margin + 1 - y)
+
+    # the same spline as from the full frame, whether the window is kept or not
+    splines_coords = []
+    for frame_window in (None, window):
+        frame = Frame3D(hsv_ranges=HSV_RANGES, depth_ranges=DEPTH_RANGES, depth_scale=0.001,
+                        roi_guard=roi_guard)
+        frame.execute(img=img, depth=depth, window=frame_window)
+        assert frame.window == (frame_window if is_kept else None)
+        dlo = DeformableLinearObject()
+        dlo.execute(frame=frame)
+        splines_coords.append(dlo.spline_coords_3d)
+    assert splines_coords[0].shape == (3, 256)
+    assert np.array_equal(splines_coords[1], splines_coords[0])
@@ -0,0 +1,40 @@
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+from cable_observer.utils.metrics import Metrics, RollingHistogram
+
+
+def test_rolling_quantiles():
+    histogram = RollingHistogram(window=100)
+    for value in np.full(500, 100.0):
+        histogram.add(value)
+    for value in np.linspace(1.0, 10.0, 200):
+        histogram.add(value)
+    # older samples are forgotten, bins have 5% resolution
+    p50, p95, p99 = histogram.quantiles()
+    assert histogram.count <= 200
+    assert abs(p50 - 7.75) < 0.5 and abs(p99 - 10.0) < 0.5 and p50 < p95 <= p99
+
+
+def test_frame_counters():
+    metrics = Metrics(window=10)
+    for key in range(30):
+        metrics.record({"total": 5.0}, is_empty=key % 3 == 0, is_skeleton_empty=key % 6 == 0,
+                       timestamp=key * 0.1)
+    metrics.set_dropped_frames(4)
+    summary = metrics.summary()
+    assert summary["frames"] == 30 and summary["empty_frames"] == 10
+    assert summary["empty_skeleton_frames"] == 5 and summary["dropped_frames"] == 4
+    assert abs(summary["fps"] - 10.0) < 1e-6
@@ -0,0 +1,73 @@
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import numpy as np
+from cable_observer.cable_observer import CableObserver
+from cable_observer.utils.synthetic import BACKGROUND_BGR, SyntheticCable
+
+
+def render(cables):
+    img, depth, coords = cables[0].render()
+    ground_truth = [coords]
+    for cable in cables[1:]:
+        cable_img, cable_depth, coords = cable.render()
+        is_cable = np.any(cable_img != BACKGROUND_BGR, axis=-1)
+        img[is_cable] = cable_img[is_cable]
+        depth[is_cable] = cable_depth[is_cable]
+        ground_truth.append(coords)
+    for cable in cables:
+        cable.step()
+    return img, depth, ground_truth
+
+
+def test_crossing_cables_keep_ids():
+    # cables of seeds 0 and 1 cross each other, both have an occlusion gap
+    cables = [SyntheticCable(num_of_fragments=2, seed=seed) for seed in range(2)]
+    cable_observer = CableObserver()
+    cable_observer.set_parameters(hsv_ranges=[170, 100, 100, 10, 255, 255],
+                                  depth_ranges=[200, 900], num_of_cables=2)
+
+    instances = None
+    for _ in range(5):
+        img, depth, ground_truth = render(cables)
+        splines_coords = cable_observer.track(frame=img, depth=depth)
+        assert splines_coords.shape == (2, 3, 256)
+        assert np.array_equal(cable_observer.get_instances_ids(), [0, 1])
+
+        # every cable is followed by one spline, the same one in every frame
+        errors = np.array([[np.linalg.norm(spline_coords[:2, :, np.newaxis] -
+                                           coords[:2, np.newaxis, ::16], axis=0).min(axis=0).mean()
+                            for spline_coords in splines_coords] for coords in ground_truth])
+        assert np.all(errors.min(axis=1) < 2.0)
+        if instances is None:
+            instances = errors.argmin(axis=1)
+        assert np.array_equal(errors.argmin(axis=1), instances)
+        assert len(set(instances)) == 2
+
+
+def test_discarded_trackers_stop_threads():
+    cables = [SyntheticCable(num_of_fragments=2, seed=seed) for seed in range(2)]
+    cable_observer = CableObserver()
+    cable_observer.set_parameters(hsv_ranges=[170, 100, 100, 10, 255, 255],
+                                  depth_ranges=[200, 900], num_of_cables=2)
+    img, depth, _ = render(cables)
+    cable_observer.track(frame=img, depth=depth)
+    num_of_threads = threading.active_count()
+    for _ in range(3):
+        cable_observer.reset()
+        cable_observer.warmup()
+        cable_observer.track(frame=img, depth=depth)
+    assert threading.active_count() <= num_of_threads
@@ -14,8 +14,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import numpy as np
 import pytest
+from cable_observer.benchmark import DEFAULT_PARAMETERS
 from cable_observer.cable_observer import CableObserver
+from cable_observer.utils.synthetic import SyntheticCable
 
 
 @pytest.mark.parametrize("test_input, expected", [
@@ -25,3 +28,70 @@ def test_custom_param(test_input, expected):
     cable_observer = CableObserver()
     cable_observer.set_parameters(debug=test_input)
     assert cable_observer._debug == expected, "Wrong value after parametrization"
+
+
+def test_update_parameters():
+    cable_observer = CableObserver()
+    cable_observer.set_parameters(**DEFAULT_PARAMETERS, roi_tracking=True)
+    frames = SyntheticCable(num_of_fragments=2, seed=0).sequence(4)
+    img, depth, _ = next(frames)
+    cable_observer.track(frame=img, depth=depth)
+    frame3d, dlo = cable_observer._frame3d, cable_observer._dlo
+
+    changed = cable_observer.update_parameters(
+        hsv_ranges=[170, 90, 90, 10, 255, 255], mask_backend="lut", num_of_pts=128,
+        spline_fitter="batched", debug=False)
+    assert changed == ["hsv_ranges", "mask_backend", "num_of_pts", "spline_fitter"]
+    # applied in place, the previous spline is resampled and kept
+    assert cable_observer._frame3d is frame3d and cable_observer._dlo is dlo
+    assert dlo.spline_coords_3d.shape == (3, 128)
+    assert dlo.predict_window(shape=img.shape[:2], padding=50) is not None
+    img, depth, _ = next(frames)
+    assert cable_observer.track(frame=img, depth=depth).shape == (3, 128)
+
+    # invalid values leave all parameters unchanged
+    with pytest.raises(ValueError):
+        cable_observer.update_parameters(min_length=20, skeleton_backend="unknown")
+    assert cable_observer._min_length == 10 and dlo.min_length == 10
+
+    # min_length is forwarded, every path is filtered out
+    cable_observer.update_parameters(min_length=100000)
+    img, depth, _ = next(frames)
+    cable_observer.track(frame=img, depth=depth)
+    assert "fit_spline" not in cable_observer.get_stamps()
+
+    cable_observer.update_parameters(num_of_cables=2)
+    assert cable_observer._dlo is not dlo
+    assert np.array_equal(cable_observer.get_instances_ids(), [])
+
+
+@pytest.mark.parametrize("parameters", [
+    dict(downscale=3),
+    dict(mask_backend="unknown"),
+    dict(path_extractor="unknown"),
+    dict(spline_fitter="unknown"),
+    dict(depth_median_window=4),
+])
+def test_update_parameters_validation(monkeypatch, parameters):
+    cable_observer = CableObserver()
+    cable_observer.set_parameters(**DEFAULT_PARAMETERS, warmup=False)
+    frame3d, dlo = cable_observer._frame3d, cable_observer._dlo
+
+    def create_pipeline():
+        raise AssertionError("Pipeline built to validate parameters")
+
+    # parameters are validated without building a pipeline
+    monkeypatch.setattr(cable_observer, "create_pipeline", create_pipeline)
+    with pytest.raises(ValueError):
+        cable_observer.update_parameters(min_length=20, **parameters)
+    assert cable_observer._min_length == 10
+    assert cable_observer._frame3d is frame3d and cable_observer._dlo is dlo
+    assert cable_observer.update_parameters(min_length=20) == ["min_length"]
+
+
+def test_update_parameters_warmup():
+    cable_observer = CableObserver()
+    cable_observer.set_parameters(**DEFAULT_PARAMETERS, warmup=False)
+    assert cable_observer.get_warmup_time() == 0.0
+    assert cable_observer.update_parameters(warmup=True) == ["warmup"]
+    assert cable_observer.get_warmup_time() > 0.0
@@ -0,0 +1,46 @@
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from cable_observer.utils.quality_scheduler import QualityScheduler
+
+
+def run(scheduler, costs, num_of_frames):
+    levels = []
+    for _ in range(num_of_frames):
+        levels.append(scheduler.level)
+        scheduler.update(costs[scheduler.level])
+    return levels
+
+
+def test_degrade_and_restore():
+    scheduler = QualityScheduler(budget=10.0, num_of_levels=3, settle=1, patience=5)
+    levels = run(scheduler, costs=[20.0, 15.0, 8.0], num_of_frames=20)
+    assert levels[:3] == [0, 1, 2] and levels[-1] == 2, "Quality not lowered to fit the budget"
+
+    levels = run(scheduler, costs=[4.0, 3.0, 2.0], num_of_frames=40)
+    assert levels[-1] == 0, "Quality not restored with headroom"
+
+
+def test_backoff():
+    # level 0 never fits, every retry waits twice as long
+    scheduler = QualityScheduler(budget=10.0, num_of_levels=2, settle=1, patience=5)
+    levels = run(scheduler, costs=[20.0, 2.0], num_of_frames=100)
+    retries = [key for key in range(1, len(levels)) if levels[key] < levels[key - 1]]
+    gaps = [b - a for a, b in zip(retries, retries[1:])]
+    assert len(gaps) >= 2 and all(b > a for a, b in zip(gaps, gaps[1:])), "No backoff"
+
+
+def test_disabled():
+    scheduler = QualityScheduler(budget=0.0, num_of_levels=3)
+    assert run(scheduler, costs=[100.0, 50.0, 10.0], num_of_frames=10) == [0] * 10
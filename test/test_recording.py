@@ -0,0 +1,49 @@
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import numpy as np
+from cable_observer.benchmark import DEFAULT_PARAMETERS
+from cable_observer.cable_observer import CableObserver
+from cable_observer.recording import INDEX_DTYPE, RECORDING_INDEX, Recorder, Replay, replay
+from cable_observer.utils.synthetic import SyntheticCable
+
+
+def test_record_replay(tmp_path):
+    frames = list(SyntheticCable(num_of_fragments=2, depth_dtype=np.uint16,
+                                 seed=0).sequence(7))
+    recorder = Recorder(str(tmp_path), chunk_frames=3)
+    recorder.set_camera_info({"k": [500.0, 0.0, 320.0, 0.0, 500.0, 240.0, 0.0, 0.0, 1.0]})
+    for key, (img, depth, _) in enumerate(frames):
+        recorder.write(rgb=img, depth=depth, stamp=key * 33_000_000)
+    recorder.close()
+    # a partially written record is ignored
+    with open(os.path.join(tmp_path, RECORDING_INDEX), "ab") as f:
+        f.write(b"\0" * (INDEX_DTYPE.itemsize // 2))
+
+    recording = Replay(str(tmp_path))
+    assert len(recording) == 7 and recording.camera_info["k"][0] == 500.0
+    for (img, depth, _), (rgb_replay, depth_replay, stamp) in zip(frames, recording.frames()):
+        assert np.array_equal(img, rgb_replay) and np.array_equal(depth, depth_replay)
+        assert isinstance(rgb_replay.base, np.memmap) or isinstance(rgb_replay, np.memmap)
+
+    # replay is deterministic and equal to tracking of the original frames
+    parameters = DEFAULT_PARAMETERS | {"native_depth": True}
+    cable_observer = CableObserver()
+    cable_observer.set_parameters(**parameters)
+    expected = [cable_observer.track(frame=img, depth=depth).copy() for img, depth, _ in frames]
+    cable_observer.reset()
+    splines = list(replay(cable_observer, str(tmp_path), native_depth=True))
+    assert all(np.array_equal(a, b) for a, b in zip(expected, splines))
@@ -0,0 +1,205 @@
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Performance and accuracy regression tests against stored baselines (baselines/regression.json).
+
+Spline accuracy is compared with ground truth geometry (pxs and depth in mm) and the memory
+high-water mark of steady state tracking with the baseline. Per-stage p50 times are compared
+with the baseline scaled by a calibration workload measured on the same machine, only on
+request as they are noisy on shared machines:
+    CABLE_OBSERVER_CHECK_TIMINGS=1 python3 -m pytest test/test_regression.py
+After an intended change of performance or accuracy, baselines are updated with:
+    CABLE_OBSERVER_UPDATE_BASELINES=1 python3 -m pytest test/test_regression.py
+"""
+
+import json
+import os
+import tracemalloc
+from time import perf_counter
+
+import cv2
+import numpy as np
+import pytest
+from skimage.morphology import skeletonize
+from cable_observer.benchmark import (DEFAULT_PARAMETERS, depth_error, run_scenario,
+                                      spline_error, summarize)
+from cable_observer.cable_observer import CableObserver
+from cable_observer.recording import Recorder, replay
+from cable_observer.utils.synthetic import SyntheticCable
+
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), "baselines", "regression.json")
+UPDATE_BASELINES = os.environ.get("CABLE_OBSERVER_UPDATE_BASELINES", "") not in ("", "0")
+CHECK_TIMINGS = os.environ.get("CABLE_OBSERVER_CHECK_TIMINGS", "") not in ("", "0")
+TIME_TOLERANCE = 2.0  # of the scaled baseline, timings on shared machines are noisy
+TIME_SLACK = 0.5  # ms, sub-millisecond stages are dominated by jitter
+ERROR_TOLERANCE = (1.2, 0.05)  # of the baseline, pxs
+DEPTH_ERROR_TOLERANCE = (1.2, 1.0)  # of the baseline, mm
+MEMORY_TOLERANCE = (1.25, 1.0)  # of the baseline, MB
+NUM_OF_FRAMES = 30
+NUM_OF_WARMUP_FRAMES = 2
+
+SCENARIOS = {
+    "default_640x480": dict(width=640, height=480, num_of_fragments=2, noise=0.0,
+                            parameters={}),
+    "noisy_1280x720": dict(width=1280, height=720, num_of_fragments=4, noise=16.0,
+                           parameters={}),
+    "fast_1280x720": dict(width=1280, height=720, num_of_fragments=4, noise=0.0,
+                          parameters={"mask_backend": "lut", "skeleton_backend": "guo_hall",
+                                      "path_extractor": "graph", "spline_fitter": "batched",
+                                      "native_depth": True, "roi_tracking": True}),
+    "downscale_1920x1080": dict(width=1920, height=1080, num_of_fragments=2, noise=0.0,
+                                parameters={"downscale": 2, "refine": True}),
+}
+
+
+@pytest.fixture(scope="module")
+def baselines():
+    if not os.path.exists(BASELINES_PATH):
+        if not UPDATE_BASELINES:
+            pytest.skip(f"No baselines in {BASELINES_PATH}")
+        baselines = {}
+    else:
+        with open(BASELINES_PATH) as f:
+            baselines = json.load(f)
+    yield baselines
+    if UPDATE_BASELINES:
+        os.makedirs(os.path.dirname(BASELINES_PATH), exist_ok=True)
+        with open(BASELINES_PATH, "w") as f:
+            f.write(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+
+
+@pytest.fixture(scope="module", autouse=True)
+def kernels():
+    """
+    Numba kernels of all scenarios are compiled (or loaded from the on-disk cache) up front.
+    """
+    for parameters in [scenario["parameters"] for scenario in SCENARIOS.values()]:
+        cable_observer = CableObserver()
+        cable_observer.set_parameters(**(DEFAULT_PARAMETERS | parameters | {"warmup": True}))
+
+
+@pytest.fixture(scope="module")
+def calibration(baselines):
+    """
+    Median time [ms] of a fixed image processing workload, relative speed of the machine.
+    """
+    img = SyntheticCable(width=1280, height=720, noise=16.0, seed=0).render()[0]
+    skeletonize(np.ones((8, 8), dtype=bool))
+    samples = []
+    for _ in range(20):
+        t1 = perf_counter()
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        mask = cv2.inRange(hsv, (0, 100, 100), (10, 255, 255))
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((5, 5), dtype=np.uint8))
+        skeletonize(mask[:360, :640] > 0)
+        samples.append((perf_counter() - t1) * 1000)
+    calibration = float(np.median(samples))
+    if UPDATE_BASELINES:
+        baselines["calibration"] = calibration
+    return calibration
+
+
+def check(baselines, calibration, name, result):
+    measured = {
+        "stages": {stage: values["p50"] for stage, values in result["stages"].items()},
+        "error": result["error"]["mean"],
+        "depth_error": result["depth_error"]["mean"],
+    }
+    if UPDATE_BASELINES:
+        baselines[name] = measured
+        return
+
+    baseline = baselines[name]
+    for key, (ratio, slack) in (("error", ERROR_TOLERANCE),
+                                ("depth_error", DEPTH_ERROR_TOLERANCE)):
+        assert measured[key] <= ratio * baseline[key] + slack, \
+            f"{key} {measured[key]:.3f}, baseline {baseline[key]:.3f}"
+    if not CHECK_TIMINGS:
+        return
+
+    scale = calibration / baselines["calibration"]
+    for stage, time in baseline["stages"].items():
+        assert stage in measured["stages"], f"Stage '{stage}' is not measured"
+        budget = TIME_TOLERANCE * scale * time + TIME_SLACK
+        assert measured["stages"][stage] <= budget, \
+            f"Stage '{stage}' takes {measured['stages'][stage]:.2f} ms, budget {budget:.2f} ms"
+
+
+@pytest.mark.parametrize("name", SCENARIOS)
+def test_synthetic(baselines, calibration, name):
+    scenario = SCENARIOS[name]
+    result = run_scenario(
+        width=scenario["width"], height=scenario["height"],
+        num_of_fragments=scenario["num_of_fragments"], noise=scenario["noise"], holes=0.0,
+        num_of_frames=NUM_OF_FRAMES, num_of_warmup_frames=NUM_OF_WARMUP_FRAMES, seed=0,
+        parameters=DEFAULT_PARAMETERS | scenario["parameters"])
+    assert result["empty_frames"] == 0
+    check(baselines, calibration, name, result)
+
+
+def test_recorded(baselines, calibration, tmp_path):
+    # 16UC1 depth as received by the node, replayed from memory-mapped chunks
+    cable = SyntheticCable(width=1280, height=720, num_of_fragments=2, noise=8.0,
+                           depth_dtype=np.uint16, seed=1)
+    recorder = Recorder(str(tmp_path), chunk_frames=16)
+    coords = []
+    for key, (img, depth, frame_coords) in enumerate(
+            cable.sequence(NUM_OF_WARMUP_FRAMES + NUM_OF_FRAMES)):
+        recorder.write(rgb=img, depth=depth, stamp=key * 33_000_000)
+        coords.append(frame_coords)
+    recorder.close()
+
+    cable_observer = CableObserver()
+    cable_observer.set_parameters(**DEFAULT_PARAMETERS, native_depth=True)
+    stages, errors, depth_errors = {}, [], []
+    for key, spline_coords in enumerate(replay(cable_observer, str(tmp_path), native_depth=True)):
+        if key < NUM_OF_WARMUP_FRAMES:
+            continue
+        assert "fit_spline" in cable_observer.get_stamps()
+        for stage, value in cable_observer.get_stamps().items():
+            stages.setdefault(stage, []).append(value)
+        errors.append(spline_error(spline_coords=spline_coords, coords=coords[key]))
+        depth_errors.append(depth_error(spline_coords=spline_coords, coords=coords[key]) * 1000)
+
+    result = {"stages": {stage: summarize(values) for stage, values in stages.items()},
+              "error": summarize(errors), "depth_error": summarize(depth_errors)}
+    check(baselines, calibration, "recorded_1280x720", result)
+
+
+def test_memory(baselines):
+    cable_observer = CableObserver()
+    cable_observer.set_parameters(**DEFAULT_PARAMETERS)
+    frames = list(SyntheticCable(width=1280, height=720, num_of_fragments=4,
+                                 seed=0).sequence(NUM_OF_WARMUP_FRAMES + 10))
+    for img, depth, _ in frames[:NUM_OF_WARMUP_FRAMES]:
+        cable_observer.track(frame=img, depth=depth)
+
+    # numpy buffers are traced, numba runtime allocations are not
+    tracemalloc.start()
+    try:
+        for img, depth, _ in frames[NUM_OF_WARMUP_FRAMES:]:
+            cable_observer.track(frame=img, depth=depth)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    peak = peak / 2 ** 20
+    if UPDATE_BASELINES:
+        baselines["memory_1280x720"] = peak
+        return
+    ratio, slack = MEMORY_TOLERANCE
+    baseline = baselines["memory_1280x720"]
+    assert peak <= ratio * baseline + slack, f"Peak {peak:.1f} MB, baseline {baseline:.1f} MB"
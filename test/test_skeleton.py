@@ -0,0 +1,84 @@
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import cv2
+import numpy as np
+import pytest
+from cable_observer.utils.deformable_linear_object import DeformableLinearObject
+from cable_observer.utils.frame_2d import Frame2D
+from cable_observer.utils.skeleton_graph import SkeletonGraph
+from cable_observer.utils.synthetic import SyntheticCable
+
+HSV_RANGES = [170, 100, 100, 10, 255, 255]
+
+
+@pytest.mark.parametrize("num_of_fragments, noise", [
+    (1, 0.0),
+    (4, 8.0),
+    (8, 16.0)
+])
+def test_skeleton_topology(num_of_fragments, noise):
+    cable = SyntheticCable(num_of_fragments=num_of_fragments, noise=noise, seed=5)
+    frame_lee = Frame2D(hsv_ranges=HSV_RANGES, skeleton_backend="lee")
+    frame_guo_hall = Frame2D(hsv_ranges=HSV_RANGES, skeleton_backend="guo_hall")
+    for img, _, _ in cable.sequence(5):
+        frame_lee.execute(img=img)
+        frame_guo_hall.execute(img=img)
+
+        num_of_components_lee, _ = cv2.connectedComponents(frame_lee.skeleton, connectivity=8)
+        num_of_components, _ = cv2.connectedComponents(frame_guo_hall.skeleton, connectivity=8)
+        assert num_of_components == num_of_components_lee, "Different number of branches"
+        assert frame_guo_hall.ends_idxs.shape == frame_lee.ends_idxs.shape, \
+            "Different number of ends"
+
+        # every skeleton pixel lies close to the reference skeleton
+        dists = cv2.distanceTransform(1 - frame_lee.skeleton, cv2.DIST_L2, 3)
+        assert dists[frame_guo_hall.skeleton > 0].max() <= 3.0, "Skeleton too far from reference"
+
+
+def test_skeleton_graph():
+    skeleton_pad = np.zeros((16, 32), dtype=np.uint8)
+    skeleton_pad[5 + 1, 2 + 1:12 + 1 + 1] = 1  # horizontal branch
+    skeleton_pad[6 + 1:12 + 1 + 1, 7 + 1] = 1  # vertical branch from the junction at (7, 5)
+    for x, y in [(20, 2), (21, 3), (22, 4), (21, 5), (20, 6), (19, 5), (18, 4), (19, 3)]:
+        skeleton_pad[y + 1, x + 1] = 1  # closed loop
+    graph = SkeletonGraph()
+    graph.execute(skeleton_pad=skeleton_pad, roi=(0, 0, 30, 14))
+
+    assert sorted(map(tuple, graph.nodes_coords[graph.nodes_degrees == 1])) == \
+        [(2, 5), (7, 12), (12, 5)], "Wrong endpoints"
+    assert list(map(tuple, graph.nodes_coords[graph.nodes_degrees == 3])) == [(7, 5)], \
+        "Wrong junction"
+    assert sorted(graph.edges_lengths[:3]) == [4.0, 4.0, 6.0], "Wrong branch lengths"
+    assert (graph.edges_nodes[:3] >= 0).all() and (graph.edges_nodes[3] == -1).all(), \
+        "Wrong edge nodes"
+    assert graph.edges_offsets[4] - graph.edges_offsets[3] == 8, "Wrong loop length"
+
+
+@pytest.mark.parametrize("skeleton_backend", ["lee", "guo_hall"])
+def test_skeleton_graph_junctions(skeleton_backend):
+    # the centre of the crossing has 4 neighbours and is pruned from `skeleton`,
+    # the graph gets the unpruned skeleton and splits the crossing at a single junction
+    img = np.zeros((120, 160, 3), dtype=np.uint8)
+    cv2.line(img, (20, 60), (140, 60), (0, 0, 200), 5)
+    cv2.line(img, (80, 10), (80, 110), (0, 0, 200), 5)
+    frame = Frame2D(hsv_ranges=HSV_RANGES, skeleton_backend=skeleton_backend)
+    frame.execute(img=img)
+    dlo = DeformableLinearObject(path_extractor="graph")
+    _, _, paths_lengths_2d = dlo.generate_paths(frame=frame)
+
+    assert sorted(dlo.graph.nodes_degrees) == [1, 1, 1, 1, 4], "Crossing not split"
+    junction_id = np.argmax(dlo.graph.nodes_degrees)
+    assert (dlo.graph.edges_nodes == junction_id).any(axis=1).all(), "Wrong edge nodes"
+    assert len(paths_lengths_2d) == 4 and paths_lengths_2d.min() > 40, "Wrong arms"
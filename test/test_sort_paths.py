@@ -0,0 +1,70 @@
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+from numba.core import types
+from numba.typed import Dict, List
+from cable_observer.cable_observer import CableObserver
+from cable_observer.utils.deformable_linear_object import DeformableLinearObject
+from cable_observer.utils.synthetic import SyntheticCable
+
+
+def find_order(dlo, be, be_dirs, sparse):
+    m = 0.05
+    n = len(be) // 2
+    conn = List.empty_list(types.int64[:])
+    skips = Dict.empty(key_type=types.int64, value_type=types.int64)
+    stats = Dict.empty(key_type=types.int64, value_type=types.int64)
+    for i in range(n):
+        stats[i] = 0
+    if sparse:
+        dlo.find_order_of_paths_sparse(conn=conn, skips=skips, stats=stats, be=be,
+                                       be_dirs=be_dirs, len_paths_coords_2d=n, m=m)
+    else:
+        dists = np.linalg.norm(be[np.newaxis] - be[:, np.newaxis], axis=-1)
+        dists_dirs = np.abs(np.pi - np.abs(be_dirs[np.newaxis] - be_dirs[:, np.newaxis]))
+        dists = m * dists + (1 - m) * dists_dirs
+        dists[np.arange(2 * n), (np.arange(2 * n) + n) % (2 * n)] = 1e10
+        dists[np.arange(2 * n), np.arange(2 * n)] = 1e10
+        dlo.find_order_of_paths(conn=conn, skips=skips, stats=stats, dists=dists,
+                                len_paths_coords_2d=n)
+    return [tuple(c) for c in conn], dict(skips)
+
+
+@pytest.mark.parametrize("num_of_paths, scale, decimals", [
+    (5, 100, 1),
+    (60, 640, 3),
+    (200, 1920, 0),  # many ties of directions
+])
+def test_sparse_order(num_of_paths, scale, decimals):
+    rng = np.random.default_rng(num_of_paths)
+    dlo = DeformableLinearObject()
+    be = np.round(rng.random((2 * num_of_paths, 2)) * scale)
+    be_dirs = np.round(rng.uniform(-np.pi, np.pi, 2 * num_of_paths), decimals)
+    assert find_order(dlo, be, be_dirs, sparse=True) == \
+        find_order(dlo, be, be_dirs, sparse=False), "Sparse ordering differs from dense one"
+
+
+def test_incremental_order():
+    splines = {}
+    for incremental_order in [False, True]:
+        cable_observer = CableObserver()
+        cable_observer.set_parameters(hsv_ranges=[170, 100, 100, 10, 255, 255],
+                                      depth_ranges=[200, 900],
+                                      incremental_order=incremental_order)
+        cable = SyntheticCable(num_of_fragments=4, seed=5)
+        splines[incremental_order] = np.array([cable_observer.track(frame=img, depth=depth)
+                                               for img, depth, _ in cable.sequence(10)])
+    assert np.array_equal(splines[True], splines[False]), "Reused order differs from full one"
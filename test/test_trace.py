@@ -0,0 +1,50 @@
+# Copyright 2023 Perception for Physical Interaction Laboratory at Poznan University of Technology
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+
+from cable_observer.utils.trace import TraceRecorder
+
+
+STAMPS = {"mask": 1.0, "skeleton": 2.0, "generate_paths": 0.5, "fit_spline": 1.5, "total": 5.0}
+DLO_STAGES = {"generate_paths": 0.5, "fit_spline": 1.5}
+
+
+def test_ring_buffer_dump(tmp_path):
+    recorder = TraceRecorder(capacity=3)
+    for key in range(5):
+        recorder.record(start=key * 0.1, stamps=STAMPS, dlo_stages=DLO_STAGES,
+                        metadata={"fragments": key})
+    events = json.load(open(recorder.dump(os.path.join(tmp_path, "trace.json"))))["traceEvents"]
+
+    frames = [event for event in events if event.get("cat") == "frame"]
+    assert [event["args"]["frame"] for event in frames] == [2, 3, 4], "Ring buffer not bounded"
+    assert frames[0]["args"]["fragments"] == 2
+
+    # stages follow each other from the frame start
+    spans = [event for event in events if event.get("cat") in ("frame3d", "dlo")][:4]
+    assert [event["cat"] for event in spans] == ["frame3d", "frame3d", "dlo", "dlo"]
+    assert spans[0]["ts"] == frames[0]["ts"]
+    assert abs(spans[3]["ts"] - (spans[0]["ts"] + 3500.0)) < 1e-6
+
+
+def test_threshold_dump(tmp_path):
+    recorder = TraceRecorder(capacity=4, threshold=4.0, directory=str(tmp_path))
+    paths = [recorder.record(start=key * 0.1, stamps=STAMPS, dlo_stages=DLO_STAGES, metadata={})
+             for key in range(6)]
+    recorder.join()
+    # at most one dump per buffer length
+    assert paths[0] is not None and paths[1:4] == [None] * 3 and paths[4] is not None
+    assert all(os.path.exists(path) for path in paths if path is not None)